@@ -0,0 +1,560 @@
+"""Batch mode: run many commands of a tool in a single process
+
+Scripts list one command per line, as given on the command line after the
+name of the tool (a leading "git cl", "git-cl" or "gerrit-accounts" is
+ignored). Blank lines and lines starting with # are skipped:
+
+    # Independent commands run concurrently
+    show 1234
+    show 1235
+
+    # Commands after a "wait" line start once all previous commands have
+    # succeeded (the rest of the script is skipped otherwise)
+    wait
+    submit 1234
+
+Scripts may also be given as a JSON plan: an array of commands, each either
+a command line or an array of arguments, and "wait" barriers:
+
+    [["show", "1234"], "show 1235", "wait", "submit 1234"]
+
+All commands share the process: the configuration is loaded once and the
+connections to Gerrit are reused. The output of each command is captured and
+reported, in the order of the script, with its exit status. With --format,
+the output of the commands is collected as records and one record is written
+per command.
+"""
+
+import argparse
+import getpass
+import itertools
+import json
+import logging
+import shlex
+import sys
+import threading
+
+from collections import OrderedDict
+from StringIO import StringIO
+
+from libpycr.editor import run_editor
+from libpycr.exceptions import PyCRError
+from libpycr.utils import records
+from libpycr.utils.introspect import get_all_subclasses
+from libpycr.utils.parallel import DEFAULT_WORKERS, imap
+from libpycr.utils.system import (fail, format_message, get_console,
+                                  read_stdin, set_console, ThreadLocalStream)
+
+
+# Script line separating dependent groups of commands
+BARRIER = 'wait'
+
+# Logger
+log = logging.getLogger(__name__)
+
+
+class Command(object):
+    """A command of a batch script, and the outcome of its execution"""
+
+    def __init__(self, line, argv):
+        """Constructor
+
+        :param line: the line number of the command in the script (or its
+            position in the JSON plan)
+        :type line: int
+        :param argv: the command and its arguments
+        :type argv: list[str]
+        """
+
+        self.line = line
+        self.argv = argv
+
+        # Exit status (None if not run), standard output and error output
+        self.status = None
+        self.output = ''
+        self.errors = ''
+
+    def __str__(self):
+        return ' '.join(self.argv)
+
+
+def strip_prefix(argv, prefixes):
+    """Remove the name of the tool from the start of ARGV, if present
+
+    :param argv: the command and its arguments
+    :type argv: list[str]
+    :param prefixes: the possible names of the tool
+    :type prefixes: collections.iterable[tuple[str]]
+    :rtype: list[str]
+    """
+
+    for prefix in prefixes:
+        if tuple(argv[:len(prefix)]) == prefix and len(argv) > len(prefix):
+            return argv[len(prefix):]
+
+    return argv
+
+
+def parse_lines(script):
+    """Parse a script of newline-delimited commands
+
+    Yields a tuple (line number, argv) per command, where argv is None for
+    barriers.
+
+    :param script: the content of the script
+    :type script: str
+    :rtype: collections.iterable[(int, list[str] | None)]
+    :raise: PyCRError if a line cannot be parsed
+    """
+
+    for number, line in enumerate(script.splitlines(), 1):
+        line = line.strip()
+
+        if not line or line.startswith('#'):
+            continue
+
+        try:
+            argv = shlex.split(line)
+        except ValueError as why:
+            raise PyCRError('line {}: invalid command'.format(number), why)
+
+        yield number, None if argv == [BARRIER] else argv
+
+
+def parse_plan(script):
+    """Parse a JSON plan
+
+    Yields a tuple (position, argv) per command, where argv is None for
+    barriers.
+
+    :param script: the content of the script
+    :type script: str
+    :rtype: collections.iterable[(int, list[str] | None)]
+    :raise: PyCRError if the plan is invalid
+    """
+
+    try:
+        plan = json.loads(script)
+    except ValueError as why:
+        raise PyCRError('invalid JSON plan', why)
+
+    if not isinstance(plan, list):
+        raise PyCRError('invalid JSON plan: expected an array')
+
+    for number, step in enumerate(plan, 1):
+        if isinstance(step, basestring):
+            try:
+                argv = shlex.split(step.encode('utf-8'))
+            except ValueError as why:
+                raise PyCRError('step {}: invalid command'.format(number), why)
+
+        elif (isinstance(step, list) and
+              all(isinstance(a, basestring) for a in step)):
+            argv = [a.encode('utf-8') for a in step]
+
+        else:
+            raise PyCRError('step {}: expected a string or an array of '
+                            'strings'.format(number))
+
+        if not argv:
+            continue
+
+        yield number, None if argv == [BARRIER] else argv
+
+
+def parse_script(script, prefixes=()):
+    """Parse a batch script into groups of independent commands
+
+    SCRIPT is parsed as a JSON plan if it starts with "[", and as
+    newline-delimited commands otherwise.
+
+    :param script: the content of the script
+    :type script: str
+    :param prefixes: the possible names of the tool, to strip from commands
+    :type prefixes: collections.iterable[tuple[str]]
+    :rtype: list[list[Command]]
+    :raise: PyCRError if the script cannot be parsed
+    """
+
+    parse = parse_plan if script.lstrip().startswith('[') else parse_lines
+    groups = [[]]
+
+    for number, argv in parse(script):
+        if argv is None:
+            if groups[-1]:
+                groups.append([])
+            continue
+
+        groups[-1].append(Command(number, strip_prefix(argv, prefixes)))
+
+    return [group for group in groups if group]
+
+
+class BatchConsole(object):
+    """Console of the commands run by a batch
+
+    Prompts are delegated to the console of the batch, one at a time. The
+    output of the commands is captured: it is never paged.
+
+    See libpycr.utils.system.set_console.
+    """
+
+    def __init__(self, console, stream):
+        """Constructor
+
+        :param console: the console of the batch, if any
+        :type console: object | None
+        :param stream: the stream to display the prompts on if CONSOLE is None
+        :type stream: file
+        """
+
+        self._console = console
+        self._stream = stream
+        self._lock = threading.Lock()
+
+    def read_input(self, prompt):
+        """Read a line of user input
+
+        :param prompt: the prompt to display
+        :type prompt: str
+        :rtype: str
+        :raise: EOFError if the standard input is exhausted
+        """
+
+        with self._lock:
+            if self._console is not None:
+                return self._console.read_input(prompt)
+
+            self._stream.write(prompt)
+            self._stream.flush()
+
+            # The script may have been read from the standard input
+            line = sys.stdin.readline()
+
+            if not line:
+                raise EOFError()
+
+            return line.rstrip('\n')
+
+    def read_password(self, prompt):
+        """Read a password without echoing it
+
+        :param prompt: the prompt to display
+        :type prompt: str
+        :rtype: str
+        """
+
+        with self._lock:
+            if self._console is not None:
+                return self._console.read_password(prompt)
+
+            return getpass.getpass(prompt)
+
+    def edit(self, editor, default):
+        """Fire EDITOR and return the resulting content
+
+        :param editor: the editor to use
+        :type editor: str
+        :param default: the initital content of the editor
+        :type default: str | None
+        :rtype: str
+        """
+
+        with self._lock:
+            if self._console is not None:
+                return self._console.edit(editor, default)
+
+            return run_editor(editor, default)
+
+    def start_pager(self, pager):
+        """Do not page the output of the commands
+
+        :param pager: the pager command
+        :type pager: str
+        """
+
+        pass
+
+    def stop_pager(self):
+        """Do not page the output of the commands"""
+
+        pass
+
+
+class Batch(object):
+    """Run the commands of a batch script"""
+
+    def __init__(self, builtin_type, prefixes=(), workers=DEFAULT_WORKERS):
+        """Constructor
+
+        :param builtin_type: the type of Builtin to look for
+        :type builtin_type: Builtin
+        :param prefixes: the possible names of the tool, to strip from
+            commands
+        :type prefixes: collections.iterable[tuple[str]]
+        :param workers: the maximum number of concurrent commands
+        :type workers: int
+        """
+
+        self.prefixes = prefixes
+        self.workers = workers
+
+        # Command name -> builtin class (batches do not nest)
+        self.builtins = {}
+
+        for builtin_class in get_all_subclasses(builtin_type):
+            name = builtin_class().name
+
+            if name != 'batch':
+                self.builtins[name] = builtin_class
+
+        self._stdout = None
+        self._stderr = None
+        self._console = None
+
+    def execute(self, command):
+        """Run COMMAND, capturing its output and exit status
+
+        :param command: the command to run
+        :type command: Command
+        :rtype: Command
+        """
+
+        stdout, stderr = StringIO(), StringIO()
+        console = get_console()
+
+        self._stdout.redirect(stdout)
+        self._stderr.redirect(stderr)
+        set_console(self._console)
+
+        try:
+            builtin_class = self.builtins.get(command.argv[0])
+
+            if builtin_class is None:
+                raise PyCRError('unknown command: {}'.format(command.argv[0]))
+
+            builtin_class().run(command.argv[1:])
+            command.status = 0
+
+        except SystemExit as why:
+            if why.code is None or isinstance(why.code, int):
+                command.status = why.code or 0
+            else:
+                print >> stderr, why.code
+                command.status = 1
+
+        except PyCRError as why:
+            print >> stderr, format_message(str(why), prefix='fatal')
+            command.status = 1
+
+        except Exception as why:  # pylint: disable=broad-except
+            log.debug('%s failed', command, exc_info=True)
+            print >> stderr, format_message(
+                '{}: {}'.format(type(why).__name__, why), prefix='fatal')
+            command.status = 1
+
+        finally:
+            set_console(console)
+            self._stdout.redirect(None)
+            self._stderr.redirect(None)
+
+        command.output = stdout.getvalue()
+        command.errors = stderr.getvalue()
+
+        return command
+
+    def iter_results(self, groups):
+        """Run the groups of commands one after the other
+
+        Yields the commands as they complete, in the order of the script.
+        Commands of a group run concurrently. The groups following a failed
+        command are skipped: their commands are yielded without status, as
+        are the commands not started before the deadline (see
+        libpycr.deadline).
+
+        :param groups: the groups of independent commands
+        :type groups: list[list[Command]]
+        :rtype: collections.iterable[Command]
+        """
+
+        failed = False
+
+        for group in groups:
+            if failed:
+                for command in group:
+                    yield command
+                continue
+
+            results = imap(self.execute, group, self.workers)
+
+            for command, (_, error) in itertools.izip(group, results):
+                if error is not None:
+                    command.errors = format_message(str(error),
+                                                    prefix='fatal') + '\n'
+
+                failed = failed or command.status != 0
+                yield command
+
+    def run(self, groups):
+        """Run the groups of commands and report their outcome
+
+        Returns True if all commands succeeded.
+
+        :param groups: the groups of independent commands
+        :type groups: list[list[Command]]
+        :rtype: bool
+        """
+
+        stdout, stderr = sys.stdout, sys.stderr
+
+        # Commands are run in worker threads: capture their output per thread
+        self._stdout = sys.stdout = ThreadLocalStream(stdout)
+        self._stderr = sys.stderr = ThreadLocalStream(stderr)
+        self._console = BatchConsole(get_console(), stderr)
+
+        # Collect the records of the commands one per line (see report_record)
+        output_format = records.get_format()
+
+        if records.is_enabled():
+            records.set_format('ndjson')
+
+        try:
+            results = self.iter_results(groups)
+
+            if output_format == records.TEXT:
+                return all([report(command, stdout, stderr)
+                            for command in results])
+
+            with records.WRITERS[output_format](stdout) as writer:
+                return all([report_record(command, writer)
+                            for command in results])
+
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+            records.set_format(output_format)
+
+
+def report(command, stdout, stderr):
+    """Write the outcome of COMMAND as text
+
+    Returns True if the command succeeded.
+
+    :param command: the command
+    :type command: Command
+    :param stdout: the stream to write the output of the command to
+    :type stdout: file
+    :param stderr: the stream to write the errors of the command to
+    :type stderr: file
+    :rtype: bool
+    """
+
+    status = ('skipped' if command.status is None else
+              'exit status {}'.format(command.status))
+
+    stdout.write('==> line {}: {} ({}) <==\n'.format(command.line, command,
+                                                     status))
+    stdout.write(command.output)
+    stdout.flush()
+
+    if command.errors:
+        stderr.write(command.errors)
+        stderr.flush()
+
+    return command.status == 0
+
+
+def report_record(command, writer):
+    """Write the outcome of COMMAND as a record
+
+    The output of the command is written one record per line: the lines that
+    are not records are reported as is.
+
+    Returns True if the command succeeded.
+
+    :param command: the command
+    :type command: Command
+    :param writer: the record writer
+    :type writer: RecordWriter
+    :rtype: bool
+    """
+
+    results, output = [], []
+
+    for line in command.output.splitlines():
+        try:
+            results.append(json.loads(line, object_pairs_hook=OrderedDict))
+        except ValueError:
+            output.append(line)
+
+    writer.write(OrderedDict([
+        ('line', command.line), ('command', command.argv),
+        ('status', command.status), ('records', results),
+        ('output', '\n'.join(output)), ('errors', command.errors)]))
+    writer.stream.flush()
+
+    return command.status == 0
+
+
+class BatchBuiltin(object):
+    """Implement the BATCH command of a tool
+
+    Mix with the Builtin type of the tool.
+    """
+
+    # The type of Builtin of the commands of the script
+    builtin_type = None
+
+    # Names of the tool that may start the commands of the script
+    prefixes = ()
+
+    @property
+    def description(self):
+        return 'run a script of commands in a single process'
+
+    @staticmethod
+    def parse_command_line(arguments):
+        """Parse the BATCH command command-line arguments
+
+        Returns a tuple with the script file name and the maximum number of
+        concurrent commands.
+
+        :param arguments: a list of command-line arguments to parse
+        :type arguments: list[str]
+        :rtype: str, int
+        """
+
+        parser = argparse.ArgumentParser(
+            description='Run a script of commands in a single process')
+        parser.add_argument(
+            'script', nargs='?', default='-',
+            help='the script: one command per line, or a JSON plan '
+                 '(default: the standard input)')
+        parser.add_argument(
+            '-j', '--jobs', type=int, default=DEFAULT_WORKERS,
+            help='the maximum number of concurrent commands '
+                 '(default: %(default)s)')
+
+        cmdline = parser.parse_args(arguments)
+
+        return cmdline.script, cmdline.jobs
+
+    def run(self, arguments, *args, **kwargs):
+        script, jobs = self.parse_command_line(arguments)
+
+        try:
+            if script == '-':
+                content = read_stdin()
+            else:
+                with open(script) as script_file:
+                    content = script_file.read()
+
+        except IOError as why:
+            fail('cannot read script', why)
+
+        try:
+            groups = parse_script(content, self.prefixes)
+        except PyCRError as why:
+            fail('invalid script', why)
+
+        if not Batch(self.builtin_type, self.prefixes, jobs).run(groups):
+            sys.exit(1)
@@ -0,0 +1,11 @@
+"""Run many commands in a single process"""
+
+from libpycr.batch import BatchBuiltin
+from libpycr.meta import GerritAccountBuiltin
+
+
+class Batch(BatchBuiltin, GerritAccountBuiltin):
+    """Implement the BATCH command"""
+
+    builtin_type = GerritAccountBuiltin
+    prefixes = (('gerrit-accounts',),)
@@ -9,12 +9,11 @@ from libpycr.exceptions import PyCRError
 from libpycr.gerrit.client import Gerrit
 from libpycr.meta import GerritAccountBuiltin
 from libpycr.pager import Pager
+from libpycr.utils import records
 from libpycr.utils.commandline import expect_account_as_positional
-from libpycr.utils.output import checkmark
+from libpycr.utils.output import checkmark, Table
 from libpycr.utils.system import fail
 
-from prettytable import PrettyTable
-
 
 class LsCapabilities(GerritAccountBuiltin):
     """Implement the LS-CAPABILITIES command"""
@@ -61,29 +60,31 @@ class LsCapabilities(GerritAccountBuiltin):
         except PyCRError as why:
             fail('cannot list account capabilities', why)
 
-        table = PrettyTable(['Capability', 'Value'])
-        table.align['Capability'] = 'l'
-        table.align['Value'] = 'c'
-
-        table.add_row(['Administrate server',
-                       checkmark(capabilities.administrate_server)])
-        table.add_row(['Min Query limit', capabilities.query_limit.min])
-        table.add_row(['Max Query limit', capabilities.query_limit.max])
-        table.add_row(['Create account',
-                       checkmark(capabilities.create_account)])
-        table.add_row(['Create group', checkmark(capabilities.create_group)])
-        table.add_row(['Create project',
-                       checkmark(capabilities.create_project)])
-        table.add_row(['Email reviewers',
-                       checkmark(capabilities.email_reviewers)])
-        table.add_row(['Kill task', checkmark(capabilities.kill_task)])
-        table.add_row(['View caches', checkmark(capabilities.view_caches)])
-        table.add_row(['Flush caches', checkmark(capabilities.flush_caches)])
-        table.add_row(['View connections',
-                       checkmark(capabilities.view_connections)])
-        table.add_row(['View queue', checkmark(capabilities.view_queue)])
-        table.add_row(['Run GC', checkmark(capabilities.run_gc)])
+        if records.is_enabled():
+            records.write_all([records.merge(
+                (('account', account.username),), capabilities)])
+            return
+
+        table = Table(['Capability', 'Value'],
+                      align={'Capability': Table.LEFT})
+
+        rows = (
+            ['Administrate server',
+             checkmark(capabilities.administrate_server)],
+            ['Min Query limit', capabilities.query_limit.min],
+            ['Max Query limit', capabilities.query_limit.max],
+            ['Create account', checkmark(capabilities.create_account)],
+            ['Create group', checkmark(capabilities.create_group)],
+            ['Create project', checkmark(capabilities.create_project)],
+            ['Email reviewers', checkmark(capabilities.email_reviewers)],
+            ['Kill task', checkmark(capabilities.kill_task)],
+            ['View caches', checkmark(capabilities.view_caches)],
+            ['Flush caches', checkmark(capabilities.flush_caches)],
+            ['View connections', checkmark(capabilities.view_connections)],
+            ['View queue', checkmark(capabilities.view_queue)],
+            ['Run GC', checkmark(capabilities.run_gc)],
+        )
 
         with Pager(command=self.name):
             print 'Account: {}'.format(account.username)
-            print table
+            table.write(rows)
@@ -9,12 +9,11 @@ from libpycr.exceptions import PyCRError
 from libpycr.gerrit.client import Gerrit
 from libpycr.meta import GerritAccountBuiltin
 from libpycr.pager import Pager
+from libpycr.utils import records
 from libpycr.utils.commandline import expect_account_as_positional
-from libpycr.utils.output import checkmark
+from libpycr.utils.output import checkmark, Table
 from libpycr.utils.system import fail
 
-from prettytable import PrettyTable
-
 
 class LsDiffPrefs(GerritAccountBuiltin):
     """Implement the LS-DIFF-PREFS command"""
@@ -61,30 +60,32 @@ class LsDiffPrefs(GerritAccountBuiltin):
         except PyCRError as why:
             fail('cannot list account diff preferences', why)
 
-        table = PrettyTable(['Preference', 'Value'])
-        table.align['Preference'] = 'l'
-        table.align['Value'] = 'c'
-
-        table.add_row(['Context', prefs.context])
-        table.add_row(['Expand all comments',
-                       checkmark(prefs.expand_all_comments)])
-        table.add_row(['Ignore whitespace', prefs.ignore_whitespace])
-        table.add_row(['Intraline difference',
-                       checkmark(prefs.intraline_difference)])
-        table.add_row(['Line length', prefs.line_length])
-        table.add_row(['Manual review', checkmark(prefs.manual_review)])
-        table.add_row(['Retain header', checkmark(prefs.retain_header)])
-        table.add_row(['Show line endings',
-                       checkmark(prefs.show_line_endings)])
-        table.add_row(['Show tabs', checkmark(prefs.show_tabs)])
-        table.add_row(['Show whitespace errors',
-                       checkmark(prefs.show_whitespace_errors)])
-        table.add_row(['Skip deleted', checkmark(prefs.skip_deleted)])
-        table.add_row(['Skip uncommented', checkmark(prefs.skip_uncommented)])
-        table.add_row(['Syntax highlighting',
-                       checkmark(prefs.syntax_highlighting)])
-        table.add_row(['Tab size', prefs.tab_size])
+        if records.is_enabled():
+            records.write_all([records.merge(
+                (('account', account.username),), prefs)])
+            return
+
+        table = Table(['Preference', 'Value'],
+                      align={'Preference': Table.LEFT})
+
+        rows = (
+            ['Context', prefs.context],
+            ['Expand all comments', checkmark(prefs.expand_all_comments)],
+            ['Ignore whitespace', prefs.ignore_whitespace],
+            ['Intraline difference', checkmark(prefs.intraline_difference)],
+            ['Line length', prefs.line_length],
+            ['Manual review', checkmark(prefs.manual_review)],
+            ['Retain header', checkmark(prefs.retain_header)],
+            ['Show line endings', checkmark(prefs.show_line_endings)],
+            ['Show tabs', checkmark(prefs.show_tabs)],
+            ['Show whitespace errors',
+             checkmark(prefs.show_whitespace_errors)],
+            ['Skip deleted', checkmark(prefs.skip_deleted)],
+            ['Skip uncommented', checkmark(prefs.skip_uncommented)],
+            ['Syntax highlighting', checkmark(prefs.syntax_highlighting)],
+            ['Tab size', prefs.tab_size],
+        )
 
         with Pager(command=self.name):
             print 'Account: {}'.format(account.username)
-            print table
+            table.write(rows)
@@ -9,12 +9,11 @@ from libpycr.exceptions import PyCRError
 from libpycr.gerrit.client import Gerrit
 from libpycr.meta import GerritAccountBuiltin
 from libpycr.pager import Pager
+from libpycr.utils import records
 from libpycr.utils.commandline import expect_account_as_positional
-from libpycr.utils.output import checkmark
+from libpycr.utils.output import checkmark, Table
 from libpycr.utils.system import fail
 
-from prettytable import PrettyTable
-
 
 class LsEmails(GerritAccountBuiltin):
     """Implement the LS-EMAILS command"""
@@ -60,17 +59,22 @@ class LsEmails(GerritAccountBuiltin):
         except PyCRError as why:
             fail('cannot list account emails', why)
 
-        table = PrettyTable(['Email', 'Preferred', 'Confirmed'])
-        table.align = 'l'
+        if records.is_enabled():
+            records.write_all(
+                records.merge((('account', account.username),), email)
+                for email in emails)
+            return
+
+        table = Table(['Email', 'Preferred', 'Confirmed'], align=Table.LEFT)
 
-        for email in emails:
-            table.add_row([email.email,
-                           checkmark(True) if email.preferred else '',
-                           'No' if email.pending_confirmation else 'Yes'])
+        rows = ([email.email,
+                 checkmark(True) if email.preferred else '',
+                 'No' if email.pending_confirmation else 'Yes']
+                for email in emails)
 
         with Pager(command=self.name):
             print 'Account: {}'.format(account.username)
             if emails:
-                print table
+                table.write(rows)
             else:
                 print 'No email address'
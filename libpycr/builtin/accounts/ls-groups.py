@@ -9,12 +9,11 @@ from libpycr.exceptions import PyCRError
 from libpycr.gerrit.client import Gerrit
 from libpycr.meta import GerritAccountBuiltin
 from libpycr.pager import Pager
+from libpycr.utils import records
 from libpycr.utils.commandline import expect_account_as_positional
-from libpycr.utils.output import checkmark
+from libpycr.utils.output import checkmark, Table
 from libpycr.utils.system import fail
 
-from prettytable import PrettyTable
-
 
 class LsGroups(GerritAccountBuiltin):
     """Implement the LS-GROUPS command"""
@@ -59,13 +58,17 @@ class LsGroups(GerritAccountBuiltin):
         except PyCRError as why:
             fail('cannot list account groups', why)
 
-        table = PrettyTable(['Group', 'Description', 'Visible to all'])
-        table.align = 'l'
-        table.align['Visible to all'] = 'c'
+        if records.is_enabled():
+            records.write_all(groups)
+            return
+
+        table = Table(
+            ['Group', 'Description', 'Visible to all'],
+            align={'Group': Table.LEFT, 'Description': Table.LEFT})
 
-        for group in groups:
-            table.add_row([group.name, group.description or '',
-                           checkmark(group.options.visible_to_all)])
+        rows = ([group.name, group.description or '',
+                 checkmark(group.options.visible_to_all)]
+                for group in groups)
 
         with Pager(command=self.name):
-            print table
+            table.write(rows)
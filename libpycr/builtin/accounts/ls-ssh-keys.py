@@ -9,12 +9,11 @@ from libpycr.exceptions import PyCRError
 from libpycr.gerrit.client import Gerrit
 from libpycr.meta import GerritAccountBuiltin
 from libpycr.pager import Pager
+from libpycr.utils import records
 from libpycr.utils.commandline import expect_account_as_positional
-from libpycr.utils.output import checkmark
+from libpycr.utils.output import checkmark, Table
 from libpycr.utils.system import fail
 
-from prettytable import PrettyTable
-
 
 class LsSshKeys(GerritAccountBuiltin):
     """Implement the LS-SSH-KEYS command"""
@@ -60,17 +59,21 @@ class LsSshKeys(GerritAccountBuiltin):
         except PyCRError as why:
             fail('cannot list account SSH keys', why)
 
-        table = PrettyTable(
-            ['Id', 'Algorithm', 'Comment', 'Valid', 'Encoded key'])
-        table.align = 'l'
+        if records.is_enabled():
+            records.write_all(
+                records.merge((('account', account.username),), key)
+                for key in keys)
+            return
+
+        table = Table(['Id', 'Algorithm', 'Comment', 'Valid', 'Encoded key'],
+                      align=Table.LEFT)
 
-        for key in keys:
-            table.add_row([key.seq, key.algorithm, key.comment,
-                           checkmark(key.valid), key.encoded_key])
+        rows = ([key.seq, key.algorithm, key.comment, checkmark(key.valid),
+                 key.encoded_key] for key in keys)
 
         with Pager(command=self.name):
             print 'Account: {}'.format(account.username)
             if keys:
-                print table
+                table.write(rows)
             else:
                 print 'No SSH keys'
@@ -9,6 +9,7 @@ from libpycr.exceptions import PyCRError
 from libpycr.gerrit.client import Gerrit
 from libpycr.meta import GerritAccountBuiltin
 from libpycr.pager import Pager
+from libpycr.utils import records
 from libpycr.utils.commandline import expect_account_as_positional
 from libpycr.utils.output import Formatter, NEW_LINE
 from libpycr.utils.system import fail
@@ -77,6 +78,10 @@ class LsStarred(GerritAccountBuiltin):
         except PyCRError as why:
             fail('cannot list account starred changes', why)
 
+        if records.is_enabled():
+            records.write_all(changes)
+            return
+
         with Pager(command=self.name):
             for idx, change in enumerate(changes):
                 print Formatter.format(self.tokenize(idx, change))
@@ -7,11 +7,11 @@ from libpycr.exceptions import PyCRError
 from libpycr.gerrit.client import Gerrit
 from libpycr.meta import GerritAccountBuiltin
 from libpycr.pager import Pager
+from libpycr.utils import records
 from libpycr.utils.commandline import expect_account_as_positional
+from libpycr.utils.output import Table
 from libpycr.utils.system import fail
 
-from prettytable import PrettyTable
-
 
 class Show(GerritAccountBuiltin):
     """Implement the SHOW command"""
@@ -52,11 +52,14 @@ class Show(GerritAccountBuiltin):
         except PyCRError as why:
             fail('cannot list accounts', why)
 
-        table = PrettyTable(['Username', 'Name', 'Email'])
-        table.align = 'l'
+        if records.is_enabled():
+            records.write_all(set(accounts))
+            return
+
+        table = Table(['Username', 'Name', 'Email'], align=Table.LEFT)
 
-        for account in set(accounts):
-            table.add_row([account.username, account.name, account.email])
+        rows = ([account.username, account.name, account.email]
+                for account in set(accounts))
 
         with Pager(command=self.name):
-            print table
+            table.write(rows)
@@ -10,6 +10,7 @@ import sys
 from libpycr.exceptions import PyCRError
 from libpycr.gerrit.client import Gerrit
 from libpycr.meta import GerritAccountBuiltin
+from libpycr.utils import records
 from libpycr.utils.commandline import expect_account_as_positional
 from libpycr.utils.system import fail
 
@@ -92,6 +93,10 @@ class SshKey(GerritAccountBuiltin):
         except PyCRError as why:
             fail('cannot list account SSH keys', why)
 
+        if records.is_enabled():
+            records.write_all([key])
+            return
+
         print key.ssh_public_key.strip()
 
     def run_add(self, arguments, *args, **kwargs):
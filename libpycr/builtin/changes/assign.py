@@ -6,7 +6,11 @@ import sys
 from libpycr.exceptions import PyCRError
 from libpycr.gerrit.changes import fetch_change_list_or_fail
 from libpycr.gerrit.client import Gerrit
+from libpycr.gerrit.fields import FieldMask, SUMMARY
+from libpycr.gerrit.reviewers import (
+    ReviewerCache, expand_groups, resolve_reviewers)
 from libpycr.meta import GitClBuiltin
+from libpycr.utils import records
 from libpycr.utils.output import Formatter, NEW_LINE, Token
 from libpycr.utils.system import fail, warn
 
@@ -14,6 +18,13 @@ from libpycr.utils.system import fail, warn
 class Assign(GitClBuiltin):
     """Implement the ASSIGN command"""
 
+    # ChangeInfo fields rendered by this command, and the current reviewers
+    # to reconcile the requested reviewers with
+    fields = SUMMARY | FieldMask('reviewers')
+
+    # ChangeInfo fields used without reconciliation
+    no_reconcile_fields = SUMMARY
+
     @property
     def description(self):
         return 'add/delete reviewer to/from change(s)'
@@ -26,7 +37,7 @@ class Assign(GitClBuiltin):
         module to parse the command-line arguments.
         """
 
-        buf = [('usage: %s assign [-h] CL [CL ...] '
+        buf = [('usage: %s assign [-h] [--no-reconcile] CL [CL ...] '
                 '[+/-REVIEWER [+/-REVIEWER ...]]')]
         buf.append('')
         buf.append('Add or delete reviewer(s) to one or more changes')
@@ -39,6 +50,9 @@ class Assign(GitClBuiltin):
         buf.append('')
         buf.append('optional arguments:')
         buf.append('  -h, --help     show this help message and exit')
+        buf.append(('  --no-reconcile send all requests, even for reviewers '
+                    'already'))
+        buf.append('                 (not) assigned to the change')
 
         print os.linesep.join(buf) % os.path.basename(sys.argv[0])
         sys.exit()
@@ -47,24 +61,28 @@ class Assign(GitClBuiltin):
     def parse_command_line(arguments):
         """Parse the SHOW command command-line arguments
 
-        Returns a tuple containing three lists:
+        Returns a tuple containing three lists and a flag:
                 - the list of ChangeInfo
                 - the list of reviewers to add
                 - the list of reviewers to delete
+                - whether to reconcile the reviewers of the changes
 
         :param arguments: a list of command-line arguments to parse
         :type arguments: list[str]
-        :rtype: tuple[ChangeInfo, list[str], list[str]]
+        :rtype: tuple[ChangeInfo, list[str], list[str], bool]
         """
 
         changes, to_add, to_del = [], [], []
+        reconcile = True
 
         for argument in arguments:
             if argument in ('-h', '--help'):
                 # Manually handle the --help flag
                 Assign.display_help()
 
-            if argument[0] == '+':
+            if argument == '--no-reconcile':
+                reconcile = False
+            elif argument[0] == '+':
                 to_add.append(argument[1:])
             elif argument[0] == '-':
                 to_del.append(argument[1:])
@@ -74,7 +92,49 @@ class Assign(GitClBuiltin):
         if not to_add and not to_del:
             fail('please specify reviewer(s) to add or delete')
 
-        return fetch_change_list_or_fail(changes), to_add, to_del
+        fields = Assign.fields if reconcile else Assign.no_reconcile_fields
+
+        return (fetch_change_list_or_fail(changes, fields), to_add, to_del,
+                reconcile)
+
+    @staticmethod
+    def reconcile(change, to_add, to_del):
+        """Compute the minimal set of operations to apply to a change
+
+        Reviewers (or groups) to add that are already reviewers of the change,
+        and reviewers to delete that are not, are dropped. Groups to delete
+        are expanded into their members.
+
+        Returns the reviewers to add, and the account IDs and ReviewerInfo of
+        the reviewers to delete.
+
+        :param change: the change, with its current reviewers
+        :type change: ChangeInfo
+        :param to_add: the reviewers to add
+        :type to_add: list[Reviewer]
+        :param to_del: the reviewers to delete (groups must be expanded)
+        :type to_del: list[Reviewer]
+        :rtype: list[Reviewer], list[(str, ReviewerInfo)]
+        """
+
+        current = dict((str(r.reviewer.account_id), r)
+                       for r in change.reviewers)
+
+        # The owner of a change is never added to its reviewers
+        owner = str(change.owner.account_id) if change.owner else None
+
+        additions = [reviewer for reviewer in to_add if any(
+            account_id not in current and account_id != owner
+            for account_id in reviewer.get_account_ids())]
+
+        deletions = []
+
+        for reviewer in to_del:
+            for account_id in reviewer.get_account_ids():
+                if account_id in current:
+                    deletions.append((account_id, current.pop(account_id)))
+
+        return additions, deletions
 
     @staticmethod
     def tokenize(idx, change, added, deleted):
@@ -130,29 +190,76 @@ class Assign(GitClBuiltin):
                 yield token
 
     def run(self, arguments, *args, **kwargs):
-        changes, to_add, to_del = self.parse_command_line(arguments)
+        changes, to_add, to_del, reconcile = self.parse_command_line(
+            arguments)
         assert changes, 'unexpected empty list'
 
-        for idx, change in enumerate(changes):
+        # Resolve the reviewers once, before modifying any change
+        cache = ReviewerCache.open_default()
+
+        try:
+            # One concurrent account query per uncached reviewer
+            resolved = resolve_reviewers(to_add + to_del, cache)
+            to_add, to_del = resolved[:len(to_add)], resolved[len(to_add):]
+
+            if reconcile:
+                expand_groups(resolved, cache)
+
+        except PyCRError as why:
+            fail('cannot resolve reviewers', why)
+
+        finally:
+            if cache is not None:
+                cache.save()
+
+        # Reconcile every change before asking anything
+        operations = []
+
+        for change in changes:
+            if reconcile and change.reviewers is not None:
+                additions, deletions = self.reconcile(change, to_add, to_del)
+            else:
+                additions = to_add
+                deletions = [(r.reviewer_id, None) for r in to_del]
+
+            operations.append((change, additions, deletions))
+
+        # Groups known to require a confirmation: ask once, upfront, and
+        # only for those still to be added to at least one change
+        for reviewer in to_add:
+            if reviewer.confirm_message is not None and any(
+                    reviewer in additions for _, additions, _ in operations):
+                reviewer.confirm(reviewer.confirm_message)
+
+        writer = records.open_writer() if records.is_enabled() else None
+
+        for idx, (change, additions, deletions) in enumerate(operations):
             added = []
             deleted = []
 
             # Add reviewers
-            for account_id in to_add:
+            for reviewer in additions:
+                if reviewer.confirmed is False:
+                    continue
+
                 try:
-                    reviewers = Gerrit.add_reviewer(change.uuid, account_id)
+                    reviewers = Gerrit.add_reviewer(
+                        change.uuid, reviewer.reviewer_id,
+                        force=bool(reviewer.confirmed),
+                        confirm_function=reviewer.confirm)
 
                     if reviewers:
                         added.extend(reviewers)
 
                 except PyCRError as why:
                     warn('{}: cannot assign reviewer {}'.format(
-                        change.change_id[:9], account_id), why)
+                        change.change_id[:9], reviewer), why)
 
             # Delete reviewers
-            for account_id in to_del:
+            for account_id, reviewer in deletions:
                 try:
-                    review = Gerrit.delete_reviewer(change.uuid, account_id)
+                    review = Gerrit.delete_reviewer(change.uuid, account_id,
+                                                    reviewer)
 
                     if review:
                         deleted.append(review.reviewer)
@@ -161,4 +268,20 @@ class Assign(GitClBuiltin):
                     warn('{}: cannot delete reviewer {}'.format(
                         change.change_id[:9], account_id), why)
 
-            print Formatter.format(self.tokenize(idx, change, added, deleted))
+            if writer is not None:
+                writer.write(records.merge(
+                    change, (('added', added), ('deleted', deleted))))
+            else:
+                print Formatter.format(
+                    self.tokenize(idx, change, added, deleted))
+
+        if writer is not None:
+            writer.close()
+
+        # Remember the groups that require a confirmation
+        if cache is not None and any(r.confirmed is not None for r in to_add):
+            for reviewer in to_add:
+                if reviewer.confirmed is not None:
+                    cache.put(reviewer)
+
+            cache.save()
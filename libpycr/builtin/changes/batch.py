@@ -0,0 +1,11 @@
+"""Run many commands in a single process"""
+
+from libpycr.batch import BatchBuiltin
+from libpycr.meta import GitClBuiltin
+
+
+class Batch(BatchBuiltin, GitClBuiltin):
+    """Implement the BATCH command"""
+
+    builtin_type = GitClBuiltin
+    prefixes = (('git', 'cl'), ('git-cl',))
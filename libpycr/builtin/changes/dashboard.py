@@ -0,0 +1,137 @@
+"""Display the changes that need the user's attention"""
+
+import argparse
+
+from libpycr.builtin.changes.list import List
+from libpycr.exceptions import PyCRError
+from libpycr.gerrit.client import Gerrit
+from libpycr.gerrit.fields import FieldMask, SUMMARY
+from libpycr.gerrit.query import Query
+from libpycr.meta import GitClBuiltin
+from libpycr.pager import Pager
+from libpycr.utils import records
+from libpycr.utils.output import Formatter, NEW_LINE, Token
+from libpycr.utils.system import fail
+
+
+class Dashboard(GitClBuiltin):
+    """Implement the DASHBOARD command"""
+
+    # ChangeInfo fields rendered by this command
+    fields = SUMMARY | FieldMask('labels')
+
+    # Sections of the dashboard: (title, query)
+    SECTIONS = (
+        ('Outgoing reviews', Query.is_state('open') & Query.owner('self')),
+        ('Incoming reviews', Query.is_state('open') & Query.reviewer('self') &
+         ~Query.owner('self')),
+        ('Recently closed', Query.is_state('closed') &
+         (Query.owner('self') | Query.reviewer('self')) & ~Query.age('4w')),
+    )
+
+    # Default maximum number of changes per section
+    DEFAULT_LIMIT = 25
+
+    @property
+    def description(self):
+        return 'display the changes that need your attention'
+
+    @classmethod
+    def parse_command_line(cls, arguments):
+        """Parse the DASHBOARD command command-line arguments
+
+        :param arguments: a list of command-line arguments to parse
+        :type arguments: list[str]
+        :rtype: int
+        """
+
+        parser = argparse.ArgumentParser(
+            description='Display your outgoing and incoming reviews, and the '
+                        'recently closed changes')
+        parser.add_argument(
+            '--limit', type=int, default=cls.DEFAULT_LIMIT,
+            help='the maximum number of changes per section (default: %d)' %
+            cls.DEFAULT_LIMIT)
+
+        cmdline = parser.parse_args(arguments)
+
+        return cmdline.limit
+
+    @staticmethod
+    def tokenize_change(change, labels):
+        """Token generator for a change: summary line and label scores
+
+        :param change: the change
+        :type change: ChangeInfo
+        :param labels: the labels to display the score of, in order
+        :type labels: list[str]
+        :yield: tuple[Token, str]
+        """
+
+        yield Token.Generic.Subheading, '%7s' % change.legacy_id
+        yield Token.Text, '  %s  ' % change.project
+        yield Token.Text, change.subject
+        yield NEW_LINE
+        yield Token.Whitespace, ' ' * 9
+
+        for token in List.tokenize_labels(change, labels):
+            yield token
+
+    @classmethod
+    def tokenize(cls, idx, title, changes, labels):
+        """Token generator for the output
+
+        Yields a stream of tokens: tuple of (Token, string).
+
+        :param idx: index of the section in the dashboard
+        :type idx: int
+        :param title: the title of the section
+        :type title: str
+        :param changes: the changes of the section
+        :type changes: list[ChangeInfo]
+        :param labels: the labels to display the score of, in order
+        :type labels: list[str]
+        :yield: tuple[Token, str]
+        """
+
+        if idx:
+            yield NEW_LINE
+
+        yield Token.Generic.Heading, '%s (%d)' % (title, len(changes))
+
+        for change in changes:
+            yield NEW_LINE
+
+            for token in cls.tokenize_change(change, labels):
+                yield token
+
+    def run(self, arguments, *args, **kwargs):
+        limit = self.parse_command_line(arguments)
+
+        try:
+            # All sections are fetched with a single request (or more if the
+            # server returns fewer changes per request than the limit)
+            results = Gerrit.multi_query(
+                [query for _, query in self.SECTIONS], fields=self.fields,
+                max_results=limit)
+
+        except PyCRError as why:
+            fail('cannot fetch dashboard', why)
+
+        if records.is_enabled():
+            records.write_all(
+                records.merge((('section', title),), change)
+                for (title, _), changes in zip(self.SECTIONS, results)
+                for change in changes)
+            return
+
+        # Display the same label columns in all sections
+        labels = sorted(set(label for changes in results
+                            for change in changes
+                            for label, _ in change.labels or ()))
+
+        with Pager(command=self.name):
+            for idx, ((title, _), changes) in enumerate(
+                    zip(self.SECTIONS, results)):
+                print Formatter.format(
+                    self.tokenize(idx, title, changes, labels))
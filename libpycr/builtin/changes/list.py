@@ -5,9 +5,12 @@ import logging
 
 from libpycr.exceptions import QueryError, PyCRError
 from libpycr.gerrit.client import Gerrit
+from libpycr.gerrit.fields import FieldMask, SUMMARY
+from libpycr.gerrit.query import Query
 from libpycr.meta import GitClBuiltin
 from libpycr.pager import Pager
-from libpycr.utils.output import Formatter, NEW_LINE
+from libpycr.utils import records
+from libpycr.utils.output import checkmark, Formatter, NEW_LINE, Token
 from libpycr.utils.system import fail
 
 
@@ -17,6 +20,9 @@ class List(GitClBuiltin):
     # Logger for this command
     log = logging.getLogger(__name__)
 
+    # ChangeInfo fields rendered by this command
+    fields = SUMMARY | FieldMask('labels')
+
     @property
     def description(self):
         return 'list change(s)'
@@ -27,30 +33,94 @@ class List(GitClBuiltin):
 
         :param arguments: a list of command-line arguments to parse
         :type arguments: list[str]
-        :rtype: str, str, bool
+        :rtype: str | None, str | None, bool, Query | None
         """
 
         parser = argparse.ArgumentParser(
             description='List changes by owner and status')
         parser.add_argument(
-            '--status', default='open', choices=Gerrit.get_all_statuses(),
-            help='the status of the changes (default: open)')
+            '--status', choices=Gerrit.get_all_statuses(),
+            help='the status of the changes (default: open, unless a query '
+                 'is specified)')
+        parser.add_argument(
+            '-q', '--query',
+            help='only list the changes matching QUERY, in the Gerrit Code '
+                 'Review query language (eg. "project:foo label:Verified=-1")')
 
         exclusive = parser.add_mutually_exclusive_group()
         exclusive.add_argument(
-            '--owner', default='self',
-            help='the owner of the changes (default: self)')
+            '--owner',
+            help='the owner of the changes (default: self, unless a query is '
+                 'specified)')
         exclusive.add_argument(
             '--watched', default=False, action='store_true',
             help='list only watched changes')
 
         cmdline = parser.parse_args(arguments)
 
-        # Fetch changes details
-        return cmdline.owner, cmdline.status, cmdline.watched
+        query = None
+
+        if cmdline.query is not None:
+            try:
+                query = Query.raw(cmdline.query)
+            except ValueError as why:
+                fail('invalid query', why)
+
+        # Without query, list the user's open changes by default
+        status, owner = cmdline.status, cmdline.owner
+
+        if query is None:
+            status = status or 'open'
+            owner = owner or 'self'
+
+        return owner, status, cmdline.watched, query
 
     @staticmethod
-    def tokenize(idx, change):
+    def get_label_abbreviation(label):
+        """Return the abbreviated name of a label (eg. CR for Code-Review)
+
+        :param label: the name of the label
+        :type label: str
+        :rtype: str
+        """
+
+        return ''.join(word[0] for word in label.split('-') if word)
+
+    @classmethod
+    def tokenize_labels(cls, change, labels):
+        """Token generator for the label scores of a change
+
+        Each label of LABELS gets a column, blank if not applicable to the
+        change, so that scores line up from one change to the next.
+
+        :param change: the change
+        :type change: ChangeInfo
+        :param labels: the labels to display, in order
+        :type labels: list[str]
+        :yield: tuple[Token, str]
+        """
+
+        scores = dict(change.labels or ())
+
+        yield Token.Text, 'Labels:'
+
+        for label in labels:
+            score = scores.get(label)
+
+            if score is None:
+                token, score = Token.Text, ''
+            elif score == checkmark(True) or score.startswith('+'):
+                token = Token.Review.OK
+            elif score == checkmark(False) or score.startswith('-'):
+                token = Token.Review.KO
+            else:
+                token = Token.Review.NONE
+
+            yield Token.Text, '  %s:' % cls.get_label_abbreviation(label)
+            yield token, score.rjust(2)
+
+    @classmethod
+    def tokenize(cls, idx, change, labels=()):
         """Token generator for the output
 
         Yields a stream of tokens: tuple of (Token, string).
@@ -59,6 +129,8 @@ class List(GitClBuiltin):
         :type idx: int
         :param change: the change
         :type change: ChangeInfo
+        :param labels: the labels to display the score of, in order
+        :type labels: list[str]
         :yield: tuple[Token, str]
         """
 
@@ -68,14 +140,55 @@ class List(GitClBuiltin):
         for token in change.tokenize():
             yield token
 
+        if labels:
+            yield NEW_LINE
+
+            for token in cls.tokenize_labels(change, labels):
+                yield token
+
+    def stream(self, owner, status, watched, query):
+        """Write the changes as records, as soon as they are received
+
+        The changes are fetched page by page, directly from the server: the
+        memory used does not grow with the number of changes.
+
+        :param owner: the owner of the changes, if any
+        :type owner: str | None
+        :param status: the status of the changes, if any
+        :type status: str | None
+        :param watched: whether to list only watched changes
+        :type watched: bool
+        :param query: additional search criteria
+        :type query: Query | None
+        """
+
+        query = Query.all(
+            Query.status(status) if status is not None else None,
+            Query.is_state('watched') if watched else None,
+            Query.owner(owner) if owner is not None and not watched else None,
+            query)
+
+        try:
+            records.write_all(Gerrit.iter_changes(query, self.fields))
+
+        except PyCRError as why:
+            fail('cannot list changes', why)
+
     def run(self, arguments, *args, **kwargs):
-        owner, status, watched = self.parse_command_line(arguments)
+        owner, status, watched, query = self.parse_command_line(arguments)
+
+        if records.is_enabled():
+            self.stream(owner, status, watched, query)
+            return
 
         try:
             if watched:
-                changes = Gerrit.list_watched_changes(status=status)
+                changes = Gerrit.list_watched_changes(
+                    status=status, fields=self.fields, query=query)
             else:
-                changes = Gerrit.list_changes(status=status, owner=owner)
+                changes = Gerrit.list_changes(
+                    status=status, owner=owner, fields=self.fields,
+                    query=query)
 
         except QueryError as why:
             # No result, not an error
@@ -85,6 +198,10 @@ class List(GitClBuiltin):
         except PyCRError as why:
             fail('cannot list changes', why)
 
+        # Display the same label columns for all changes
+        labels = sorted(set(label for change in changes
+                            for label, _ in change.labels or ()))
+
         with Pager(command=self.name):
             for idx, change in enumerate(changes):
-                print Formatter.format(self.tokenize(idx, change))
+                print Formatter.format(self.tokenize(idx, change, labels))
@@ -6,6 +6,7 @@ import logging
 from libpycr.exceptions import NoSuchChangeError, PyCRError
 from libpycr.gerrit.client import Gerrit
 from libpycr.meta import GitClBuiltin
+from libpycr.utils import records
 from libpycr.utils.output import Formatter, NEW_LINE, Token
 from libpycr.utils.system import fail
 
@@ -74,4 +75,8 @@ class Rebase(GitClBuiltin):
         except PyCRError as why:
             fail('cannot rebase', why)
 
+        if records.is_enabled():
+            records.write_all([change])
+            return
+
         print Formatter.format(self.tokenize(change))
@@ -7,7 +7,9 @@ import os
 from libpycr.editor import raw_input_editor, strip_comments
 from libpycr.exceptions import NoSuchChangeError, PyCRError
 from libpycr.gerrit.client import Gerrit
+from libpycr.gerrit.fields import SUMMARY
 from libpycr.meta import GitClBuiltin
+from libpycr.utils import records
 from libpycr.utils.output import Formatter, NEW_LINE
 from libpycr.utils.system import ask, fail
 
@@ -17,6 +19,9 @@ class Review(GitClBuiltin):
 
     log = logging.getLogger(__name__)
 
+    # ChangeInfo fields rendered by this command
+    fields = SUMMARY
+
     @property
     def description(self):
         return 'code-review a change'
@@ -74,7 +79,7 @@ class Review(GitClBuiltin):
         change_id, score, message, label = self.parse_command_line(arguments)
 
         try:
-            change = Gerrit.get_change(change_id)
+            change = Gerrit.get_change(change_id, self.fields)
 
             if message is None:
                 initial_content = [
@@ -103,4 +108,8 @@ class Review(GitClBuiltin):
         except PyCRError as why:
             fail('cannot post review', why)
 
+        if records.is_enabled():
+            records.write_all([records.merge(change, (('review', review),))])
+            return
+
         print Formatter.format(self.tokenize(change, review))
@@ -1,20 +1,27 @@
 """Display the code review scores for one or more Gerrit CL"""
 
 import argparse
+import itertools
 
 from libpycr.exceptions import PyCRError
 from libpycr.gerrit.changes import fetch_change_list_or_fail
 from libpycr.gerrit.client import Gerrit
+from libpycr.gerrit.fields import FieldMask, SUMMARY
 from libpycr.meta import GitClBuiltin
 from libpycr.pager import Pager
+from libpycr.utils import records
 from libpycr.utils.commandline import expect_changes_as_positional
 from libpycr.utils.output import Formatter, NEW_LINE
+from libpycr.utils.parallel import imap
 from libpycr.utils.system import warn
 
 
 class Show(GitClBuiltin):
     """Implement the SHOW command"""
 
+    # ChangeInfo fields rendered by this command
+    fields = SUMMARY | FieldMask('reviewers')
+
     @property
     def description(self):
         return 'display the change(s) details'
@@ -35,7 +42,7 @@ class Show(GitClBuiltin):
         cmdline = parser.parse_args(arguments)
 
         # Fetch changes details
-        return fetch_change_list_or_fail(cmdline.changes)
+        return fetch_change_list_or_fail(cmdline.changes, Show.fields)
 
     @staticmethod
     def tokenize(idx, change, reviews, patch):
@@ -48,7 +55,7 @@ class Show(GitClBuiltin):
         :param change: the change
         :type change: ChangeInfo
         :param reviews: the reviews attached to the change
-        :type reviews: list[ReviewInfo]
+        :type reviews: list[ReviewerInfo]
         :param patch: the patch to display along the change
         :type patch: str
         :yield: tuple[Token, str]
@@ -74,20 +81,50 @@ class Show(GitClBuiltin):
         for token in Formatter.tokenize_diff(patch):
             yield token
 
+    @staticmethod
+    def stream(changes, patches):
+        """Write the changes and their patch as records
+
+        :param changes: the changes
+        :type changes: list[ChangeInfo]
+        :param patches: the (patch, error) of each change
+        :type patches: collections.iterable[(str, PyCRError | None)]
+        """
+
+        with records.open_writer() as writer:
+            for change, (patch, error) in itertools.izip(changes, patches):
+                if error is not None:
+                    warn('%s: cannot fetch patch' % change.change_id[:9],
+                         error)
+                    continue
+
+                writer.write(records.merge(change, (('patch', patch),)))
+
     def run(self, arguments, *args, **kwargs):
         changes = self.parse_command_line(arguments)
         assert changes, 'unexpected empty list'
 
-        with Pager(command=self.name):
-            for idx, change in enumerate(changes):
-                try:
-                    reviews = Gerrit.get_reviews(change.uuid)
-                    patch = Gerrit.get_patch(change.uuid)
-
-                except PyCRError as why:
-                    warn('%s: cannot list reviewers' % change.change_id[:9],
-                         why)
+        # Reviewers are part of the change details: only the patches remain to
+        # fetch, concurrently
+        def get_patch(change):
+            """Fetch the patch of the current revision of CHANGE"""
+            return Gerrit.get_patch(change.uuid)
+
+        if records.is_enabled():
+            self.stream(changes, imap(get_patch, changes, catch=PyCRError))
+            return
+
+        with Pager(command=self.name) as pager:
+            # Cancel the pending fetches as soon as the user quits the pager
+            patches = imap(get_patch, changes, catch=PyCRError,
+                           cancel=pager.closed)
+
+            for idx, (change, (patch, error)) in enumerate(
+                    itertools.izip(changes, patches)):
+                if error is not None:
+                    warn('%s: cannot fetch patch' % change.change_id[:9],
+                         error)
                     continue
 
                 print Formatter.format(
-                    self.tokenize(idx, change, reviews, patch))
+                    self.tokenize(idx, change, change.reviewers or (), patch))
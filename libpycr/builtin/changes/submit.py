@@ -5,7 +5,9 @@ import logging
 
 from libpycr.exceptions import NoSuchChangeError, PyCRError
 from libpycr.gerrit.client import Gerrit
+from libpycr.gerrit.fields import FieldMask, SUMMARY
 from libpycr.meta import GitClBuiltin
+from libpycr.utils import records
 from libpycr.utils.output import Formatter, NEW_LINE, Token
 from libpycr.utils.system import fail
 
@@ -16,6 +18,9 @@ class Submit(GitClBuiltin):
     # Logger for this command
     log = logging.getLogger(__name__)
 
+    # ChangeInfo fields rendered by this command
+    fields = SUMMARY | FieldMask('current_revision')
+
     @property
     def description(self):
         return 'submit a change'
@@ -65,7 +70,7 @@ class Submit(GitClBuiltin):
         change_id = self.parse_command_line(arguments)
 
         try:
-            change = Gerrit.get_change(change_id)
+            change = Gerrit.get_change(change_id, self.fields)
 
             if not Gerrit.submit(change.uuid):
                 fail('change could not be merged')
@@ -77,4 +82,8 @@ class Submit(GitClBuiltin):
         except PyCRError as why:
             fail('cannot submit', why)
 
+        if records.is_enabled():
+            records.write_all([change])
+            return
+
         print Formatter.format(self.tokenize(change))
@@ -4,10 +4,33 @@ import argparse
 import logging
 import sys
 
-from libpycr import get_version
+from libpycr import get_version, tracing
+from libpycr.config import Config
 from libpycr.http import RequestFactory
 from libpycr.utils.introspect import get_all_subclasses
+from libpycr.utils import records
 from libpycr.utils.output import Formatter
+from libpycr.utils.system import fail
+
+
+class VersionAction(argparse.Action):
+    """Print the version number and exit
+
+    Unlike argparse's version action, the version is only computed when
+    requested: computing it may spawn a git process.
+    """
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS,
+                 default=argparse.SUPPRESS,
+                 help="show program's version number and exit"):
+        # pylint: disable=redefined-builtin
+        super(VersionAction, self).__init__(
+            option_strings=option_strings, dest=dest, default=default,
+            nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        parser.exit(message='{} version {}\n'.format(parser.prog,
+                                                     get_version()))
 
 
 def build_cmdline_parser(builtin_type):
@@ -22,9 +45,7 @@ def build_cmdline_parser(builtin_type):
     parser = argparse.ArgumentParser(
         description='Gerrit Code Review command line tools')
 
-    parser.add_argument(
-        '--version', action='version',
-        version='%(prog)s version ' + get_version())
+    parser.add_argument('--version', action=VersionAction)
 
     # Activate debug logging. Do not provide this option in usage message
     parser.add_argument(
@@ -42,6 +63,24 @@ def build_cmdline_parser(builtin_type):
         '--username', default=None,
         help='Gerrit Code Review HTTP digest authentication')
 
+    # Request tracing
+    parser.add_argument(
+        '--profile', default=False, action='store_true',
+        help='print a summary of the requests sent to Gerrit on exit')
+    parser.add_argument(
+        '--trace', default=None, metavar='FILE',
+        help='append a JSON record of each request sent to Gerrit to FILE')
+
+    # Overall time budget of the command
+    parser.add_argument(
+        '--timeout', default=None, type=float, metavar='SECONDS',
+        help='give up the requests to Gerrit after SECONDS (default: none)')
+
+    # Machine-readable output
+    parser.add_argument(
+        '--format', default=records.TEXT, choices=records.FORMATS,
+        help='the output format (default: %(default)s)')
+
     # Hidden argument to select a custom Pygments formatter.
     # This is not a very user-friendly feature so do not litter the usage
     # message with it.
@@ -124,6 +163,23 @@ def parse_command_line(builtin_type):
     if cmdline.builtins == 'help':
         display_help(builtin_type, cmdline.builtin)
 
+    # Configure request tracing (sinks are closed by builtin_main)
+    if cmdline.profile:
+        tracing.add_sink(tracing.HistogramSink(report=sys.stderr))
+
+    trace_file = cmdline.trace or Config.get('trace.file')
+
+    if trace_file is not None:
+        try:
+            tracing.add_sink(tracing.JsonLinesSink(trace_file))
+        except IOError as why:
+            fail('cannot open trace file: {}'.format(trace_file), why)
+
+    records.set_format(cmdline.format)
+
+    if cmdline.timeout is not None:
+        Config.set('http.timeout', cmdline.timeout)
+
     # Configure the HTTP request engine
     RequestFactory.set_unsecure_connection(cmdline.unsecure)
 
@@ -1,11 +1,50 @@
-"""This module manipulates the configuration files for this project"""
+"""This module manipulates the configuration files for this project
 
+Parsing the configuration files is startup work repeated on every command.
+The result is cached (see Config.load_all), along with the modification
+stamps of the files it was read from and of the directories looked into for
+the local configuration file: as long as none of them changed, the
+configuration is loaded from the cache with a handful of stat calls.
+"""
+
+import functools
+import marshal
 import os
 import sys
+import time
+
+from libpycr.utils.system import (
+    fail, get_cache_dir, get_local, reverse_find_file, set_local, warn,
+    write_atomically)
+
+
+# Name of the compiled configuration cache, in the cache directory
+CACHE_FILENAME = 'config.marshal'
+
+# Maximum number of working directories the cache keeps the configuration of
+CACHE_SIZE = 64
+
+# Boolean spellings, as accepted by ConfigParser.getboolean
+BOOLEAN_STATES = {'1': True, 'yes': True, 'true': True, 'on': True,
+                  '0': False, 'no': False, 'false': False, 'off': False}
+
+
+def get_stamp(path):
+    """Return the modification stamp of PATH
 
-from ConfigParser import ParsingError, SafeConfigParser
+    Returns None if PATH does not exist.
 
-from libpycr.utils.system import fail, warn, reverse_find_file
+    :param path: the path to the file or directory
+    :type path: str
+    :rtype: (float, int) | None
+    """
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    return stat.st_mtime, stat.st_size
 
 
 # pylint: disable=R0903
@@ -24,9 +63,37 @@ class Config(dict):
     # $HOME/.gitreview
     GLOBAL = os.path.expanduser('~/.{}'.format(FILENAME))
 
-    # Dictionary of configuration keys
+    # Dictionary of configuration keys of the process. Threads may use their
+    # own dictionary instead (see Config.use).
     __config = {}
 
+    @classmethod
+    def use(cls, entries):
+        """Use ENTRIES as the configuration of the current thread
+
+        All reads and writes of the configuration in the current thread then
+        apply to ENTRIES (see libpycr.gerrit.client.GerritClient). Returns the
+        entries previously used by the thread, if any.
+
+        :param entries: the configuration entries, or None to use the
+            configuration of the process
+        :type entries: dict | None
+        :rtype: dict | None
+        """
+
+        return set_local('config', entries)
+
+    @classmethod
+    def _entries(cls):
+        """Return the configuration entries used by the current thread
+
+        :rtype: dict
+        """
+
+        entries = get_local('config')
+
+        return cls.__config if entries is None else entries
+
     @classmethod
     def load(cls, filename, quiet=False):
         """Parse a configuration file and extract this script's configuration
@@ -41,6 +108,9 @@ class Config(dict):
 
             return
 
+        # Only imported when the configuration is not loaded from the cache
+        from ConfigParser import ParsingError, SafeConfigParser
+
         parser = SafeConfigParser()
 
         try:
@@ -51,18 +121,117 @@ class Config(dict):
 
         cls._store_config(parser)
 
-    @staticmethod
-    def load_all():
-        """Load all configuration files available"""
+    @classmethod
+    def load_all(cls, origin=None, cache=True):
+        """Load all configuration files available
 
-        Config.load(Config.SYSTEM, quiet=True)
-        Config.load(Config.GLOBAL, quiet=True)
+        :param origin: the directory from which to look for the local
+            configuration file. Defaults to the current working directory
+        :type origin: str | None
+        :param cache: whether to use the compiled configuration cache
+        :type cache: bool
+        """
+
+        origin = os.getcwd() if origin is None else origin
+
+        try:
+            cache_path = os.path.join(get_cache_dir(), CACHE_FILENAME)
+        except OSError:
+            cache = False
 
-        local = reverse_find_file('.{}'.format(Config.FILENAME),
-                                  ignores=[Config.GLOBAL])
+        entries = cls._read_cache(cache_path) if cache else {}
+        entry = entries.get(origin)
+
+        if entry is not None and all(
+                get_stamp(path) == stamp for path, stamp in entry['stamps']):
+            cls._entries().update(entry['config'])
+            return
+
+        # Parse the files, and compile their content
+        previous = cls.snapshot()
+        cls.reset()
+
+        cls.load(cls.SYSTEM, quiet=True)
+        cls.load(cls.GLOBAL, quiet=True)
+
+        inspected = []
+        local = reverse_find_file('.{}'.format(cls.FILENAME), origin=origin,
+                                  ignores=[cls.GLOBAL], inspected=inspected)
+
+        if local is not None:
+            cls.load(local)
+
+        compiled = cls.snapshot()
+
+        cls.restore(previous)
+        cls._entries().update(compiled)
+
+        if not cache:
+            return
+
+        # A file created in (or removed from) a directory changes the stamp of
+        # the directory
+        paths = [cls.SYSTEM, cls.GLOBAL] + inspected
 
         if local is not None:
-            Config.load(local)
+            paths.append(local)
+
+        entries[origin] = {
+            'stamps': [(path, get_stamp(path)) for path in paths],
+            'config': compiled,
+            'timestamp': time.time(),
+        }
+
+        cls._write_cache(cache_path, entries)
+
+    @staticmethod
+    def _read_cache(path):
+        """Read the compiled configuration cache
+
+        Returns an empty cache if the file cannot be read.
+
+        :param path: the path to the cache file
+        :type path: str
+        :rtype: dict
+        """
+
+        try:
+            with open(path, 'rb') as cache_file:
+                data = marshal.load(cache_file)
+
+        except (IOError, EOFError, ValueError, TypeError):
+            return {}
+
+        # The marshal format depends on the version of Python
+        if not isinstance(data, dict) or data.get('version') != sys.version:
+            return {}
+
+        return data['entries']
+
+    @staticmethod
+    def _write_cache(path, entries):
+        """Write the compiled configuration cache
+
+        Only the most recently compiled entries are kept.
+
+        :param path: the path to the cache file
+        :type path: str
+        :param entries: working directory -> compiled configuration
+        :type entries: dict
+        """
+
+        if len(entries) > CACHE_SIZE:
+            recent = sorted(entries, key=lambda k: entries[k]['timestamp'])
+            entries = dict((key, entries[key])
+                           for key in recent[-CACHE_SIZE:])
+
+        try:
+            # Commands may run concurrently
+            data = {'version': sys.version, 'entries': entries}
+            write_atomically(path, functools.partial(marshal.dump, data), 'wb')
+
+        except (IOError, OSError):
+            pass
 
     @classmethod
     def get(cls, key, default=None):
@@ -78,7 +247,111 @@ class Config(dict):
         :rtype: str
         """
 
-        return cls.__config.get(key, default)
+        return cls._entries().get(key, default)
+
+    @classmethod
+    def get_int(cls, key, default=None):
+        """Return the configuration value associated with KEY as an integer
+
+        Returns DEFAULT if no value is associated with KEY.
+
+        :param key: the configuration key
+        :type key: str
+        :param default: the default value to return if key is not in the
+            configuration
+        :type default: int
+        :rtype: int
+        """
+
+        value = cls._entries().get(key)
+
+        if value is None:
+            return default
+
+        try:
+            return int(value)
+        except ValueError:
+            fail('{}: invalid integer value: {}'.format(key, value))
+
+    @classmethod
+    def get_float(cls, key, default=None):
+        """Return the configuration value associated with KEY as a float
+
+        Returns DEFAULT if no value is associated with KEY.
+
+        :param key: the configuration key
+        :type key: str
+        :param default: the default value to return if key is not in the
+            configuration
+        :type default: float
+        :rtype: float
+        """
+
+        value = cls._entries().get(key)
+
+        if value is None:
+            return default
+
+        try:
+            return float(value)
+        except ValueError:
+            fail('{}: invalid numeric value: {}'.format(key, value))
+
+    @classmethod
+    def get_bool(cls, key, default=None):
+        """Return the configuration value associated with KEY as a boolean
+
+        Accepts the same spellings as ConfigParser.getboolean (1/0, yes/no,
+        true/false, on/off). Returns DEFAULT if no value is associated with
+        KEY.
+
+        :param key: the configuration key
+        :type key: str
+        :param default: the default value to return if key is not in the
+            configuration
+        :type default: bool
+        :rtype: bool
+        """
+
+        value = cls._entries().get(key)
+
+        if value is None:
+            return default
+
+        if isinstance(value, bool):
+            return value
+
+        if value.lower() not in BOOLEAN_STATES:
+            fail('{}: invalid boolean value: {}'.format(key, value))
+
+        return BOOLEAN_STATES[value.lower()]
+
+    @classmethod
+    def reset(cls):
+        """Discard all configuration entries"""
+
+        cls._entries().clear()
+
+    @classmethod
+    def snapshot(cls):
+        """Return a copy of all configuration entries
+
+        :rtype: dict
+        """
+
+        return cls._entries().copy()
+
+    @classmethod
+    def restore(cls, snapshot):
+        """Replace all configuration entries with the content of SNAPSHOT
+
+        :param snapshot: configuration entries, as returned by snapshot()
+        :type snapshot: dict
+        """
+
+        entries = cls._entries()
+        entries.clear()
+        entries.update(snapshot)
 
     @classmethod
     def _store_config(cls, config):
@@ -92,7 +365,7 @@ class Config(dict):
 
         for section in config.sections():
             for option, value in config.items(section):
-                cls.__config['{}.{}'.format(section, option)] = value
+                cls._entries()['{}.{}'.format(section, option)] = value
 
     @classmethod
     def set(cls, key, value):
@@ -104,4 +377,4 @@ class Config(dict):
         :type value: str
         """
 
-        cls.__config[key] = value
+        cls._entries()[key] = value
@@ -0,0 +1,877 @@
+"""Persistent local daemon amortizing process startup and connections
+
+The daemon keeps the library imported, and the HTTP sessions (TLS connections
+and digest authentication) warm between invocations of the command-line
+tools. The git-cl and gerrit-accounts scripts act as thin clients: they
+forward their command line, working directory and environment over a Unix
+socket and relay the output. Terminal interactions (prompts, editor, pager)
+are performed by the client on behalf of the daemon.
+
+With --index, the daemon also maintains the local change index (see
+libpycr.gerrit.index) from the server's events stream. Commands run in the
+working directory and with the environment of the client, which are
+process-wide: the feeder of the index uses those of the last command (it
+does not send requests while they are replaced).
+
+The client side of this module only depends on the standard library so that
+forwarding a command does not pay for importing the rest of the package.
+
+Protocol: newline-delimited JSON messages. The client sends a "run" request
+and then serves "input", "password", "edit", "pager" and "pager-end" requests
+until it receives an "exit" message.
+"""
+
+import errno
+import json
+import os
+import socket
+import stat
+import sys
+
+
+# Environment variable overriding the socket location
+SOCKET_ENV = 'PYCR_DAEMON_SOCKET'
+
+# Environment variable disabling the use of the daemon by the clients
+DISABLE_ENV = 'PYCR_NO_DAEMON'
+
+# Message separator
+SEPARATOR = '\n'
+
+# Size of the output buffer, in bytes, before forwarding to the client
+OUTPUT_BUFFER_SIZE = 16 * 1024
+
+# Default inactivity delay, in seconds, after which the daemon exits
+DEFAULT_IDLE_TIMEOUT = 3600
+
+# The command-line tools served by the daemon: name -> (builtin module, type)
+TOOLS = {
+    'git-cl': ('libpycr.builtin.changes', 'GitClBuiltin'),
+    'gerrit-accounts': ('libpycr.builtin.accounts', 'GerritAccountBuiltin'),
+}
+
+
+def get_socket_path():
+    """Return the path to the daemon's Unix socket
+
+    :rtype: str
+    """
+
+    path = os.environ.get(SOCKET_ENV)
+
+    if path:
+        return path
+
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+
+    if not runtime_dir:
+        runtime_dir = os.path.join('/tmp', 'pycr-{}'.format(os.getuid()))
+
+    return os.path.join(runtime_dir, 'pycr-daemon.sock')
+
+
+def check_socket_path(path):
+    """Return why the daemon socket at PATH cannot be trusted, if it cannot
+
+    The socket and its directory must belong to the current user, and the
+    directory must not be accessible to the other users: otherwise, another
+    user could listen in place of the daemon, and collect the environment and
+    the passwords sent by the clients. The socket may not exist yet.
+
+    :param path: the path to the socket
+    :type path: str
+    :rtype: str | None
+    """
+
+    directory = os.path.dirname(os.path.abspath(path))
+
+    try:
+        info = os.lstat(directory)
+    except OSError as why:
+        return '{}: {}'.format(directory, why.strerror)
+
+    if (not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or
+            info.st_mode & 077):
+        return '{}: not a directory private to the current user'.format(
+            directory)
+
+    try:
+        info = os.lstat(path)
+    except OSError as why:
+        if why.errno == errno.ENOENT:
+            return None
+
+        return '{}: {}'.format(path, why.strerror)
+
+    if not stat.S_ISSOCK(info.st_mode) or info.st_uid != os.getuid():
+        return '{}: not a socket of the current user'.format(path)
+
+    return None
+
+
+def send_message(stream, message_type, **kwargs):
+    """Write a message on STREAM
+
+    :param stream: the stream to write to
+    :type stream: file
+    :param message_type: the type of message
+    :type message_type: str
+    :param **kwargs: the message payload
+    :type **kwargs: dict
+    """
+
+    kwargs['type'] = message_type
+    stream.write(json.dumps(kwargs) + SEPARATOR)
+    stream.flush()
+
+
+def read_message(stream):
+    """Read a message from STREAM
+
+    Returns None if the connection was closed.
+
+    :param stream: the stream to read from
+    :type stream: file
+    :rtype: dict | None
+    """
+
+    line = stream.readline()
+
+    if not line:
+        return None
+
+    return json.loads(line)
+
+
+def to_bytes(data):
+    """Encode DATA for writing on a byte stream
+
+    :param data: the data to encode
+    :type data: unicode | str
+    :rtype: str
+    """
+
+    if isinstance(data, unicode):
+        return data.encode('utf-8')
+
+    return data
+
+
+class Client(object):
+    """Thin client forwarding a command to the daemon"""
+
+    def __init__(self, path=None):
+        self.path = path or get_socket_path()
+
+        # The stream of the paged output (see libpycr.pager.PagerStream)
+        self._pager = None
+
+    def available(self):
+        """Whether a daemon may be listening
+
+        :rtype: bool
+        """
+
+        return (not os.environ.get(DISABLE_ENV) and
+                hasattr(socket, 'AF_UNIX') and os.path.exists(self.path))
+
+    def connect(self):
+        """Return a socket connected to the daemon, or None on error
+
+        Returns None as well if the socket cannot be trusted (see
+        check_socket_path).
+
+        :rtype: socket.socket | None
+        """
+
+        if not hasattr(socket, 'AF_UNIX') or not os.path.exists(self.path):
+            return None
+
+        if check_socket_path(self.path) is not None:
+            return None
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        try:
+            sock.connect(self.path)
+        except socket.error:
+            sock.close()
+            return None
+
+        return sock
+
+    def run(self, tool, argv):
+        """Forward the command to the daemon
+
+        Returns the exit status of the command, or None if the daemon is not
+        available (in which case the command must be run in-process).
+
+        :param tool: the name of the command-line tool (git-cl, ...)
+        :type tool: str
+        :param argv: the command-line arguments
+        :type argv: list[str]
+        :rtype: int | None
+        """
+
+        sock = self.connect() if self.available() else None
+
+        if sock is None:
+            return None
+
+        rfile = sock.makefile('rb')
+        wfile = sock.makefile('wb')
+
+        try:
+            send_message(wfile, 'run', tool=tool, argv=argv, cwd=os.getcwd(),
+                         env=dict(os.environ), isatty=sys.stdout.isatty())
+            return self._serve(rfile, wfile)
+
+        except socket.error:
+            if self._pager is None:
+                # The daemon went away before processing the command
+                return None
+            raise
+
+        finally:
+            self._stop_pager()
+            rfile.close()
+            wfile.close()
+            sock.close()
+
+    def stop(self):
+        """Request the daemon to exit
+
+        Returns False if no daemon is listening.
+
+        :rtype: bool
+        """
+
+        sock = self.connect()
+
+        if sock is None:
+            return False
+
+        wfile = sock.makefile('wb')
+        send_message(wfile, 'stop')
+        wfile.close()
+        sock.close()
+        return True
+
+    def _serve(self, rfile, wfile):
+        """Serve the daemon's requests until the command exits
+
+        :param rfile: the stream to read requests from
+        :type rfile: file
+        :param wfile: the stream to write replies to
+        :type wfile: file
+        :rtype: int | None
+        """
+
+        while True:
+            message = read_message(rfile)
+
+            if message is None:
+                raise socket.error('connection closed by the daemon')
+
+            kind = message['type']
+
+            if kind == 'busy':
+                return None
+
+            elif kind == 'exit':
+                return message['status']
+
+            elif kind == 'out':
+                self._write(to_bytes(message['data']))
+
+            elif kind == 'err':
+                sys.stdout.flush()
+                sys.stderr.write(to_bytes(message['data']))
+
+            elif kind == 'input':
+                sys.stdout.flush()
+                send_message(wfile, 'reply', value=raw_input(
+                    to_bytes(message['prompt'])))
+
+            elif kind == 'stdin':
+                send_message(wfile, 'reply', value=sys.stdin.read().decode(
+                    'utf-8', 'replace'))
+
+            elif kind == 'password':
+                import getpass
+                send_message(wfile, 'reply', value=getpass.getpass(
+                    to_bytes(message['prompt'])))
+
+            elif kind == 'edit':
+                from libpycr.editor import run_editor
+                send_message(wfile, 'reply', value=run_editor(
+                    message['editor'], to_bytes(message['default'])))
+
+            elif kind == 'pager':
+                import threading
+                from libpycr.pager import PagerStream
+                sys.stdout.flush()
+                self._pager = PagerStream(message['pager'],
+                                          threading.Event(), sys.stdout)
+
+            elif kind == 'pager-end':
+                self._stop_pager()
+
+    def _write(self, data):
+        """Write the output of the command to the pager or standard output
+
+        The pager is only spawned once the output overflows the terminal.
+        Once the user has quit the pager, the rest of the paged output is
+        dropped.
+
+        :param data: the output
+        :type data: str
+        """
+
+        if self._pager is None:
+            sys.stdout.write(data)
+            return
+
+        from libpycr.exceptions import PagerClosedError
+
+        try:
+            self._pager.write(data)
+        except PagerClosedError:
+            pass
+
+    def _stop_pager(self):
+        """Close the pager stream, if any
+
+        Output that fits on the screen is written to the terminal; otherwise,
+        waits for the user to quit the pager.
+        """
+
+        if self._pager is not None:
+            self._pager.close()
+            self._pager = None
+
+
+def client_main(tool):
+    """Forward the command to the daemon and exit with its status
+
+    Returns without doing anything if the daemon is not available, in which
+    case the caller falls back to the in-process path.
+
+    :param tool: the name of the command-line tool (git-cl, ...)
+    :type tool: str
+    """
+
+    try:
+        status = Client().run(tool, sys.argv[1:])
+    except KeyboardInterrupt:
+        sys.exit(os.linesep + 'Interruption caught...')
+
+    if status is not None:
+        sys.exit(status)
+
+
+class RemoteOutput(object):
+    """Output stream forwarding data to the client"""
+
+    def __init__(self, console, kind):
+        self._console = console
+        self._kind = kind
+        self._buffer = []
+        self._size = 0
+
+        # Used by the print statement
+        self.softspace = 0
+
+    def write(self, data):
+        """Buffer DATA to be sent to the client
+
+        :param data: the data to write
+        :type data: str
+        """
+
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+
+        self._buffer.append(data)
+        self._size += len(data)
+
+        if self._size >= OUTPUT_BUFFER_SIZE:
+            self.flush()
+
+    def writelines(self, lines):
+        """Buffer LINES to be sent to the client
+
+        :param lines: the lines to write
+        :type lines: collections.iterable[str]
+        """
+
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        """Send the buffered data to the client"""
+
+        if not self._buffer:
+            return
+
+        data = ''.join(self._buffer)
+        self._buffer = []
+        self._size = 0
+
+        self._console.send(self._kind, data=data.decode('utf-8', 'replace'))
+
+    def isatty(self):
+        """Whether the client's output is a terminal
+
+        :rtype: bool
+        """
+
+        return self._console.isatty
+
+
+class RemoteConsole(object):
+    """Console performing the terminal interactions on the client side
+
+    See libpycr.utils.system.set_console.
+    """
+
+    def __init__(self, rfile, wfile, isatty):
+        self._rfile = rfile
+        self._wfile = wfile
+        self.isatty = isatty
+
+        self.stdout = RemoteOutput(self, 'out')
+        self.stderr = RemoteOutput(self, 'err')
+
+    def send(self, message_type, **kwargs):
+        """Send a message to the client
+
+        :param message_type: the type of message
+        :type message_type: str
+        :param **kwargs: the message payload
+        :type **kwargs: dict
+        """
+
+        send_message(self._wfile, message_type, **kwargs)
+
+    def _request(self, message_type, **kwargs):
+        """Send a request to the client and return its reply
+
+        :param message_type: the type of message
+        :type message_type: str
+        :param **kwargs: the message payload
+        :type **kwargs: dict
+        :rtype: str
+        """
+
+        self.flush()
+        self.send(message_type, **kwargs)
+        reply = read_message(self._rfile)
+
+        if reply is None:
+            raise KeyboardInterrupt()
+
+        return to_bytes(reply['value'])
+
+    def flush(self):
+        """Flush the output streams"""
+
+        self.stdout.flush()
+        self.stderr.flush()
+
+    def read_input(self, prompt):
+        """Read a line of user input on the client side
+
+        :param prompt: the prompt to display
+        :type prompt: str
+        :rtype: str
+        """
+
+        return self._request('input', prompt=prompt)
+
+    def read_password(self, prompt):
+        """Read a password on the client side
+
+        :param prompt: the prompt to display
+        :type prompt: str
+        :rtype: str
+        """
+
+        return self._request('password', prompt=prompt)
+
+    def read_stdin(self):
+        """Read the whole standard input of the client
+
+        :rtype: str
+        """
+
+        return self._request('stdin')
+
+    def edit(self, editor, default):
+        """Fire EDITOR on the client side and return the resulting content
+
+        :param editor: the editor to use
+        :type editor: str
+        :param default: the initital content of the editor
+        :type default: str | None
+        :rtype: str
+        """
+
+        return self._request('edit', editor=editor, default=default or '')
+
+    def start_pager(self, pager):
+        """Page the output on the client side
+
+        :param pager: the pager command
+        :type pager: str
+        """
+
+        if self.isatty:
+            self.flush()
+            self.send('pager', pager=pager)
+
+    def stop_pager(self):
+        """Stop paging the output on the client side"""
+
+        if self.isatty:
+            self.flush()
+            self.send('pager-end')
+
+
+class Daemon(object):
+    """Serve the command-line tools requests"""
+
+    def __init__(self, path=None, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 index=False):
+        # Deferred imports: keep the client side of this module lightweight
+        import logging
+        import threading
+        import time
+
+        from libpycr.utils.system import ThreadLocalStream
+
+        self.log = logging.getLogger(__name__)
+        self.path = path or get_socket_path()
+        self.idle_timeout = idle_timeout
+
+        self._time = time.time
+        self._last_activity = time.time()
+
+        # Commands rely on process-wide state (configuration, working
+        # directory, environment): they are run one at a time. Clients
+        # connecting while a command is running fall back to the in-process
+        # path.
+        self._lock = threading.Lock()
+        self._server = None
+
+        # The working directory and environment are those of the command
+        # being run: they are replaced holding this lock, which the other
+        # threads (the index feeder) hold while they rely on them
+        self._environ_lock = threading.Lock()
+
+        # Route the output of the command to the client connection that
+        # requested it
+        self._stdout = ThreadLocalStream(sys.stdout)
+        self._stderr = ThreadLocalStream(sys.stderr)
+
+        self._builtins = {}
+        self._feeder = None
+
+        if index:
+            self._feeder = self._create_feeder()
+
+        for tool, (module, builtin_type) in TOOLS.items():
+            self._builtins[tool] = self._load_builtins(module, builtin_type)
+
+    @staticmethod
+    def _load_builtins(module_name, type_name):
+        """Import the builtins of a command-line tool
+
+        :param module_name: the package that contains the builtins
+        :type module_name: str
+        :param type_name: the name of the builtin type in libpycr.meta
+        :type type_name: str
+        :rtype: type
+        """
+
+        import importlib
+        import libpycr.meta
+
+        module = importlib.import_module(module_name)
+
+        for name in module.__all__:
+            importlib.import_module('{}.{}'.format(module_name, name))
+
+        return getattr(libpycr.meta, type_name)
+
+    def _create_feeder(self):
+        """Create the feeder of the change index of the configured server
+
+        The configuration is loaded from the daemon's working directory.
+
+        :rtype: libpycr.gerrit.index.IndexFeeder
+        """
+
+        from libpycr.config import Config
+        from libpycr.gerrit.index import IndexFeeder, get_index_path
+        from libpycr.utils.system import fail
+
+        Config.load_all()
+
+        path = get_index_path()
+
+        if path is None:
+            fail('gerrit.host not set: cannot create the change index')
+
+        return IndexFeeder(path, Config.snapshot(), self._lock,
+                           self._environ_lock)
+
+    def serve_forever(self):
+        """Listen for client requests until stopped"""
+
+        import SocketServer
+        import threading
+
+        daemon = self
+
+        class Handler(SocketServer.StreamRequestHandler):
+            """Handle one client connection"""
+
+            def handle(self):
+                daemon.handle(self.rfile, self.wfile)
+
+        class Server(SocketServer.ThreadingMixIn,
+                     SocketServer.UnixStreamServer):
+            """Threaded Unix socket server"""
+
+            daemon_threads = True
+
+        from libpycr.utils.system import fail
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0700)
+
+        # Do not reuse a directory (or socket) created by another user
+        reason = check_socket_path(self.path)
+
+        if reason is not None:
+            fail('refusing to listen on {}'.format(self.path), reason)
+
+        if os.path.exists(self.path):
+            if Client(self.path).connect() is not None:
+                fail('daemon already running on {}'.format(self.path))
+
+            os.unlink(self.path)
+
+        # Only the current user is allowed to connect
+        umask = os.umask(0177)
+        try:
+            self._server = Server(self.path, Handler)
+        finally:
+            os.umask(umask)
+
+        sys.stdout, sys.stderr = self._stdout, self._stderr
+
+        watchdog = threading.Thread(target=self._watchdog)
+        watchdog.daemon = True
+        watchdog.start()
+
+        if self._feeder is not None:
+            self._feeder.start()
+
+        self.log.debug('Listening on %s', self.path)
+
+        try:
+            self._server.serve_forever()
+        finally:
+            sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+            self._server.server_close()
+
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def stop(self):
+        """Stop serving requests"""
+
+        if self._server is not None:
+            self._server.shutdown()
+
+    def _watchdog(self):
+        """Stop the daemon after idle_timeout seconds of inactivity"""
+
+        import time
+
+        while True:
+            time.sleep(min(self.idle_timeout, 60))
+
+            if self._lock.locked():
+                continue
+
+            if self._time() - self._last_activity >= self.idle_timeout:
+                self.log.debug('Idle timeout reached, exiting')
+                self.stop()
+                return
+
+    def handle(self, rfile, wfile):
+        """Handle a client connection
+
+        :param rfile: the stream to read requests from
+        :type rfile: file
+        :param wfile: the stream to write replies to
+        :type wfile: file
+        """
+
+        request = read_message(rfile)
+
+        if request is None:
+            return
+
+        if request['type'] == 'stop':
+            # shutdown() blocks until serve_forever() returns: do not wait
+            # from the handler thread
+            import threading
+            threading.Thread(target=self.stop).start()
+            return
+
+        if not self._lock.acquire(False):
+            send_message(wfile, 'busy')
+            return
+
+        try:
+            self._last_activity = self._time()
+            console = RemoteConsole(rfile, wfile, request.get('isatty'))
+            status = self.execute(request, console)
+            console.flush()
+            send_message(wfile, 'exit', status=status)
+
+        except Exception:  # pylint: disable=broad-except
+            # Most likely the client went away (Ctrl-C, closed pager)
+            self.log.debug('Command aborted', exc_info=True)
+
+        finally:
+            self._last_activity = self._time()
+            self._lock.release()
+
+    def execute(self, request, console):
+        """Run the requested command and return its exit status
+
+        :param request: the "run" request
+        :type request: dict
+        :param console: the console of the client
+        :type console: RemoteConsole
+        :rtype: int
+        """
+
+        import logging
+
+        from libpycr.config import Config
+        from libpycr.main import builtin_main
+        from libpycr.utils.output import Formatter
+        from libpycr.utils.system import set_console
+
+        tool = request['tool']
+
+        if tool not in self._builtins:
+            console.stderr.write('unknown tool: {}{}'.format(tool, os.linesep))
+            return 1
+
+        # Reproduce the client's process state. The working directory and
+        # environment are process-wide: the other threads of the daemon see
+        # those of the last command.
+        with self._environ_lock:
+            os.chdir(request['cwd'])
+            os.environ.clear()
+            os.environ.update(dict((to_bytes(k), to_bytes(v))
+                                   for k, v in request['env'].items()))
+        sys.argv = [tool] + [to_bytes(a) for a in request['argv']]
+
+        # Discard per-command state. HTTP sessions are kept: they are looked
+        # up by server and identity (see RequestFactory.get_session).
+        Config.reset()
+        Formatter.formatter = None
+        logging.getLogger().setLevel(logging.WARNING)
+
+        self._stdout.redirect(console.stdout)
+        self._stderr.redirect(console.stderr)
+        set_console(console)
+
+        try:
+            builtin_main(self._builtins[tool])
+            status = 0
+
+        except SystemExit as why:
+            if why.code is None or isinstance(why.code, int):
+                status = why.code or 0
+            else:
+                console.stderr.write('{}{}'.format(why.code, os.linesep))
+                status = 1
+
+        finally:
+            set_console(None)
+            self._stdout.redirect(None)
+            self._stderr.redirect(None)
+
+        return status
+
+
+def daemon_main():
+    """pycr-daemon entry point"""
+
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Gerrit Code Review command line tools daemon')
+    parser.add_argument(
+        'action', nargs='?', default='run',
+        choices=('run', 'start', 'stop', 'status'),
+        help='run in the foreground, start in the background, stop or query '
+             'the daemon (default: run)')
+    parser.add_argument(
+        '--socket', default=None,
+        help='path to the Unix socket (default: {})'.format(get_socket_path()))
+    parser.add_argument(
+        '--idle-timeout', type=int, default=DEFAULT_IDLE_TIMEOUT,
+        help='exit after this many seconds of inactivity (default: %(default)s)')
+    parser.add_argument(
+        '--index', default=False, action='store_true',
+        help='maintain the local change index of the current repository\'s '
+             'server from its events stream (requires SSH access)')
+    parser.add_argument(
+        '--debug', default=False, action='store_true', help=argparse.SUPPRESS)
+
+    cmdline = parser.parse_args()
+
+    if cmdline.debug:
+        import logging
+        logging.basicConfig(
+            format='[%(asctime)s %(name)-20s] %(message)s', datefmt='%H:%M:%S',
+            level=logging.DEBUG)
+
+    client = Client(cmdline.socket)
+
+    if cmdline.action == 'stop':
+        sys.exit(0 if client.stop() else 'no daemon running')
+
+    if cmdline.action == 'status':
+        running = client.connect() is not None
+        print 'running' if running else 'stopped'
+        sys.exit(0 if running else 1)
+
+    daemon = Daemon(cmdline.socket, cmdline.idle_timeout, cmdline.index)
+
+    if cmdline.action == 'start' and os.fork():
+        # Parent process: the child serves the requests
+        return
+
+    if cmdline.action == 'start':
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,206 @@
+"""Timeouts and deadlines of the requests sent to Gerrit
+
+Each request is sent with a connection timeout and a read timeout (the
+maximum time to wait for the server between two bytes of the response). A
+deadline bounds the total time spent by a set of requests, retries included:
+once it has passed, pending requests fail with DeadlineExceededError, and the
+concurrent calls of libpycr.utils.parallel.imap are cancelled, so that the
+results received until then can be reported.
+
+Configuration ([http] section):
+
+    connecttimeout = 10  ; connection timeout, in seconds (0: none)
+    readtimeout = 60     ; read timeout, in seconds (0: none)
+    timeout = 0          ; deadline of each command, in seconds (0: none)
+"""
+
+import functools
+import threading
+import time
+import types
+
+from libpycr.config import Config
+from libpycr.exceptions import DeadlineExceededError
+from libpycr.utils.system import get_local, set_local
+
+
+# Default values for the [http] configuration section
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 60.0
+
+# Smallest timeout, in seconds, of a request sent just before the deadline
+MIN_TIMEOUT = 0.001
+
+
+def get_timeouts(config=Config):
+    """Return the connection and read timeouts of the requests
+
+    The timeouts are capped to the time left before the deadline of the
+    current thread, if any.
+
+    :param config: the configuration to read the settings from
+    :type config: Config
+    :rtype: (float | None, float | None)
+    """
+
+    connect = config.get_float('http.connecttimeout',
+                               DEFAULT_CONNECT_TIMEOUT) or None
+    read = config.get_float('http.readtimeout', DEFAULT_READ_TIMEOUT) or None
+
+    deadline = Deadline.current()
+
+    if deadline is None or deadline.expires is None:
+        return connect, read
+
+    # A timeout of 0 is rejected by requests
+    remaining = max(deadline.remaining(), MIN_TIMEOUT)
+
+    return min(connect or remaining, remaining), min(read or remaining,
+                                                     remaining)
+
+
+class Deadline(object):
+    """Time budget shared by a set of requests
+
+    Use as a context manager: the requests sent from the current thread, and
+    from the worker threads it starts with libpycr.utils.parallel.imap, are
+    then bound by the deadline. Deadlines nest: an inner deadline does not
+    extend the budget of the outer one.
+    """
+
+    def __init__(self, timeout=None):
+        """Constructor
+
+        :param timeout: the budget, in seconds, from now (None: unlimited)
+        :type timeout: float | None
+        """
+
+        self.expires = time.time() + timeout if timeout is not None else None
+
+        # Per-thread stack of the deadlines in use before this one
+        self._local = threading.local()
+
+    @classmethod
+    def from_config(cls, config=Config):
+        """Create the deadline of a command from the configuration
+
+        :param config: the configuration to read the settings from
+        :type config: Config
+        :rtype: Deadline
+        """
+
+        return cls(config.get_float('http.timeout', 0) or None)
+
+    @staticmethod
+    def current():
+        """Return the deadline of the current thread, if any
+
+        :rtype: Deadline | None
+        """
+
+        return get_local('deadline')
+
+    def remaining(self):
+        """Return the time left, in seconds (None if unlimited)
+
+        :rtype: float | None
+        """
+
+        if self.expires is None:
+            return None
+
+        return max(0.0, self.expires - time.time())
+
+    def expired(self):
+        """Whether the deadline has passed
+
+        :rtype: bool
+        """
+
+        return self.expires is not None and time.time() >= self.expires
+
+    def allows(self, delay):
+        """Whether waiting DELAY seconds leaves time before the deadline
+
+        :param delay: the delay, in seconds
+        :type delay: float
+        :rtype: bool
+        """
+
+        return self.expires is None or time.time() + delay < self.expires
+
+    def check(self):
+        """Raise DeadlineExceededError if the deadline has passed
+
+        :raise: DeadlineExceededError if the deadline has passed
+        """
+
+        if self.expired():
+            raise DeadlineExceededError()
+
+    def __enter__(self):
+        outer = self.current()
+
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+
+        self._local.stack.append(outer)
+
+        if outer is None or (self.expires is not None and (
+                outer.expires is None or self.expires < outer.expires)):
+            set_local('deadline', self)
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        set_local('deadline', self._local.stack.pop())
+
+
+def with_deadline(function):
+    """Decorator adding the timeout and deadline keyword arguments
+
+    TIMEOUT is the budget, in seconds, of the call; DEADLINE a deadline shared
+    with other calls. Both bound the requests sent by FUNCTION, or by the
+    iteration of the generator it returns.
+
+    :param function: the function to decorate
+    :type function: callable
+    :rtype: callable
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        """Call FUNCTION within its deadlines"""
+
+        deadlines = [Deadline(kwargs.pop('timeout', None)),
+                     kwargs.pop('deadline', None) or Deadline()]
+
+        with deadlines[0], deadlines[1]:
+            result = function(*args, **kwargs)
+
+        if isinstance(result, types.GeneratorType):
+            return _iterate(result, deadlines)
+
+        return result
+
+    return wrapper
+
+
+def _iterate(generator, deadlines):
+    """Run each step of GENERATOR within DEADLINES
+
+    :param generator: the generator
+    :type generator: generator
+    :param deadlines: the deadlines
+    :type deadlines: list[Deadline]
+    :rtype: collections.iterable
+    """
+
+    while True:
+        with deadlines[0], deadlines[1]:
+            try:
+                item = next(generator)
+            except StopIteration:
+                return
+
+        yield item
@@ -0,0 +1,220 @@
+"""JSON decoding backends used by the request factory
+
+Gerrit Code Review prefixes every JSON response with a magic line to prevent
+Cross Site Script Inclusion (XSSI) attacks. Backends decode the response body
+in place, starting right after that prefix, so that the (potentially large)
+body is never copied before being decoded.
+
+The backend is selected with the json.backend configuration key:
+
+    [json]
+    backend = auto      ; auto (default), orjson, ujson, simplejson or json
+
+With "auto", the fastest installed backend is used, in this order: orjson,
+ujson, simplejson, and the json module of the standard library.
+"""
+
+import json
+import logging
+
+from libpycr.config import Config
+from libpycr.utils.system import fail
+
+
+# Default value for json.backend
+DEFAULT_BACKEND = 'auto'
+
+# Order of preference of the backends for json.backend = auto
+PREFERENCES = ('orjson', 'ujson', 'simplejson', 'json')
+
+# Registered backends: name -> factory
+_BACKENDS = {}
+
+# Decode functions, by backend name (None if the backend is not installed)
+_decoders = {}
+
+# Logger
+log = logging.getLogger(__name__)
+
+
+def register_backend(name, factory):
+    """Register a new JSON decoding backend
+
+    The factory is called without argument the first time the backend is
+    used. It must return a function decoding the JSON document that starts at
+    a given offset of a byte string, or raise ImportError if the backend is
+    not available:
+
+        decode(data, offset) -> object
+
+    :param name: the name of the backend (value of json.backend)
+    :type name: str
+    :param factory: the decode function factory
+    :type factory: callable
+    """
+
+    _BACKENDS[name] = factory
+    _decoders.pop(name, None)
+
+
+def get_backends():
+    """Return the names of all registered backends
+
+    :rtype: tuple[str]
+    """
+
+    return tuple(sorted(_BACKENDS))
+
+
+def get_decoder(name):
+    """Return the decode function of backend NAME
+
+    Returns None if the backend is not installed.
+
+    :param name: the name of the backend
+    :type name: str
+    :rtype: callable | None
+    """
+
+    if name not in _decoders:
+        try:
+            _decoders[name] = _BACKENDS[name]()
+        except ImportError:
+            log.debug('JSON backend %s is not available', name)
+            _decoders[name] = None
+
+    return _decoders[name]
+
+
+def get_backend(config=Config):
+    """Return the name and decode function of the selected backend
+
+    :param config: the configuration to read the settings from
+    :type config: Config
+    :rtype: str, callable
+    """
+
+    name = config.get('json.backend', DEFAULT_BACKEND)
+
+    if name == 'auto':
+        for candidate in PREFERENCES:
+            if candidate in _BACKENDS and get_decoder(candidate) is not None:
+                return candidate, get_decoder(candidate)
+
+        fail('no JSON backend available')
+
+    if name not in _BACKENDS:
+        fail('unknown json.backend: {} (expected one of: auto, {})'.format(
+            name, ', '.join(get_backends())))
+
+    decoder = get_decoder(name)
+
+    if decoder is None:
+        fail('json.backend = {0} requires the {0} package'.format(name))
+
+    return name, decoder
+
+
+def decode(data, offset=0, config=Config):
+    """Decode the JSON document starting at OFFSET in DATA
+
+    :param data: the raw (UTF-8 encoded) document
+    :type data: str
+    :param offset: the position of the document in DATA
+    :type offset: int
+    :param config: the configuration to read the settings from
+    :type config: Config
+    :rtype: object
+    :raise: ValueError if the document is not valid JSON
+    """
+
+    return get_backend(config)[1](data, offset)
+
+
+def _raw_decode_backend(module):
+    """Build a decode function from a module providing json.JSONDecoder
+
+    JSONDecoder.raw_decode decodes in place, starting at any offset.
+
+    :param module: json or simplejson
+    :type module: module
+    :rtype: callable
+    """
+
+    decoder = module.JSONDecoder()
+    whitespace = ' \t\n\r'
+
+    def decode_function(data, offset):
+        """Decode the document starting at OFFSET in DATA"""
+
+        obj, end = decoder.raw_decode(data, offset)
+
+        # raw_decode ignores trailing data: only accept whitespace
+        if data[end:].strip(whitespace):
+            raise ValueError('extra data after JSON document at offset %d' %
+                             end)
+
+        return obj
+
+    return decode_function
+
+
+def json_backend():
+    """Return the decode function of the standard library backend
+
+    :rtype: callable
+    """
+
+    return _raw_decode_backend(json)
+
+
+def simplejson_backend():
+    """Return the decode function of the simplejson backend
+
+    :rtype: callable
+    """
+
+    import simplejson
+    return _raw_decode_backend(simplejson)
+
+
+def ujson_backend():
+    """Return the decode function of the ujson backend
+
+    ujson cannot decode from an offset: the prefix is sliced off, which
+    copies the document.
+
+    :rtype: callable
+    """
+
+    import ujson
+
+    def decode_function(data, offset):
+        """Decode the document starting at OFFSET in DATA"""
+        return ujson.loads(data[offset:] if offset else data)
+
+    return decode_function
+
+
+def orjson_backend():
+    """Return the decode function of the orjson backend
+
+    orjson decodes memoryview objects: the prefix is skipped without copying
+    the document.
+
+    :rtype: callable
+    """
+
+    import orjson
+
+    def decode_function(data, offset):
+        """Decode the document starting at OFFSET in DATA"""
+        return orjson.loads(memoryview(data)[offset:] if offset else data)
+
+    return decode_function
+
+
+register_backend('json', json_backend)
+register_backend('simplejson', simplejson_backend)
+register_backend('ujson', ujson_backend)
+register_backend('orjson', orjson_backend)
@@ -5,6 +5,7 @@ import subprocess
 import tempfile
 
 from libpycr.config import Config
+from libpycr.utils.system import get_console
 
 
 def get_editor():
@@ -36,13 +37,29 @@ def raw_input_editor(default=None):
     Like the built-in raw_input(), except that it uses a visual text editor for
     ease of editing.
 
-    :param editor: the editor to use
-    :type editor: str
     :param default: the initital content of the editor
     :type default: str | None
+    :rtype: str
     """
 
     editor = Config.get('core.editor', get_editor())
+    console = get_console()
+
+    if console is not None:
+        return console.edit(editor, default)
+
+    return run_editor(editor, default)
+
+
+def run_editor(editor, default=None):
+    """Fire EDITOR on a temporary file and return the resulting content
+
+    :param editor: the editor to use
+    :type editor: str
+    :param default: the initital content of the editor
+    :type default: str | None
+    :rtype: str
+    """
 
     with tempfile.NamedTemporaryFile(mode='r+', delete=False) as tmpfile:
         if default:
@@ -24,6 +24,11 @@ class NoSuchChangeError(PyCRError):
     pass
 
 
+class NoSuchGroupError(PyCRError):
+    """Exception raised on attempt to manipulate an invalid group"""
+    pass
+
+
 class QueryError(PyCRError):
     """Exception raised on an invalid query"""
     pass
@@ -43,8 +48,32 @@ class RequestError(PyCRError):
         super(RequestError, self).__init__(message, cause)
 
 
+class NetworkError(PyCRError):
+    """Exception raised when the server cannot be reached"""
+    pass
+
+
+class InvalidResponseError(PyCRError):
+    """Exception raised when the server response cannot be decoded"""
+    pass
+
+
 class UnexpectedError(PyCRError):
     """Exception raised when an unexpected error occured"""
 
     def __init__(self, cause=None):
         super(UnexpectedError, self).__init__('unexpected error', cause)
+
+
+class PagerClosedError(PyCRError):
+    """Exception raised on attempt to write to a pager the user has quit"""
+
+    def __init__(self):
+        super(PagerClosedError, self).__init__('pager closed')
+
+
+class DeadlineExceededError(PyCRError):
+    """Exception raised when the time budget of a request is spent"""
+
+    def __init__(self, cause=None):
+        super(DeadlineExceededError, self).__init__('deadline exceeded', cause)
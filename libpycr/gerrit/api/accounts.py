@@ -12,6 +12,19 @@ def base_query():
     return '{}/accounts/'.format(RequestFactory.get_remote_base_url())
 
 
+def search_query(query):
+    """Return an URL to Gerrit
+
+    This URL contains the account query to perform.
+
+    :param query: the query to perform
+    :type query: Query
+    :rtype: str
+    """
+
+    return '{}?q={}'.format(base_query(), query.encode())
+
+
 def account(account_id):
     """Return an URL to Gerrit for an account
 
@@ -1,5 +1,6 @@
 """Change related REST endpoints"""
 
+from libpycr.gerrit.query import Query, encode_queries
 from libpycr.http import RequestFactory
 
 
@@ -163,7 +164,8 @@ def reviewer(change_id, account_id):
 # Allow re-use of 'reviewer' name as keyword argument.
 
 
-def search_query_attr(status=None, owner=None, reviewer=None, watched=None):
+def search_query_attr(status=None, owner=None, reviewer=None, watched=None,
+                      query=None):
     """Create a search query compatible with Gerrit Code Review queries
 
     :param status: the status of changes
@@ -174,27 +176,32 @@ def search_query_attr(status=None, owner=None, reviewer=None, watched=None):
     :type reviewer: str
     :param watched: whether the change should be in the watched list or not
     :type watched: str
-    :rtype: str
+    :param query: additional criteria
+    :type query: Query | None
+    :rtype: Query | None
     """
 
     buf = []
 
     if status is not None:
-        buf.append('status:%s' % status)
+        buf.append(Query.status(status))
 
     if owner is not None:
-        buf.append('owner:%s' % owner)
+        buf.append(Query.owner(owner))
 
     if reviewer is not None:
-        buf.append('reviewer:%s' % reviewer)
+        buf.append(Query.reviewer(reviewer))
 
     if watched is not None:
-        buf.append('is:watched')
+        buf.append(Query.is_state('watched'))
+
+    buf.append(query)
 
-    return '+'.join(buf)
+    return Query.all(*buf)
 
 
-def search_query(status=None, owner=None, reviewer=None, watched=None):
+def search_query(status=None, owner=None, reviewer=None, watched=None,
+                 query=None):
     """Return an URL to Gerrit
 
     This URL contains the query to perform.
@@ -205,13 +212,33 @@ def search_query(status=None, owner=None, reviewer=None, watched=None):
     :type owner: str
     :param reviewer: the reviewer of changes
     :type reviewer: str
+    :param watched: whether the change should be in the watched list or not
+    :type watched: str
+    :param query: additional criteria
+    :type query: Query | None
     :rtype: str
     """
 
-    # NOTE: We can't use the params= parameter of the requests.get
-    # method because this would encode the query string and prevent
-    # Gerrit from parsing it
+    # NOTE: We don't use the params= parameter of the requests.get method:
+    # Query.encode keeps the operators readable in logs and traces
+
+    query = search_query_attr(status=status, owner=owner, reviewer=reviewer,
+                              watched=watched, query=query)
+
+    if query is None:
+        return base_query()
+
+    return '{}?q={}'.format(base_query(), query.encode())
+
+
+def multi_search_query(queries):
+    """Return an URL to Gerrit
+
+    This URL contains several queries, performed in a single request.
+
+    :param queries: the queries to perform
+    :type queries: list[Query]
+    :rtype: str
+    """
 
-    return '{}?q={}'.format(
-        base_query(), search_query_attr(status=status, owner=owner,
-                                        reviewer=reviewer, watched=watched))
+    return '{}?{}'.format(base_query(), encode_queries(queries))
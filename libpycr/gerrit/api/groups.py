@@ -0,0 +1,40 @@
+"""Group related REST endpoints"""
+
+import urllib
+
+from libpycr.http import RequestFactory
+
+
+def base_query():
+    """Return an URL to Gerrit
+
+    :rtype: str
+    """
+
+    return '{}/groups/'.format(RequestFactory.get_remote_base_url())
+
+
+def group(group_id):
+    """Return an URL to Gerrit for a group
+
+    :param group_id: identifier that uniquely identifies one group (UUID,
+        legacy numeric ID, or name)
+    :type group_id: str
+    :rtype: str
+    """
+
+    return base_query() + urllib.quote(group_id, safe='')
+
+
+def members(group_id):
+    """Return an URL to Gerrit for the members of a group
+
+    The members of the included groups are listed as well.
+
+    :param group_id: identifier that uniquely identifies one group (UUID,
+        legacy numeric ID, or name)
+    :type group_id: str
+    :rtype: str
+    """
+
+    return '{}/members/?recursive'.format(group(group_id))
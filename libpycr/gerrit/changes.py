@@ -1,10 +1,12 @@
 """This module provides routine to manipulate Gerrit Code Review Change-Ids"""
 
+import itertools
 import re
 
-from libpycr.exceptions import NoSuchChangeError
+from libpycr.exceptions import DeadlineExceededError, NoSuchChangeError
 from libpycr.gerrit.client import Gerrit
 from libpycr.http import RequestFactory
+from libpycr.utils.parallel import imap
 from libpycr.utils.system import fail, warn
 
 
@@ -33,7 +35,7 @@ def expand_change_range(change):
     return range(int(lower), int(upper) + 1)
 
 
-def fetch_change_list(change_list):
+def fetch_change_list(change_list, fields=None):
     """Convert a list of changes or change ranges into a list of ChangeInfo
 
     The input list accepts the following string elements:
@@ -44,6 +46,8 @@ def fetch_change_list(change_list):
 
     :param change_list: the list of changes
     :type change_list: list[str]
+    :param fields: the fields to fetch (see Gerrit.get_change)
+    :type fields: FieldMask | None
     :rtype: list[ChangeInfo]
     """
 
@@ -57,27 +61,33 @@ def fetch_change_list(change_list):
         else:
             warn('invalid Change-Id: %s' % change)
 
-    change_infos = []
+    # Fetch the changes concurrently. Keep the changes fetched before the
+    # deadline, if any.
+    results = imap(lambda change_id: Gerrit.get_change(change_id, fields),
+                   change_ids,
+                   catch=(NoSuchChangeError, DeadlineExceededError))
+    changes = []
 
-    for change_id in change_ids:
-        try:
-            change_infos.append(Gerrit.get_change(change_id))
+    for change_id, (change, error) in itertools.izip(change_ids, results):
+        if isinstance(error, DeadlineExceededError):
+            warn('%s: cannot fetch change' % change_id, error)
+        elif error is None:
+            changes.append(change)
 
-        except NoSuchChangeError:
-            pass
-
-    return change_infos
+    return changes
 
 
-def fetch_change_list_or_fail(change_list):
+def fetch_change_list_or_fail(change_list, fields=None):
     """Same as fetch_change_list, but fail if the final change list is empty
 
     :param change_list: the list of changes
     :type change_list: list[str]
+    :param fields: the fields to fetch (see Gerrit.get_change)
+    :type fields: FieldMask | None
     :rtype: list[ChangeInfo]
     """
 
-    changes = fetch_change_list(change_list)
+    changes = fetch_change_list(change_list, fields)
 
     # If no correct changes found
     if not changes:
@@ -1,21 +1,38 @@
 """Gerrit Code Review HTTP API client"""
 
+import functools
 import json
 import logging
+import threading
+import types
 
+from libpycr.config import Config
+from libpycr.deadline import with_deadline
 from libpycr.exceptions import (
-    ConflictError, NoSuchChangeError, RequestError, UnexpectedError)
+    ConflictError, NoSuchChangeError, NoSuchGroupError, RequestError,
+    UnexpectedError)
 from libpycr.exceptions import PyCRError, QueryError
-from libpycr.http import RequestFactory, BASE64
-from libpycr.gerrit.api import accounts, changes
+from libpycr.http import RequestFactory, SessionPool, BASE64
+from libpycr.gerrit import fields as field_masks
+from libpycr.gerrit.api import accounts, changes, groups
+from libpycr.gerrit.index import ChangeIndex
 from libpycr.gerrit.entities import (
-    AccountInfo, CapabilityInfo, ChangeInfo, DiffPreferencesInfo, EmailInfo,
-    GroupInfo, ReviewInfo, ReviewerInfo, SshKeyInfo)
+    AccountInfo, AccountPool, CapabilityInfo, ChangeInfo, DiffPreferencesInfo,
+    EmailInfo, GroupInfo, ReviewInfo, ReviewerInfo, SshKeyInfo)
 from libpycr.utils.system import confirm, info
 
 
+# Number of changes per request when streaming search results
+DEFAULT_PAGE_SIZE = 500
+
+
 class Gerrit(object):
-    """Provides Gerrit Code Review HTTP low level API implementation"""
+    """Provides Gerrit Code Review HTTP low level API implementation
+
+    All methods that send requests accept the keyword arguments timeout (the
+    budget of the call, in seconds) and deadline (a Deadline shared with
+    other calls): see libpycr.deadline.
+    """
 
     # Logger
     log = logging.getLogger(__name__)
@@ -34,8 +51,21 @@ class Gerrit(object):
         return ('open', 'merged', 'abandoned', 'closed', 'reviewed',
                 'submitted')
 
+    @staticmethod
+    def get_query_params(fields):
+        """Return the query parameters to request FIELDS with
+
+        :param fields: the fields to request
+        :type fields: FieldMask
+        :rtype: dict
+        """
+
+        options = fields.options
+        return {'o': options} if options else {}
+
     @classmethod
-    def list_watched_changes(cls, status='open'):
+    @with_deadline
+    def list_watched_changes(cls, status='open', fields=None, query=None):
         """List user's watched changes
 
         Sends a GET request to Gerrit to fetch the list of changes with the
@@ -45,6 +75,10 @@ class Gerrit(object):
         :type status: str
         :param owner: the account_id of the owner of the changes
         :type owner: str
+        :param fields: the fields to fetch (default: field_masks.SUMMARY)
+        :type fields: FieldMask | None
+        :param query: additional search criteria
+        :type query: Query | None
         :rtype: tuple[ChangeInfo]
         :raise: NoSuchChangeError if no change match the query criterion
         :raise: PyCRError on any other error
@@ -52,34 +86,201 @@ class Gerrit(object):
 
         cls.log.debug('Watched changes lookup with status:%s', status)
 
-        try:
-            endpoint = changes.search_query(status=status, watched=True)
+        return cls.search_changes(
+            changes.search_query_attr(status=status, watched=True,
+                                      query=query), fields)
 
-            # DETAILED_ACCOUNTS option ensures that the owner email address is
-            # sent in the response
-            extra_params = {'o': 'DETAILED_ACCOUNTS'}
+    @classmethod
+    @with_deadline
+    def search_changes(cls, query, fields=None):
+        """Search changes
 
-            _, response = RequestFactory.get(endpoint, params=extra_params)
+        Sends a GET request to Gerrit to fetch the list of changes matching
+        QUERY. Filtering is done by the server.
+
+        :param query: the search query
+        :type query: Query | None
+        :param fields: the fields to fetch (default: field_masks.SUMMARY)
+        :type fields: FieldMask | None
+        :rtype: tuple[ChangeInfo]
+        :raise: QueryError if no change match the query
+        :raise: PyCRError on any other error (eg. invalid query)
+        """
+
+        cls.log.debug('Changes search: %s', query)
+
+        fields = fields or field_masks.SUMMARY
+
+        try:
+            endpoint = changes.search_query(query=query)
+            extra_params = cls.get_query_params(fields)
+
+            response = RequestFactory.get(endpoint, params=extra_params)
 
         except RequestError as why:
             if why.status_code == 404:
                 raise QueryError('no result for query criterion')
 
+            if why.status_code == 400:
+                raise PyCRError('invalid query: %s' % query, why)
+
             raise UnexpectedError(why)
 
-        return tuple([ChangeInfo.parse(c) for c in response])
+        pool = AccountPool()
+        return tuple([ChangeInfo.parse(c, pool, fields) for c in response])
+
+    @classmethod
+    @with_deadline
+    def iter_changes(cls, query, fields=None, page_size=DEFAULT_PAGE_SIZE):
+        """Search changes, page by page
+
+        Yields the changes matching QUERY as soon as their page is received.
+        Only one page of changes is held in memory at once: use this method
+        to stream the results of queries that match many changes.
+
+        :param query: the search query
+        :type query: Query | None
+        :param fields: the fields to fetch (default: field_masks.SUMMARY)
+        :type fields: FieldMask | None
+        :param page_size: the number of changes per request
+        :type page_size: int
+        :yield: ChangeInfo
+        :raise: PyCRError on any error (eg. invalid query)
+        """
+
+        cls.log.debug('Changes streaming search: %s', query)
+
+        fields = fields or field_masks.SUMMARY
+        start = 0
+
+        while True:
+            extra_params = cls.get_query_params(fields)
+            extra_params['n'] = page_size
+
+            if start:
+                extra_params['S'] = start
+
+            try:
+                endpoint = changes.search_query(query=query)
+                response = RequestFactory.get(endpoint, params=extra_params)
+
+            except RequestError as why:
+                if why.status_code == 404:
+                    return
+
+                if why.status_code == 400:
+                    raise PyCRError('invalid query: %s' % query, why)
+
+                raise UnexpectedError(why)
+
+            # Accounts are only shared within a page
+            pool = AccountPool()
+
+            for change in response:
+                yield ChangeInfo.parse(change, pool, fields)
+
+            if not response or not response[-1].get('_more_changes'):
+                return
+
+            start += len(response)
+
+    @classmethod
+    @with_deadline
+    def multi_query(cls, queries, fields=None, limit=None, max_results=None):
+        """Search changes with several queries at once
+
+        Sends a single GET request to Gerrit for all QUERIES. The results of
+        the queries for which the server has more changes than returned
+        (_more_changes) are then fetched page by page, batching together the
+        queries that continue from the same offset.
+
+        :param queries: the search queries
+        :type queries: list[Query]
+        :param fields: the fields to fetch (default: field_masks.SUMMARY)
+        :type fields: FieldMask | None
+        :param limit: the maximum number of changes per query and request
+            (default: the server limit)
+        :type limit: int | None
+        :param max_results: the maximum number of changes per query (default:
+            all matching changes)
+        :type max_results: int | None
+        :rtype: tuple[tuple[ChangeInfo]]
+        :raise: PyCRError on any error (eg. invalid query)
+        """
+
+        queries = list(queries)
+        fields = fields or field_masks.SUMMARY
+
+        cls.log.debug('Changes multi-search: %s', ', '.join(map(str, queries)))
+
+        results = [[] for _ in queries]
+
+        # Offset -> indexes of the queries to fetch from that offset
+        pending = {0: range(len(queries))} if queries else {}
+
+        while pending:
+            start = min(pending)
+            indexes = pending.pop(start)
+
+            extra_params = cls.get_query_params(fields)
+
+            # All the queries of the batch have START changes so far
+            count = limit
+
+            if max_results is not None:
+                count = min(count or max_results, max_results - start)
+
+            if count is not None:
+                extra_params['n'] = count
+
+            if start:
+                extra_params['S'] = start
+
+            try:
+                endpoint = changes.multi_search_query(
+                    [queries[index] for index in indexes])
+
+                response = RequestFactory.get(endpoint, params=extra_params)
+
+            except RequestError as why:
+                if why.status_code == 400:
+                    raise PyCRError('invalid query', why)
+
+                raise UnexpectedError(why)
+
+            # The server only returns a list of lists for several queries
+            if len(indexes) == 1:
+                response = [response]
+
+            for index, page in zip(indexes, response):
+                results[index].extend(page)
+
+                if (page and page[-1].get('_more_changes') and
+                        (max_results is None or
+                         len(results[index]) < max_results)):
+                    pending.setdefault(start + len(page), []).append(index)
+
+        pool = AccountPool()
+        return tuple([tuple([ChangeInfo.parse(c, pool, fields) for c in r])
+                      for r in results])
 
     @classmethod
-    def list_changes(cls, status='open', owner='self'):
+    @with_deadline
+    def list_changes(cls, status='open', owner='self', fields=None,
+                     query=None):
         """List changes
 
         Sends a GET request to Gerrit to fetch the list of changes with the
         given STATUS and from the given OWNER.
 
-        :param status: the status of the change (open, merged, ...)
-        :type status: str
-        :param owner: the account_id of the owner of the changes
-        :type owner: str
+        :param status: the status of the change (open, merged, ...), if any
+        :type status: str | None
+        :param owner: the account_id of the owner of the changes, if any
+        :type owner: str | None
+        :param fields: the fields to fetch (default: field_masks.SUMMARY)
+        :type fields: FieldMask | None
+        :param query: additional search criteria
+        :type query: Query | None
         :rtype: tuple[ChangeInfo]
         :raise: NoSuchChangeError if no change match the query criterion
         :raise: PyCRError on any other error
@@ -88,32 +289,47 @@ class Gerrit(object):
         cls.log.debug(
             'Changes lookup with status:%s & owner:%s', status, owner)
 
-        try:
-            endpoint = changes.search_query(status=status, owner=owner)
+        fields = fields or field_masks.SUMMARY
 
-            # DETAILED_ACCOUNTS option ensures that the owner email address is
-            # sent in the response
-            extra_params = {'o': 'DETAILED_ACCOUNTS'}
+        # Serve the query from the local change index if it is up-to-date and
+        # stores all requested fields (the index only knows about status and
+        # owner)
+        index = None
 
-            _, response = RequestFactory.get(endpoint, params=extra_params)
+        if query is None and fields.is_covered_by(ChangeIndex.OPTIONS):
+            index = ChangeIndex.open_default()
 
-        except RequestError as why:
-            if why.status_code == 404:
-                raise QueryError('no result for query criterion')
+        if index is not None:
+            try:
+                response = index.list_changes(status=status, owner=owner)
+            finally:
+                index.close()
 
-            raise UnexpectedError(why)
+            if response is not None:
+                cls.log.debug('Changes served from the local index')
 
-        return tuple([ChangeInfo.parse(c) for c in response])
+                pool = AccountPool()
+                return tuple([ChangeInfo.parse(c, pool, fields)
+                              for c in response])
+
+        return cls.search_changes(
+            changes.search_query_attr(status=status, owner=owner,
+                                      query=query), fields)
 
     @classmethod
-    def get_change(cls, change_id):
+    @with_deadline
+    def get_change(cls, change_id, fields=None):
         """Fetch a change details
 
         Sends a GET request to Gerrit to fetch the data on the given change.
+        The /detail endpoint is only used if one of the requested fields
+        requires it.
 
         :param change_id: any identification number for the change (UUID,
             Change-Id, or legacy numeric change ID
         :type change_id: str
+        :param fields: the fields to fetch (default: field_masks.DEFAULT)
+        :type fields: FieldMask | None
         :rtype: ChangeInfo
         :raise: NoSuchChangeError if the change does not exists
         :raise: PyCRError on any other error
@@ -121,14 +337,17 @@ class Gerrit(object):
 
         cls.log.debug('Change lookup: %s', change_id)
 
+        fields = fields or field_masks.DEFAULT
+
         try:
-            endpoint = changes.detailed_changes(change_id)
+            if fields.detail:
+                endpoint = changes.detailed_changes(change_id)
+            else:
+                endpoint = changes.changes(change_id)
 
-            # CURRENT_REVISION describe the current revision (patch set) of the
-            # change, including the commit SHA-1 and URLs to fetch from
-            extra_params = {'o': 'CURRENT_REVISION'}
+            extra_params = cls.get_query_params(fields)
 
-            _, response = RequestFactory.get(endpoint, params=extra_params)
+            response = RequestFactory.get(endpoint, params=extra_params)
 
         except RequestError as why:
             if why.status_code == 404:
@@ -136,9 +355,10 @@ class Gerrit(object):
 
             raise UnexpectedError(why)
 
-        return ChangeInfo.parse(response)
+        return ChangeInfo.parse(response, fields=fields)
 
     @classmethod
+    @with_deadline
     def get_patch(cls, change_id, revision_id='current'):
         """Fetch a patch content
 
@@ -161,7 +381,7 @@ class Gerrit(object):
 
         try:
             endpoint = changes.patch(change_id, revision_id)
-            _, patch = RequestFactory.get(endpoint, encoding=BASE64)
+            patch = RequestFactory.get(endpoint, encoding=BASE64)
 
         except RequestError as why:
             if why.status_code == 404:
@@ -172,6 +392,7 @@ class Gerrit(object):
         return patch
 
     @classmethod
+    @with_deadline
     def set_review(cls, score, message, change_id, label,
                    revision_id='current'):
         """Set a review score
@@ -211,9 +432,9 @@ class Gerrit(object):
 
         try:
             endpoint = changes.review(change_id, revision_id)
-            _, review = RequestFactory.post(endpoint,
-                                            data=json.dumps(payload),
-                                            headers=headers)
+            review = RequestFactory.post(endpoint,
+                                         data=json.dumps(payload),
+                                         headers=headers)
 
         except RequestError as why:
             if why.status_code == 404:
@@ -228,6 +449,7 @@ class Gerrit(object):
         return ReviewInfo.parse(review)
 
     @classmethod
+    @with_deadline
     def rebase(cls, change_id):
         """Rebase a change
 
@@ -245,7 +467,7 @@ class Gerrit(object):
         cls.log.debug('rebase: %s', change_id)
 
         try:
-            _, change = RequestFactory.post(changes.rebase(change_id))
+            change = RequestFactory.post(changes.rebase(change_id))
 
         except RequestError as why:
             if why.status_code == 404:
@@ -261,6 +483,7 @@ class Gerrit(object):
         return ChangeInfo.parse(change)
 
     @classmethod
+    @with_deadline
     def submit(cls, change_id):
         """Submit a change
 
@@ -282,9 +505,9 @@ class Gerrit(object):
         headers = {'content-type': 'application/json'}
 
         try:
-            _, change = RequestFactory.post(changes.submit(change_id),
-                                            data=json.dumps(payload),
-                                            headers=headers)
+            change = RequestFactory.post(changes.submit(change_id),
+                                         data=json.dumps(payload),
+                                         headers=headers)
 
         except RequestError as why:
             if why.status_code == 404:
@@ -300,6 +523,7 @@ class Gerrit(object):
         return ChangeInfo.parse(change).status == ChangeInfo.MERGED
 
     @classmethod
+    @with_deadline
     def get_reviews(cls, change_id):
         """Fetch the reviews for a change
 
@@ -318,7 +542,7 @@ class Gerrit(object):
 
         try:
             endpoint = changes.reviewers(change_id)
-            _, response = RequestFactory.get(endpoint)
+            response = RequestFactory.get(endpoint)
 
         except RequestError as why:
             if why.status_code == 404:
@@ -336,11 +560,14 @@ class Gerrit(object):
         # experiences show that it's not always the case, and that the change
         # owner can also be in the list although not a reviewers.
 
-        return tuple(
-            [ReviewerInfo.parse(r) for r in response if 'approvals' in r])
+        pool = AccountPool()
+        return tuple([ReviewerInfo.parse(r, pool)
+                      for r in response if 'approvals' in r])
 
     @classmethod
-    def add_reviewer(cls, change_id, account_id, force=False):
+    @with_deadline
+    def add_reviewer(cls, change_id, account_id, force=False,
+                     confirm_function=confirm):
         """Add a reviewer
 
         Sends a POST request to Gerrit to add one user or all members of one
@@ -356,6 +583,9 @@ class Gerrit(object):
             confirmation to add multiple reviewers at once (group).  Defaults
             to False
         :type force: bool
+        :param confirm_function: the function asking the user for
+            confirmation, called with the message of the server
+        :type confirm_function: callable
         :rtype: tuple(AccountInfo)
         :raise: PyCRError if the Gerrit server returns an error
         """
@@ -365,11 +595,19 @@ class Gerrit(object):
         payload = {'reviewer': account_id}
         headers = {'content-type': 'application/json'}
 
+        if force:
+            # Skip the confirmation round trip
+            payload['confirmed'] = True
+
         try:
             endpoint = changes.reviewers(change_id)
-            _, response = RequestFactory.post(endpoint,
-                                              data=json.dumps(payload),
-                                              headers=headers)
+
+            # Adding the same reviewer twice has no side effect: the request
+            # can safely be retried
+            response = RequestFactory.post(endpoint,
+                                           data=json.dumps(payload),
+                                           headers=headers,
+                                           idempotent=True)
 
         except RequestError as why:
             if why.status_code == 404:
@@ -382,7 +620,8 @@ class Gerrit(object):
 
             cls.log.debug('Assigning review: confirmation requested')
 
-            do_add_reviewers = True if force else confirm(response['error'])
+            do_add_reviewers = (
+                True if force else confirm_function(response['error']))
 
             if not do_add_reviewers:
                 info('reviewer not added, aborting...')
@@ -390,9 +629,9 @@ class Gerrit(object):
 
             try:
                 payload['confirmed'] = True
-                _, response = RequestFactory.post(endpoint,
-                                                  data=json.dumps(payload),
-                                                  headers=headers)
+                response = RequestFactory.post(endpoint,
+                                               data=json.dumps(payload),
+                                               headers=headers)
 
             except RequestError as why:
                 raise UnexpectedError(why)
@@ -401,6 +640,7 @@ class Gerrit(object):
         return tuple([AccountInfo.parse(r) for r in response['reviewers']])
 
     @classmethod
+    @with_deadline
     def get_reviewer(cls, change_id, account_id):
         """Fetch a reviewer info
 
@@ -422,7 +662,7 @@ class Gerrit(object):
 
         try:
             endpoint = changes.reviewer(change_id, account_id)
-            _, response = RequestFactory.get(endpoint)
+            response = RequestFactory.get(endpoint)
 
         except RequestError as why:
             if why.status_code == 404:
@@ -434,7 +674,8 @@ class Gerrit(object):
         return ReviewerInfo.parse(response)
 
     @classmethod
-    def delete_reviewer(cls, change_id, account_id):
+    @with_deadline
+    def delete_reviewer(cls, change_id, account_id, reviewer=None):
         """Remove a reviewer from the list of reviewer of a change
 
         Sends a DELETE request to Gerrit to delete one user from the reviewer's
@@ -447,6 +688,8 @@ class Gerrit(object):
         :param account_id: any identification string for an account (name,
             username, email)
         :type account_id: str
+        :param reviewer: the reviewer, if already known (skips the lookup)
+        :type reviewer: ReviewerInfo | None
         :rtype: ReviewerInfo | None
         :raise: PyCRError if the Gerrit server returns an error
         """
@@ -456,7 +699,9 @@ class Gerrit(object):
         try:
             endpoint = changes.reviewer(change_id, account_id)
 
-            _, response = RequestFactory.get(endpoint)
+            if reviewer is None:
+                response = RequestFactory.get(endpoint)
+
             RequestFactory.delete(endpoint)
 
         except RequestError as why:
@@ -470,10 +715,14 @@ class Gerrit(object):
 
             raise UnexpectedError(why)
 
+        if reviewer is not None:
+            return reviewer
+
         assert len(response) == 1
         return ReviewerInfo.parse(response[0])
 
     @classmethod
+    @with_deadline
     def get_account(cls, account_id='self'):
         """Fetch Gerrit account details
 
@@ -486,7 +735,7 @@ class Gerrit(object):
         cls.log.debug('List Gerrit accounts')
 
         try:
-            _, response = RequestFactory.get(accounts.account(account_id))
+            response = RequestFactory.get(accounts.account(account_id))
 
         except RequestError as why:
             if why.status_code == 404:
@@ -497,6 +746,7 @@ class Gerrit(object):
         return AccountInfo.parse(response)
 
     @classmethod
+    @with_deadline
     def get_emails(cls, account_id='self'):
         """Fetch Gerrit account emails
 
@@ -509,7 +759,7 @@ class Gerrit(object):
         cls.log.debug('List Gerrit account emails')
 
         try:
-            _, response = RequestFactory.get(accounts.emails(account_id))
+            response = RequestFactory.get(accounts.emails(account_id))
 
         except RequestError as why:
             if why.status_code == 404:
@@ -520,6 +770,7 @@ class Gerrit(object):
         return tuple([EmailInfo.parse(e) for e in response])
 
     @classmethod
+    @with_deadline
     def get_ssh_keys(cls, account_id='self'):
         """Fetch Gerrit account SSH keys
 
@@ -532,7 +783,7 @@ class Gerrit(object):
         cls.log.debug('List Gerrit account SSH keys')
 
         try:
-            _, response = RequestFactory.get(accounts.ssh_keys(account_id))
+            response = RequestFactory.get(accounts.ssh_keys(account_id))
 
         except RequestError as why:
             if why.status_code == 404:
@@ -543,6 +794,7 @@ class Gerrit(object):
         return tuple(SshKeyInfo.parse(k) for k in response)
 
     @classmethod
+    @with_deadline
     def get_ssh_key(cls, account_id='self', ssh_key_id='0'):
         """Fetch Gerrit account SSH key
 
@@ -557,7 +809,7 @@ class Gerrit(object):
         cls.log.debug('List Gerrit account SSH keys')
 
         try:
-            _, response = RequestFactory.get(
+            response = RequestFactory.get(
                 accounts.ssh_key(account_id, ssh_key_id))
 
         except RequestError as why:
@@ -569,6 +821,7 @@ class Gerrit(object):
         return SshKeyInfo.parse(response)
 
     @classmethod
+    @with_deadline
     def get_capabilities(cls, account_id='self'):
         """Fetch Gerrit account capabilities
 
@@ -581,7 +834,7 @@ class Gerrit(object):
         cls.log.debug('List Gerrit account capabilities')
 
         try:
-            _, response = RequestFactory.get(accounts.capabilities(account_id))
+            response = RequestFactory.get(accounts.capabilities(account_id))
 
         except RequestError as why:
             if why.status_code == 404:
@@ -592,6 +845,7 @@ class Gerrit(object):
         return CapabilityInfo.parse(response)
 
     @classmethod
+    @with_deadline
     def get_diff_prefs(cls, account_id='self'):
         """Fetch Gerrit account diff preferences
 
@@ -604,7 +858,7 @@ class Gerrit(object):
         cls.log.debug('List Gerrit account diff preferences')
 
         try:
-            _, response = RequestFactory.get(
+            response = RequestFactory.get(
                 accounts.diff_preferences(account_id))
 
         except RequestError as why:
@@ -616,6 +870,7 @@ class Gerrit(object):
         return DiffPreferencesInfo.parse(response)
 
     @classmethod
+    @with_deadline
     def get_starred_changes(cls, account_id='self'):
         """Fetch Gerrit account starred changes
 
@@ -628,7 +883,7 @@ class Gerrit(object):
         cls.log.debug('List Gerrit account starred changes')
 
         try:
-            _, response = RequestFactory.get(
+            response = RequestFactory.get(
                 accounts.starred_changes(account_id))
 
         except RequestError as why:
@@ -637,9 +892,11 @@ class Gerrit(object):
 
             raise UnexpectedError(why)
 
-        return tuple(ChangeInfo.parse(c) for c in response)
+        pool = AccountPool()
+        return tuple(ChangeInfo.parse(c, pool) for c in response)
 
     @classmethod
+    @with_deadline
     def get_groups(cls, account_id='self'):
         """Fetch Gerrit account groups
 
@@ -652,7 +909,7 @@ class Gerrit(object):
         cls.log.debug('List Gerrit account group')
 
         try:
-            _, response = RequestFactory.get(accounts.groups(account_id))
+            response = RequestFactory.get(accounts.groups(account_id))
 
         except RequestError as why:
             if why.status_code == 404:
@@ -660,4 +917,232 @@ class Gerrit(object):
 
             raise UnexpectedError(why)
 
-        return tuple(GroupInfo.parse(g) for g in response)
+        pool = AccountPool()
+        return tuple(GroupInfo.parse(g, pool) for g in response)
+
+    @classmethod
+    @with_deadline
+    def query_accounts(cls, query):
+        """Search accounts
+
+        Unlike changes, accounts are searched one query per request.
+
+        :param query: the search query
+        :type query: Query
+        :rtype: tuple[AccountInfo]
+        :raise: PyCRError on any error (eg. invalid query)
+        """
+
+        cls.log.debug('Accounts search: %s', query)
+
+        try:
+            response = RequestFactory.get(accounts.search_query(query),
+                                          params={'o': 'DETAILS'})
+
+        except RequestError as why:
+            if why.status_code == 400:
+                raise PyCRError('invalid account query', why)
+
+            raise UnexpectedError(why)
+
+        pool = AccountPool()
+        return tuple([AccountInfo.parse(a, pool) for a in response])
+
+    @classmethod
+    @with_deadline
+    def get_group(cls, group_id):
+        """Fetch a group
+
+        :param group_id: identifier that uniquely identifies one group (UUID,
+            legacy numeric ID, or name)
+        :type group_id: str
+        :rtype: GroupInfo
+        :raise: NoSuchGroupError if the group does not exist
+        :raise: PyCRError on any other error
+        """
+
+        cls.log.debug('Group lookup: %s', group_id)
+
+        try:
+            response = RequestFactory.get(groups.group(group_id))
+
+        except RequestError as why:
+            if why.status_code == 404:
+                raise NoSuchGroupError(group_id)
+
+            raise UnexpectedError(why)
+
+        return GroupInfo.parse(response)
+
+    @classmethod
+    @with_deadline
+    def get_group_members(cls, group_id):
+        """Fetch the members of a group, and of the groups it includes
+
+        :param group_id: identifier that uniquely identifies one group (UUID,
+            legacy numeric ID, or name)
+        :type group_id: str
+        :rtype: tuple[AccountInfo]
+        :raise: NoSuchGroupError if the group does not exist
+        :raise: PyCRError on any other error
+        """
+
+        cls.log.debug('Group members lookup: %s', group_id)
+
+        try:
+            response = RequestFactory.get(groups.members(group_id))
+
+        except RequestError as why:
+            if why.status_code == 404:
+                raise NoSuchGroupError(group_id)
+
+            raise UnexpectedError(why)
+
+        pool = AccountPool()
+        return tuple([AccountInfo.parse(a, pool) for a in response])
+
+
+class GerritClient(object):
+    """A Gerrit Code Review client for a server and an identity
+
+    The Gerrit class methods talk to the server of the process configuration.
+    Clients are independent of it and of each other: each has its own
+    configuration and HTTP sessions, and can be used from several threads at
+    once. All the methods of Gerrit are available on clients:
+
+        client = GerritClient('review.example.com', ('bot', 'http-password'))
+        change = client.get_change('1234')
+
+    Code written against the Gerrit class methods (eg. a builtin) can also
+    run with a client:
+
+        with client:
+            change = Gerrit.get_change('1234')
+
+    The client of the process configuration is GerritClient.default().
+    """
+
+    # Configuration keys of the server and identity of the process, not
+    # inherited by clients (the change index is specific to both)
+    IDENTITY = ('gerrit.host', 'gerrit.unsecure', 'gerrit.username',
+                'gerrit.password', 'index.path')
+
+    # The client of the process configuration
+    _default = None
+
+    def __init__(self, host, auth=None, options=None):
+        """Constructor
+
+        The client inherits the configuration of the process (eg. the retry
+        and transport settings), except for the server and the identity.
+
+        :param host: the hostname of the server
+        :type host: str
+        :param auth: the username and HTTP password, if authentication is
+            required
+        :type auth: (str, str) | None
+        :param options: configuration entries overriding those of the
+            process (eg. {'gerrit.unsecure': True})
+        :type options: dict | None
+        """
+
+        self.config = dict((key, value)
+                           for key, value in Config.snapshot().items()
+                           if key not in self.IDENTITY)
+        self.config['gerrit.host'] = host
+
+        if auth is not None:
+            self.config['gerrit.username'], self.config['gerrit.password'] = (
+                auth)
+
+        self.config.update(options or {})
+
+        self.pool = SessionPool()
+
+        # Per-thread stack of the configuration and session pool in use
+        # before the client (see __enter__)
+        self._local = threading.local()
+
+    @classmethod
+    def default(cls):
+        """Return the client of the process configuration and sessions
+
+        Its methods are the Gerrit class methods.
+
+        :rtype: GerritClient
+        """
+
+        if cls._default is None:
+            client = cls.__new__(cls)
+
+            # Use the configuration and sessions of the process
+            client.config = client.pool = None
+            client._local = threading.local()
+
+            cls._default = client
+
+        return cls._default
+
+    def __enter__(self):
+        """Use this client in the current thread
+
+        Gerrit class methods called from the current thread, or from the
+        worker threads of libpycr.utils.parallel, then use this client.
+        """
+
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+
+        self._local.stack.append((Config.use(self.config),
+                                  RequestFactory.use_pool(self.pool)))
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        config, pool = self._local.stack.pop()
+
+        Config.use(config)
+        RequestFactory.use_pool(pool)
+
+    def __getattr__(self, name):
+        method = getattr(Gerrit, name)
+
+        if not callable(method):
+            return method
+
+        @functools.wraps(method)
+        def call(*args, **kwargs):
+            """Call the method with this client"""
+
+            with self:
+                result = method(*args, **kwargs)
+
+            if isinstance(result, types.GeneratorType):
+                return self._iterate(result)
+
+            return result
+
+        return call
+
+    def _iterate(self, generator):
+        """Run each step of GENERATOR with this client
+
+        :param generator: the generator returned by a Gerrit method
+        :type generator: generator
+        :rtype: collections.iterable
+        """
+
+        while True:
+            with self:
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+
+            yield item
+
+    def close(self):
+        """Close the connections of the client"""
+
+        if self.pool is not None:
+            self.pool.close()
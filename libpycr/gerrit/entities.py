@@ -1,8 +1,172 @@
 """Provides all the Gerrit structure that can be received from the server"""
 
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
 
-from libpycr.utils.output import Formatter, NEW_LINE, Token
+from libpycr.utils.output import checkmark, Formatter, NEW_LINE, Token
+from libpycr.utils.records import to_serializable
+
+
+def intern_string(value, pool=None):
+    """Return the copy of VALUE shared by the entities parsed with POOL
+
+    Projects, branches, statuses and label names repeat across the entities of
+    a response: keep a single copy of each. The built-in intern() does not
+    accept the unicode strings produced by the JSON decoder, and would keep
+    them for the lifetime of the process.
+
+    :param value: the string to intern
+    :type value: unicode | str | None
+    :param pool: the pool to share strings from, if any
+    :type pool: AccountPool | None
+    :rtype: unicode | str | None
+    """
+
+    if value is None or pool is None:
+        return value
+
+    return pool.share(basestring, (value,), lambda: value)
+
+
+def format_score(value):
+    """Format a label vote the way Gerrit does in ApprovalInfo maps
+
+    :param value: the vote
+    :type value: int
+    :rtype: str
+    """
+
+    if value > 0:
+        return '+%d' % value
+
+    if value == 0:
+        return ' 0'
+
+    return str(value)
+
+
+def format_label_status(data):
+    """Summarize the state of a label the way the Gerrit web UI does
+
+    A blocking vote (eg. Code-Review -2) is shown as a cross mark, an
+    approving vote (eg. Code-Review +2) as a checkmark, and the other votes
+    as the lowest or highest score.
+
+    :param data: JSON representation of the label as emitted by Gerrit (with
+        the LABELS or DETAILED_LABELS option)
+    :type data: dict
+    :rtype: unicode | str
+    """
+
+    if 'rejected' in data:
+        return checkmark(False)
+
+    if 'approved' in data:
+        return checkmark(True)
+
+    # The vote value is only given if it is not -1 / +1
+    if 'disliked' in data:
+        return format_score(data.get('value', -1))
+
+    if 'recommended' in data:
+        return format_score(data.get('value', 1))
+
+    return format_score(0)
+
+
+class AccountPool(object):
+    """Share identical AccountInfo and GitPersonInfo objects (and strings)
+
+    The same accounts (owners, reviewers, authors, ...) appear many times in a
+    single response: parsing the response with a pool creates each of them
+    once. The pool is dropped with the response, along with the objects it
+    shares.
+    """
+
+    __slots__ = ('_objects',)
+
+    def __init__(self):
+        self._objects = {}
+
+    def share(self, kind, key, factory):
+        """Return the object of type KIND identified by KEY
+
+        The object is created with FACTORY if not in the pool yet.
+
+        :param kind: the type of the object
+        :type kind: type
+        :param key: the identity of the object
+        :type key: tuple
+        :param factory: function creating the object
+        :type factory: callable
+        :rtype: Info
+        """
+
+        obj = self._objects.get((kind, key))
+
+        if obj is None:
+            obj = self._objects[(kind, key)] = factory()
+
+        return obj
+
+
+class LazyValue(object):
+    """A value to parse on first access (see LazyAttribute)"""
+
+    __slots__ = ('parser', 'args')
+
+    def __init__(self, parser, *args):
+        """Constructor
+
+        :param parser: the function that parses the value
+        :type parser: callable
+        :param *args: the arguments to call PARSER with
+        :type *args: list
+        """
+
+        self.parser = parser
+        self.args = args
+
+    def parse(self):
+        """Parse the value
+
+        :rtype: object
+        """
+
+        return self.parser(*self.args)
+
+
+class LazyAttribute(object):
+    """Entity attribute parsed from its JSON representation on first access
+
+    The attribute is stored in the SLOT slot of the entity. Assigning a
+    LazyValue to the attribute defers parsing until the attribute is read;
+    any other value is stored as is.
+    """
+
+    def __init__(self, slot):
+        """Constructor
+
+        :param slot: the name of the slot storing the attribute value
+        :type slot: str
+        """
+
+        self.slot = slot
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+
+        value = getattr(obj, self.slot)
+
+        if isinstance(value, LazyValue):
+            value = value.parse()
+            setattr(obj, self.slot, value)
+
+        return value
+
+    def __set__(self, obj, value):
+        setattr(obj, self.slot, value)
 
 
 # pylint: disable=R0902,R0903
@@ -13,6 +177,16 @@ class Info(object):
 
     __metaclass__ = ABCMeta
 
+    # Entities are created in large numbers: do not allocate a per-instance
+    # __dict__. Subclasses must declare their own attributes in __slots__.
+    __slots__ = ()
+
+    # Fields stored as sequences of (key, value) pairs, serialized as objects
+    PAIRS = ()
+
+    # Names of the fields of each entity type (see get_field_names)
+    _field_names = {}
+
     def __str__(self):
         return Formatter.format(self.tokenize())
 
@@ -23,6 +197,45 @@ class Info(object):
         """
         return Formatter.raw_format(self.tokenize())
 
+    @classmethod
+    def get_field_names(cls):
+        """Return the names of the fields of this entity type, in order
+
+        Fields are the slots of the entity, without the leading underscore of
+        the slots of lazy attributes.
+
+        :rtype: tuple[str]
+        """
+
+        names = Info._field_names.get(cls)
+
+        if names is None:
+            names = Info._field_names[cls] = tuple(
+                slot.lstrip('_') for klass in reversed(cls.__mro__)
+                for slot in klass.__dict__.get('__slots__', ()))
+
+        return names
+
+    def to_dict(self):
+        """Return a JSON-serializable representation of this entity
+
+        Lazy attributes are parsed.
+
+        :rtype: OrderedDict
+        """
+
+        record = OrderedDict()
+
+        for name in self.get_field_names():
+            value = getattr(self, name)
+
+            if name in self.PAIRS and value is not None:
+                value = OrderedDict(value)
+
+            record[name] = to_serializable(value)
+
+        return record
+
     @abstractmethod
     def tokenize(self):
         """Generate a stream of token
@@ -37,7 +250,10 @@ class Info(object):
 class AccountInfo(Info):
     """An account object"""
 
+    __slots__ = ('account_id', 'name', 'email', 'username')
+
     def __init__(self):
+        self.account_id = None
         self.name = None
         self.email = None
         self.username = None
@@ -57,7 +273,8 @@ class AccountInfo(Info):
         # else:
         #   John Doe
 
-        yield Token.Text, self.name
+        # Accounts without a full name are known by their username
+        yield Token.Text, self.name or self.username or str(self.account_id)
 
         if self.email:
             yield Token.Whitespace, ' '
@@ -66,17 +283,27 @@ class AccountInfo(Info):
             yield Token.Punctuation, '>'
 
     @staticmethod
-    def parse(data):
+    def parse(data, pool=None):
         """Create an initialized AccountInfo object
 
         :param data: JSON representation of the account as emitted by Gerrit
         :type data: str
+        :param pool: the pool to share the account from, if any
+        :type pool: AccountPool | None
         :rtype: AccountInfo
         """
 
+        if pool is not None:
+            return pool.share(
+                AccountInfo,
+                (data.get('_account_id'), data.get('username'),
+                 data.get('email'), data.get('name')),
+                lambda: AccountInfo.parse(data))
+
         account = AccountInfo()
 
-        account.name = data['name']
+        account.account_id = data.get('_account_id')
+        account.name = data.get('name')
         account.email = data.get('email')
         account.username = data.get('username')
 
@@ -86,6 +313,8 @@ class AccountInfo(Info):
 class GitPersonInfo(Info):
     """A git person object."""
 
+    __slots__ = ('name', 'email', 'date', 'timezone')
+
     def __init__(self):
         self.name = None
         self.email = None
@@ -101,14 +330,22 @@ class GitPersonInfo(Info):
         yield Token.Punctuation, '>'
 
     @staticmethod
-    def parse(data):
+    def parse(data, pool=None):
         """Create an initialized GitPersonInfo object
 
         :param data: JSON representation of the git person as emitted by Gerrit
         :type data: str
+        :param pool: the pool to share the person from, if any
+        :type pool: AccountPool | None
         :rtype: GitPersonInfo
         """
 
+        if pool is not None:
+            return pool.share(
+                GitPersonInfo,
+                (data['email'], data['name'], data['date'], data['tz']),
+                lambda: GitPersonInfo.parse(data))
+
         person = GitPersonInfo()
 
         person.name = data['name']
@@ -122,6 +359,14 @@ class GitPersonInfo(Info):
 class CommitInfo(Info):
     """A commit object"""
 
+    __slots__ = ('commit_id', '_parents', '_author', '_committer', 'subject',
+                 'message')
+
+    # Parsed on first access
+    parents = LazyAttribute('_parents')
+    author = LazyAttribute('_author')
+    committer = LazyAttribute('_committer')
+
     def __init__(self):
         self.commit_id = None
         self.parents = None
@@ -153,37 +398,64 @@ class CommitInfo(Info):
             yield NEW_LINE
 
     @staticmethod
-    def parse(data):
+    def parse(data, pool=None, commit_id=None):
         """Create an initialized CommitInfo object
 
+        Parents, author and committer are parsed on first access.
+
         :param data: JSON representation of the commit as emitted by Gerrit
         :type data: str
+        :param pool: the pool to share the author and committer from, if any
+        :type pool: AccountPool | None
+        :param commit_id: the commit ID, if not part of DATA
+        :type commit_id: str | None
         :rtype: CommitInfo
         """
 
         commit = CommitInfo()
 
-        commit.commit_id = data.get('commit')
+        commit.commit_id = commit_id or data.get('commit')
         commit.subject = data['subject']
 
         if 'parent' in data:
-            commit.parents = []
-            for parent in data['parent']:
-                commit.parents.append(CommitInfo.parse(parent))
+            commit.parents = LazyValue(CommitInfo.parse_parents,
+                                       data['parent'], pool)
 
         if 'author' in data:
-            commit.author = GitPersonInfo.parse(data['author'])
+            commit.author = LazyValue(GitPersonInfo.parse,
+                                      data['author'], pool)
         if 'committer' in data:
-            commit.committer = GitPersonInfo.parse(data['committer'])
+            commit.committer = LazyValue(GitPersonInfo.parse,
+                                         data['committer'], pool)
 
         commit.message = data.get('message')
 
         return commit
 
+    @staticmethod
+    def parse_parents(data, pool=None):
+        """Create the list of parents of a commit
+
+        :param data: JSON representation of the parent commits as emitted by
+            Gerrit
+        :type data: list
+        :param pool: the pool to share accounts from, if any
+        :type pool: AccountPool | None
+        :rtype: list[CommitInfo]
+        """
+
+        return [CommitInfo.parse(parent, pool) for parent in data]
+
 
 class RevisionInfo(Info):
     """A revision object"""
 
+    __slots__ = ('draft', 'has_draft_comments', 'number', 'fetch', '_commit',
+                 'files', 'actions')
+
+    # Parsed on first access
+    commit = LazyAttribute('_commit')
+
     def __init__(self):
         self.draft = None
         self.has_draft_comments = None
@@ -199,11 +471,17 @@ class RevisionInfo(Info):
                 yield token
 
     @staticmethod
-    def parse(data):
+    def parse(data, pool=None, commit_id=None):
         """Create an initialized CommitInfo object
 
+        The commit is parsed on first access.
+
         :param data: JSON representation of the revision as emitted by Gerrit
         :type data: str
+        :param pool: the pool to share accounts from, if any
+        :type pool: AccountPool | None
+        :param commit_id: the ID of the commit of the revision
+        :type commit_id: str | None
         :rtype: CommitInfo
         """
 
@@ -218,7 +496,8 @@ class RevisionInfo(Info):
         # self.actions = ActionInfo.parse(data['action'])
 
         if 'commit' in data:
-            revision.commit = CommitInfo.parse(data['commit'])
+            revision.commit = LazyValue(CommitInfo.parse, data['commit'],
+                                        pool, commit_id)
 
         return revision
 
@@ -226,6 +505,17 @@ class RevisionInfo(Info):
 class ChangeInfo(Info):
     """A change object"""
 
+    __slots__ = ('uuid', 'change_id', 'legacy_id', 'project', 'branch',
+                 'subject', 'status', 'owner', '_revisions',
+                 'current_revision', '_reviewers', '_labels')
+
+    # Parsed on first access
+    revisions = LazyAttribute('_revisions')
+    reviewers = LazyAttribute('_reviewers')
+    labels = LazyAttribute('_labels')
+
+    PAIRS = ('labels',)
+
     MERGED = 'MERGED'
     SUBMITTED = 'SUBMITTED'
 
@@ -240,6 +530,8 @@ class ChangeInfo(Info):
         self.owner = None
         self.revisions = None
         self.current_revision = None
+        self.reviewers = None
+        self.labels = None
 
     def tokenize(self):
         yield Token.Generic.Heading, 'change-id %s' % self.change_id
@@ -253,11 +545,23 @@ class ChangeInfo(Info):
         yield Token.Text, 'Subject: %s' % self.subject
 
     @staticmethod
-    def parse(data):
+    def parse(data, pool=None, fields=None):
         """Create an initialized ChangeInfo object
 
+        Revisions, reviewers and labels are parsed on first access. If FIELDS
+        is specified, the owner, current revision, revisions, reviewers and
+        labels are only parsed if part of the mask (the other fields are
+        always part of the response).
+
+        Reviewers are read from the detailed labels (DETAILED_LABELS option
+        or /detail endpoint).
+
         :param data: JSON representation of the change as emitted by Gerrit
         :type data: str
+        :param pool: the pool to share accounts from, if any
+        :type pool: AccountPool | None
+        :param fields: the fields to parse (default: all fields in DATA)
+        :type fields: FieldMask | None
         :rtype: ChangeInfo
         """
 
@@ -266,33 +570,104 @@ class ChangeInfo(Info):
         change.uuid = data['id']
         change.change_id = data['change_id']
         change.legacy_id = data['_number']
-        change.project = data['project']
-        change.branch = data['branch']
+        change.project = intern_string(data['project'], pool)
+        change.branch = intern_string(data['branch'], pool)
         change.subject = data['subject']
-        change.owner = AccountInfo.parse(data['owner'])
+        change.status = intern_string(data.get('status'), pool)
 
-        change.status = data.get('status')
-        change.current_revision = data.get('current_revision')
+        if fields is None or 'owner' in fields:
+            change.owner = AccountInfo.parse(data['owner'], pool)
 
-        if 'revisions' in data:
-            change.revisions = {}
+        if fields is None or 'current_revision' in fields:
+            change.current_revision = data.get('current_revision')
 
-            for commit_id, details in data['revisions'].items():
-                rev = RevisionInfo.parse(details)
+        if 'revisions' in data and (fields is None or 'revisions' in fields):
+            change.revisions = LazyValue(ChangeInfo.parse_revisions,
+                                         data['revisions'], pool)
 
-                # The commit ID is not specified twice in the commit detail:
-                # it needs to be set manually
-                if rev.commit is not None:
-                    rev.commit.commit_id = commit_id
+        if 'labels' in data and (fields is None or 'reviewers' in fields):
+            change.reviewers = LazyValue(ChangeInfo.parse_reviewers,
+                                         data['labels'], pool)
 
-                change.revisions[commit_id] = rev
+        if 'labels' in data and (fields is None or 'labels' in fields):
+            change.labels = LazyValue(ChangeInfo.parse_labels, data['labels'],
+                                      pool)
 
         return change
 
+    @staticmethod
+    def parse_revisions(data, pool=None):
+        """Create the revisions of a change
+
+        Each revision commit is parsed on first access.
+
+        :param data: JSON representation of the revisions as emitted by Gerrit
+        :type data: dict
+        :param pool: the pool to share accounts from, if any
+        :type pool: AccountPool | None
+        :rtype: dict[str, RevisionInfo]
+        """
+
+        # The commit ID is not specified twice in the commit detail: it is
+        # passed down from the revisions map key
+        return dict((commit_id, RevisionInfo.parse(details, pool, commit_id))
+                    for commit_id, details in data.iteritems())
+
+    @staticmethod
+    def parse_reviewers(data, pool=None):
+        """Create the reviewers of a change from its detailed labels
+
+        Each account listed in the votes of a label is a reviewer. Returns the
+        same information as the /reviewers endpoint.
+
+        :param data: JSON representation of the labels as emitted by Gerrit
+        :type data: dict
+        :param pool: the pool to share accounts from, if any
+        :type pool: AccountPool | None
+        :rtype: tuple[ReviewerInfo]
+        """
+
+        reviewers = OrderedDict()
+
+        for label in sorted(data):
+            for vote in data[label].get('all', ()):
+                key = vote.get('_account_id', vote.get('username'))
+
+                if key not in reviewers:
+                    reviewer = ReviewerInfo()
+                    reviewer.reviewer = AccountInfo.parse(vote, pool)
+                    reviewer.approvals = []
+                    reviewers[key] = reviewer
+
+                reviewers[key].approvals.append(
+                    (intern_string(label, pool),
+                     intern_string(format_score(vote.get('value', 0)), pool)))
+
+        return tuple(reviewers.itervalues())
+
+    @staticmethod
+    def parse_labels(data, pool=None):
+        """Create the summary of the labels of a change
+
+        :param data: JSON representation of the labels as emitted by Gerrit
+        :type data: dict
+        :param pool: the pool to share strings from, if any
+        :type pool: AccountPool | None
+        :rtype: tuple[(str, str)]
+        """
+
+        return tuple([(intern_string(label, pool),
+                       intern_string(format_label_status(data[label]), pool))
+                      for label in sorted(data)])
+
 
 class ReviewerInfo(Info):
     """A reviewer object"""
 
+    __slots__ = ('reviewer', 'approvals')
+
+    PAIRS = ('approvals',)
+
     def __init__(self):
         self.reviewer = None
         self.approvals = None
@@ -320,18 +695,22 @@ class ReviewerInfo(Info):
             yield NEW_LINE
 
     @staticmethod
-    def parse(data):
+    def parse(data, pool=None):
         """Create an initialized ReviewerInfo object
 
         :param data: JSON representation of the reviewer as emitted by Gerrit
         :type data: str
+        :param pool: the pool to share the account and labels from, if any
+        :type pool: AccountPool | None
         :rtype: ReviewerInfo
         """
 
         reviewer = ReviewerInfo()
 
-        reviewer.reviewer = AccountInfo.parse(data)
-        reviewer.approvals = data['approvals'].items()
+        reviewer.reviewer = AccountInfo.parse(data, pool)
+        reviewer.approvals = [
+            (intern_string(label, pool), intern_string(score, pool))
+            for label, score in data['approvals'].items()]
 
         return reviewer
 
@@ -339,6 +718,10 @@ class ReviewerInfo(Info):
 class ReviewInfo(Info):
     """A review object"""
 
+    __slots__ = ('labels',)
+
+    PAIRS = ('labels',)
+
     def __init__(self):
         self.labels = None
 
@@ -376,6 +759,11 @@ class ReviewInfo(Info):
 class CapabilityInfo(Info):
     """A capability object"""
 
+    __slots__ = ('administrate_server', 'query_limit', 'create_account',
+                 'create_group', 'create_project', 'email_reviewers',
+                 'kill_task', 'view_caches', 'flush_caches',
+                 'view_connections', 'view_queue', 'run_gc')
+
     def __init__(self):
         self.administrate_server = None
         self.query_limit = None
@@ -422,6 +810,12 @@ class CapabilityInfo(Info):
 class DiffPreferencesInfo(Info):
     """A diff preferences object"""
 
+    __slots__ = ('context', 'expand_all_comments', 'ignore_whitespace',
+                 'intraline_difference', 'line_length', 'manual_review',
+                 'retain_header', 'show_line_endings', 'show_tabs',
+                 'show_whitespace_errors', 'skip_deleted', 'skip_uncommented',
+                 'syntax_highlighting', 'tab_size')
+
     def __init__(self):
         self.context = None
         self.expand_all_comments = None
@@ -472,6 +866,8 @@ class DiffPreferencesInfo(Info):
 class EmailInfo(Info):
     """An email info object"""
 
+    __slots__ = ('email', 'preferred', 'pending_confirmation')
+
     def __init__(self):
         self.email = None
         self.preferred = None
@@ -500,6 +896,8 @@ class EmailInfo(Info):
 class QueryLimitInfo(Info):
     """A query limit info object"""
 
+    __slots__ = ('min', 'max')
+
     def __init__(self):
         self.min = None
         self.max = None
@@ -527,6 +925,9 @@ class QueryLimitInfo(Info):
 class SshKeyInfo(Info):
     """A SSH key info object"""
 
+    __slots__ = ('seq', 'ssh_public_key', 'encoded_key', 'algorithm',
+                 'comment', 'valid')
+
     def __init__(self):
         self.seq = None
         self.ssh_public_key = None
@@ -563,6 +964,8 @@ class SshKeyInfo(Info):
 class GroupOptionsInfo(Info):
     """A group options info object"""
 
+    __slots__ = ('visible_to_all',)
+
     def __init__(self):
         self.visible_to_all = None
 
@@ -587,6 +990,9 @@ class GroupOptionsInfo(Info):
 class GroupInfo(Info):
     """A group info object"""
 
+    __slots__ = ('kind', 'uuid', 'name', 'url', 'options', 'description',
+                 'group_id', 'owner', 'owner_id', 'members', 'includes')
+
     def __init__(self):
         self.kind = None
         self.uuid = None
@@ -604,11 +1010,13 @@ class GroupInfo(Info):
         pass  # ???(delay)
 
     @staticmethod
-    def parse(data):
+    def parse(data, pool=None):
         """Create an initialized GroupInfo object
 
         :param data: JSON representation of the group as emitted by Gerrit
         :type data: str
+        :param pool: the pool to share members from, if any
+        :type pool: AccountPool | None
         :rtype: GroupInfo
         """
 
@@ -630,10 +1038,10 @@ class GroupInfo(Info):
 
         if 'members' in data:
             group.members = tuple(
-                [AccountInfo.parse(m) for m in data['members']])
+                [AccountInfo.parse(m, pool) for m in data['members']])
 
         if 'includes' in data:
             group.includes = tuple(
-                [GroupInfo.parse(g) for g in data['includes']])
+                [GroupInfo.parse(g, pool) for g in data['includes']])
 
         return group
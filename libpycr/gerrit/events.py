@@ -178,6 +178,19 @@ class EventNotifier(object):
             self._ssh_client.close()
             self._ssh_client = self._ctl_sock = None
 
+    def is_connected(self):
+        """Whether the mainloop is connected to the Gerrit events stream
+
+        :rtype: bool
+        """
+        client = self._ssh_client
+
+        if client is None:
+            return False
+
+        transport = client.get_transport()
+        return transport is not None and transport.is_active()
+
     def stop(self):
         """Stop the mainloop
 
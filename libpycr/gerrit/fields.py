@@ -0,0 +1,113 @@
+"""Field masks: the ChangeInfo fields a command needs
+
+Each builtin declares the fields it renders as a FieldMask. From that mask,
+the client computes the minimal set of query options (o=) to send, and the
+lightest endpoint (/changes/X rather than /changes/X/detail) that returns all
+of them. ChangeInfo.parse skips the fields that are not in the mask.
+"""
+
+
+# Field -> (query options, whether the /detail endpoint is required)
+FIELDS = {
+    'uuid': ((), False),
+    'change_id': ((), False),
+    'legacy_id': ((), False),
+    'project': ((), False),
+    'branch': ((), False),
+    'subject': ((), False),
+    'status': ((), False),
+    # Without DETAILED_ACCOUNTS, accounts only have an _account_id
+    'owner': (('DETAILED_ACCOUNTS',), False),
+    'current_revision': (('CURRENT_REVISION',), False),
+    'revisions': (('ALL_REVISIONS', 'ALL_COMMITS'), False),
+    # Summary of the votes of each label
+    'labels': (('LABELS',), False),
+    # Reviewers are read from the votes of the labels of /detail
+    'reviewers': (('DETAILED_ACCOUNTS', 'DETAILED_LABELS'), True),
+}
+
+# Query options implied by another option
+IMPLIED_OPTIONS = {
+    'ALL_REVISIONS': ('CURRENT_REVISION',),
+    'ALL_COMMITS': ('CURRENT_COMMIT',),
+    'DETAILED_LABELS': ('LABELS',),
+}
+
+
+class FieldMask(object):
+    """An immutable set of ChangeInfo fields"""
+
+    def __init__(self, *fields):
+        """Constructor
+
+        :param *fields: the names of the fields (see FIELDS)
+        :type *fields: list[str]
+        :raise: ValueError if a field is unknown
+        """
+
+        unknown = set(fields).difference(FIELDS)
+
+        if unknown:
+            raise ValueError('unknown field(s): {}'.format(
+                ', '.join(sorted(unknown))))
+
+        self.fields = frozenset(fields)
+
+    def __contains__(self, field):
+        return field in self.fields
+
+    def __or__(self, other):
+        return FieldMask(*self.fields.union(other.fields))
+
+    def __repr__(self):
+        return 'FieldMask({})'.format(', '.join(sorted(self.fields)))
+
+    @property
+    def options(self):
+        """The minimal list of query options to request the fields with
+
+        :rtype: list[str]
+        """
+
+        options = set()
+
+        for field in self.fields:
+            options.update(FIELDS[field][0])
+
+        # Drop the options implied by another one
+        for option in list(options):
+            options.difference_update(IMPLIED_OPTIONS.get(option, ()))
+
+        return sorted(options)
+
+    @property
+    def detail(self):
+        """Whether the /detail endpoint is required
+
+        :rtype: bool
+        """
+
+        return any(FIELDS[field][1] for field in self.fields)
+
+    def is_covered_by(self, options):
+        """Whether a response to a query with OPTIONS contains all fields
+
+        :param options: the query options of the response
+        :type options: collections.iterable[str]
+        :rtype: bool
+        """
+
+        available = set(options)
+
+        for option in options:
+            available.update(IMPLIED_OPTIONS.get(option, ()))
+
+        return not self.detail and available.issuperset(self.options)
+
+
+# Fields rendered by ChangeInfo.tokenize and used to address the change
+SUMMARY = FieldMask('uuid', 'change_id', 'legacy_id', 'project', 'branch',
+                    'subject', 'status', 'owner')
+
+# Fields parsed when no mask is specified
+DEFAULT = SUMMARY | FieldMask('current_revision')
@@ -0,0 +1,935 @@
+"""Local index of changes kept up to date by the Gerrit events stream
+
+The index is a SQLite database seeded by a paginated query, then updated from
+the stream-events SSH interface (see libpycr.gerrit.events). It is fed by the
+daemon (pycr-daemon --index) and read by Gerrit.list_changes, which falls back
+to querying the server when the index is missing, stale, or cannot answer the
+query.
+
+Configuration ([index] section):
+
+    path = ...          ; the database (default: changes-HOST-USERNAME.db,
+                        ; in the cache directory)
+    enabled = true      ; whether list queries may be served from the index
+    maxage = 60         ; seconds after which a silent index is stale
+    statuses = open     ; comma-separated list of statuses to seed
+"""
+
+import Queue
+import datetime
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import urllib
+
+from libpycr.config import Config
+from libpycr.exceptions import RequestError
+from libpycr.gerrit.api import changes as api
+from libpycr.http import RequestFactory, SessionPool
+from libpycr.utils.system import get_host_cache_path
+
+
+# Default number of seconds after which the index is considered stale if the
+# feeder stopped sending heartbeats
+DEFAULT_MAX_AGE = 60
+
+# Default list of statuses to seed the index with
+DEFAULT_STATUSES = ('open',)
+
+# Period, in seconds, of the feeder heartbeats
+HEARTBEAT_PERIOD = 15
+
+# Number of changes to fetch per request when seeding the index
+PAGE_SIZE = 500
+
+# Delay, in seconds, before reconnecting to the events stream
+RECONNECT_DELAY = 30
+
+# Query status -> Gerrit ChangeInfo statuses
+STATUSES = {
+    'open': ('NEW', 'SUBMITTED', 'DRAFT'),
+    'submitted': ('SUBMITTED',),
+    'merged': ('MERGED',),
+    'abandoned': ('ABANDONED',),
+    'closed': ('MERGED', 'ABANDONED'),
+}
+
+# Event type -> status of the change after the event
+EVENT_STATUSES = {
+    'patchset-created': 'NEW',
+    'draft-published': 'NEW',
+    'change-restored': 'NEW',
+    'change-merged': 'MERGED',
+    'change-abandoned': 'ABANDONED',
+}
+
+# Format of the ChangeInfo.updated field
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f000'
+
+# Version of the database schema (user_version), bumped on each change: the
+# feeder recreates the index if it was created with another version
+SCHEMA_VERSION = 2
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS changes (
+    uuid TEXT PRIMARY KEY,
+    project TEXT,
+    status TEXT,
+    owner_username TEXT,
+    owner_email TEXT,
+    owner_account_id INTEGER,
+    updated TEXT,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS changes_project ON changes (project);
+CREATE INDEX IF NOT EXISTS changes_status ON changes (status);
+CREATE INDEX IF NOT EXISTS changes_owner_username ON changes (owner_username);
+CREATE INDEX IF NOT EXISTS changes_owner_email ON changes (owner_email);
+CREATE INDEX IF NOT EXISTS changes_owner_account_id
+    ON changes (owner_account_id);
+
+CREATE TABLE IF NOT EXISTS reviewers (
+    uuid TEXT,
+    account TEXT,
+    PRIMARY KEY (uuid, account)
+);
+CREATE INDEX IF NOT EXISTS reviewers_account ON reviewers (account);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+# Changes fetched by the seeding query are stored in these temporary tables
+# until the index content is replaced by them (see ChangeIndex.reset)
+STAGING_SCHEMA = '''
+CREATE TEMP TABLE IF NOT EXISTS staged_changes (
+    uuid TEXT PRIMARY KEY,
+    project TEXT,
+    status TEXT,
+    owner_username TEXT,
+    owner_email TEXT,
+    owner_account_id INTEGER,
+    updated TEXT,
+    data TEXT
+);
+CREATE TEMP TABLE IF NOT EXISTS staged_reviewers (
+    uuid TEXT,
+    account TEXT,
+    PRIMARY KEY (uuid, account)
+);
+'''
+
+
+def get_index_path():
+    """Return the path to the index database of the configured server
+
+    The index only contains the changes visible to the account that fed it:
+    each account has its own. Returns None if the server is not configured.
+
+    :rtype: str | None
+    """
+
+    path = Config.get('index.path')
+
+    if path is not None:
+        return os.path.expanduser(path)
+
+    host = Config.get('gerrit.host')
+
+    if host is None:
+        return None
+
+    return get_host_cache_path('changes', host, '.db',
+                               Config.get('gerrit.username'))
+
+
+def get_account_keys(account):
+    """Return the keys under which an account is indexed
+
+    :param account: JSON representation of the account as emitted by Gerrit
+    :type account: dict
+    :rtype: set[str]
+    """
+
+    keys = set()
+
+    if account.get('username'):
+        keys.add(account['username'])
+    if account.get('email'):
+        keys.add(account['email'].lower())
+
+    return keys
+
+
+def get_reviewers(data):
+    """Return the keys of the reviewers of a change
+
+    Reviewers are listed in the labels when the DETAILED_LABELS option is
+    requested.
+
+    :param data: JSON representation of the change as emitted by Gerrit
+    :type data: dict
+    :rtype: set[str]
+    """
+
+    reviewers = set()
+
+    for label in data.get('labels', {}).values():
+        for approval in label.get('all', ()):
+            reviewers.update(get_account_keys(approval))
+
+    for account in data.get('removable_reviewers', ()):
+        reviewers.update(get_account_keys(account))
+
+    return reviewers
+
+
+def summarize_label(label):
+    """Update the summary of a detailed label from its votes
+
+    Sets the approved, rejected, recommended and disliked accounts (and the
+    value of the recommendation or dislike) the way Gerrit does. Approving
+    and blocking votes are only recognized if the range of the label is
+    known.
+
+    :param label: JSON representation of the label as emitted by Gerrit
+        (with the DETAILED_LABELS option)
+    :type label: dict
+    """
+
+    for key in ('approved', 'rejected', 'recommended', 'disliked', 'value'):
+        label.pop(key, None)
+
+    scores = [int(score) for score in label.get('values', ())]
+    recommended = disliked = None
+
+    for vote in label.get('all', ()):
+        value = vote.get('value', 0)
+        account = dict((key, vote[key]) for key in vote
+                       if key not in ('value', 'date'))
+
+        if scores and value == max(scores) and value > 0:
+            label['approved'] = account
+        elif scores and value == min(scores) and value < 0:
+            label['rejected'] = account
+        elif value > 0 and (recommended is None or value > recommended[0]):
+            recommended = value, account
+        elif value < 0 and (disliked is None or value < disliked[0]):
+            disliked = value, account
+
+    if recommended is not None:
+        label['recommended'] = recommended[1]
+    if disliked is not None:
+        label['disliked'] = disliked[1]
+
+    # A single value is given (if not -1 / +1): that of the dislike, if any
+    vote = disliked or recommended
+
+    if vote is not None and abs(vote[0]) != 1:
+        label['value'] = vote[0]
+
+
+def set_vote(label, account, value):
+    """Record the vote of an account on a detailed label
+
+    :param label: JSON representation of the label as emitted by Gerrit
+        (with the DETAILED_LABELS option)
+    :type label: dict
+    :param account: JSON representation of the account (as emitted by Gerrit
+        or stream-events)
+    :type account: dict
+    :param value: the vote
+    :type value: int
+    """
+
+    keys = get_account_keys(account)
+    votes = label.setdefault('all', [])
+
+    for vote in votes:
+        if keys & get_account_keys(vote):
+            vote['value'] = value
+            break
+    else:
+        vote = dict(account)
+        vote['value'] = value
+        votes.append(vote)
+
+    summarize_label(label)
+
+
+def format_timestamp(timestamp=None):
+    """Format an epoch timestamp as a Gerrit timestamp
+
+    :param timestamp: seconds since the epoch (default: now)
+    :type timestamp: float | None
+    :rtype: str
+    """
+
+    if timestamp is None:
+        timestamp = time.time()
+
+    return datetime.datetime.utcfromtimestamp(timestamp).strftime(
+        TIMESTAMP_FORMAT)
+
+
+def get_event_change_id(change):
+    """Return the ID of the change attribute of an event
+
+    :param change: the change attribute of the event
+    :type change: dict
+    :rtype: str
+    """
+
+    return '~'.join((urllib.quote(change['project'], safe=''),
+                     urllib.quote(change['branch'], safe=''),
+                     change['id']))
+
+
+def parse_event_change(event):
+    """Convert the change attribute of an event into a ChangeInfo entity
+
+    :param event: the event object, as emitted by stream-events
+    :type event: dict
+    :rtype: dict
+    """
+
+    change = event['change']
+
+    data = {
+        'id': get_event_change_id(change),
+        'change_id': change['id'],
+        '_number': int(change['number']),
+        'project': change['project'],
+        'branch': change['branch'],
+        'subject': change['subject'],
+        'owner': change['owner'],
+        'updated': format_timestamp(event.get('eventCreatedOn')),
+    }
+
+    if 'topic' in change:
+        data['topic'] = change['topic']
+
+    status = EVENT_STATUSES.get(event['type'], change.get('status'))
+
+    if status is not None:
+        data['status'] = status
+
+    return data
+
+
+class ChangeIndex(object):
+    """SQLite index of changes
+
+    An instance must only be used from the thread that created it. Only the
+    feeder creates the database and writes to it: the other users open it
+    read-only.
+    """
+
+    # Logger
+    log = logging.getLogger(__name__)
+
+    # Query options of the changes stored in the index
+    OPTIONS = ('DETAILED_ACCOUNTS', 'DETAILED_LABELS')
+
+    def __init__(self, path, readonly=False):
+        """Constructor
+
+        :param path: the path to the index database
+        :type path: str
+        :param readonly: whether to open an existing index for reading only
+        :type readonly: bool
+        """
+
+        self.path = path
+        self._db = sqlite3.connect(path)
+
+        if readonly:
+            # The sqlite3 module of Python 2 does not accept URI filenames
+            # (mode=ro): forbid writes on the connection instead
+            self._db.execute('PRAGMA query_only = ON')
+        else:
+            # Allow the feeder to update the index while clients read it
+            self._db.execute('PRAGMA journal_mode=WAL')
+
+            if self.get_version() != SCHEMA_VERSION:
+                # The index is reseeded anyway
+                self._db.executescript('''
+                    DROP TABLE IF EXISTS changes;
+                    DROP TABLE IF EXISTS reviewers;
+                    DROP TABLE IF EXISTS meta;
+                ''')
+
+            self._db.executescript(SCHEMA)
+            self._db.execute('PRAGMA user_version = {}'.format(
+                SCHEMA_VERSION))
+
+    @classmethod
+    def open_default(cls):
+        """Open the index of the configured server
+
+        Returns None if the index is disabled, does not exist, or was created
+        by another version.
+
+        :rtype: ChangeIndex | None
+        """
+
+        if not Config.get_bool('index.enabled', True):
+            return None
+
+        path = get_index_path()
+
+        if path is None or not os.path.isfile(path):
+            return None
+
+        index = cls(path, readonly=True)
+
+        if index.get_version() != SCHEMA_VERSION:
+            index.close()
+            return None
+
+        return index
+
+    def close(self):
+        """Close the database"""
+
+        self._db.close()
+
+    def get_version(self):
+        """Return the version of the schema of the database (0 if empty)
+
+        :rtype: int
+        """
+
+        return self._db.execute('PRAGMA user_version').fetchone()[0]
+
+    def get_meta(self, key, default=None):
+        """Return a metadata value
+
+        :param key: the metadata key
+        :type key: str
+        :param default: the value to return if KEY is not set
+        :type default: str | None
+        :rtype: str | None
+        """
+
+        row = self._db.execute(
+            'SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+
+        return default if row is None else row[0]
+
+    def set_meta(self, key, value):
+        """Set a metadata value
+
+        :param key: the metadata key
+        :type key: str
+        :param value: the value
+        :type value: str
+        """
+
+        with self._db:
+            self._db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                             (key, value))
+
+    def heartbeat(self):
+        """Record that the index is up-to-date"""
+
+        self.set_meta('heartbeat', repr(time.time()))
+
+    def is_fresh(self, max_age=None):
+        """Whether the index was recently updated by a feeder
+
+        :param max_age: the maximum number of seconds since the last
+            heartbeat (default: index.maxage)
+        :type max_age: int | None
+        :rtype: bool
+        """
+
+        if max_age is None:
+            max_age = Config.get_int('index.maxage', DEFAULT_MAX_AGE)
+
+        heartbeat = float(self.get_meta('heartbeat', 0))
+        return time.time() - heartbeat <= max_age
+
+    def covers(self, status):
+        """Whether the index contains all the changes with STATUS
+
+        :param status: the status of the changes (open, merged, ...)
+        :type status: str
+        :rtype: bool
+        """
+
+        seeded = set()
+
+        for name in self.get_meta('statuses', '').split(','):
+            seeded.update(STATUSES.get(name, ()))
+
+        return status in STATUSES and seeded.issuperset(STATUSES[status])
+
+    def query(self, status=None, owner=None, reviewer=None, project=None):
+        """Return the changes that match all the given criteria
+
+        Changes are returned as JSON objects, most recently updated first.
+
+        :param status: the status of the changes (open, merged, ...)
+        :type status: str | None
+        :param owner: the username, email or account ID of the owner of the
+            changes
+        :type owner: str | None
+        :param reviewer: the username or email of a reviewer of the changes
+        :type reviewer: str | None
+        :param project: the project of the changes
+        :type project: str | None
+        :rtype: list[dict]
+        """
+
+        sql = ['SELECT data FROM changes']
+        where, params = [], []
+
+        if status is not None:
+            statuses = STATUSES[status]
+            where.append('status IN ({})'.format(
+                ', '.join('?' * len(statuses))))
+            params.extend(statuses)
+
+        if owner is not None:
+            where.append(self._match_owner(owner, params))
+
+        if reviewer is not None:
+            sql.append('JOIN reviewers USING (uuid)')
+            where.append('account = ?')
+            params.append(reviewer if '@' not in reviewer
+                          else reviewer.lower())
+
+        if project is not None:
+            where.append('project = ?')
+            params.append(project)
+
+        if where:
+            sql.append('WHERE ' + ' AND '.join(where))
+
+        sql.append('ORDER BY updated DESC')
+
+        return [json.loads(row[0]) for row in
+                self._db.execute(' '.join(sql), params)]
+
+    @staticmethod
+    def _match_owner(owner, params):
+        """Return the SQL condition matching the changes owned by OWNER
+
+        The parameters of the condition are appended to PARAMS.
+
+        :param owner: the username, email or account ID of the owner
+        :type owner: str
+        :param params: the parameters of the query
+        :type params: list
+        :rtype: str
+        """
+
+        if owner.isdigit():
+            params.append(int(owner))
+            return 'owner_account_id = ?'
+
+        params.extend((owner, owner.lower()))
+        return '(owner_username = ? OR owner_email = ?)'
+
+    def has_owner(self, owner):
+        """Whether the index contains changes owned by OWNER
+
+        :param owner: the username, email or account ID of the owner
+        :type owner: str
+        :rtype: bool
+        """
+
+        params = []
+        sql = 'SELECT 1 FROM changes WHERE {} LIMIT 1'.format(
+            self._match_owner(owner, params))
+
+        return self._db.execute(sql, params).fetchone() is not None
+
+    def list_changes(self, status='open', owner='self'):
+        """Answer a Gerrit.list_changes query
+
+        Returns None if the index cannot answer the query (stale index,
+        incomplete status, unknown current user or owner).
+
+        :param status: the status of the changes (open, merged, ...)
+        :type status: str
+        :param owner: the account_id of the owner of the changes
+        :type owner: str
+        :rtype: list[dict] | None
+        """
+
+        if owner == 'self':
+            owner = Config.get('gerrit.username')
+
+        elif not self.has_owner(owner):
+            # The server also matches the owner by full name, and knows the
+            # accounts that own no indexed change
+            return None
+
+        if owner is None or not self.covers(status) or not self.is_fresh():
+            return None
+
+        return self.query(status=status, owner=owner)
+
+    def _store(self, data, reviewers=None, prefix=''):
+        """Insert or update a change (no commit)
+
+        :param data: JSON representation of the change as emitted by Gerrit
+        :type data: dict
+        :param reviewers: the keys of the reviewers of the change (default:
+            extracted from DATA)
+        :type reviewers: collections.iterable[str] | None
+        :param prefix: the prefix of the tables to store the change into
+            ('staged_' for the staging tables)
+        :type prefix: str
+        """
+
+        owner = data.get('owner', {})
+
+        self._db.execute(
+            'INSERT OR REPLACE INTO {}changes VALUES (?, ?, ?, ?, ?, ?, ?, ?)'
+            .format(prefix),
+            (data['id'], data['project'], data.get('status'),
+             owner.get('username'), (owner.get('email') or '').lower(),
+             owner.get('_account_id'), data.get('updated'), json.dumps(data)))
+
+        for account in get_reviewers(data) if reviewers is None else reviewers:
+            self._db.execute(
+                'INSERT OR IGNORE INTO {}reviewers VALUES (?, ?)'.format(
+                    prefix), (data['id'], account))
+
+    def stage(self, changes):
+        """Store changes in the staging tables, until the next reset()
+
+        The staging tables are private to this instance: the content of the
+        index is left untouched.
+
+        :param changes: JSON representation of the changes as emitted by
+            Gerrit (with the DETAILED_ACCOUNTS and DETAILED_LABELS options)
+        :type changes: collections.iterable[dict]
+        """
+
+        with self._db:
+            self._db.executescript(STAGING_SCHEMA)
+
+            for data in changes:
+                self._store(data, prefix='staged_')
+
+    def discard_staged(self):
+        """Drop the changes stored by stage()"""
+
+        with self._db:
+            self._db.execute('DROP TABLE IF EXISTS temp.staged_changes')
+            self._db.execute('DROP TABLE IF EXISTS temp.staged_reviewers')
+
+    def reset(self, statuses):
+        """Replace the content of the index with the staged changes
+
+        :param statuses: the statuses the staged changes were fetched for
+        :type statuses: collections.iterable[str]
+        """
+
+        with self._db:
+            self._db.executescript(STAGING_SCHEMA)
+
+            self._db.execute('DELETE FROM changes')
+            self._db.execute('DELETE FROM reviewers')
+            self._db.execute(
+                'INSERT INTO changes SELECT * FROM temp.staged_changes')
+            self._db.execute(
+                'INSERT INTO reviewers SELECT * FROM temp.staged_reviewers')
+
+            self._db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                             ('statuses', ','.join(statuses)))
+            self._db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                             ('heartbeat', repr(time.time())))
+
+        self.discard_staged()
+
+    def store(self, data):
+        """Insert or update a change
+
+        :param data: JSON representation of the change as emitted by Gerrit
+            (with the DETAILED_ACCOUNTS and DETAILED_LABELS options)
+        :type data: dict
+        """
+
+        with self._db:
+            self._store(data)
+
+    def apply_event(self, event):
+        """Update the index from a stream-events event
+
+        Returns False if the change of the event is not in the index: it must
+        be fetched (see store()), events only give part of its state.
+
+        :param event: the event object
+        :type event: dict
+        :rtype: bool
+        """
+
+        if 'change' not in event:
+            # Not a change event (eg. ref-updated)
+            return True
+
+        update = parse_event_change(event)
+
+        row = self._db.execute('SELECT data FROM changes WHERE uuid = ?',
+                               (update['id'],)).fetchone()
+
+        if row is None:
+            return False
+
+        data = json.loads(row[0])
+
+        # Events do not give account IDs: keep that of the owner
+        owner = data.get('owner', {})
+        owner.update(update.pop('owner'))
+
+        data.update(update)
+        data['owner'] = owner
+
+        labels = data.setdefault('labels', {})
+        reviewers = set()
+
+        if event['type'] == 'reviewer-added':
+            reviewers.update(get_account_keys(event['reviewer']))
+
+        elif event['type'] == 'comment-added' and event.get('approvals'):
+            reviewers.update(get_account_keys(event['author']))
+
+            for approval in event['approvals']:
+                set_vote(labels.setdefault(approval['type'], {}),
+                         event['author'], int(approval['value']))
+
+        elif event['type'] == 'patchset-created':
+            # Votes apply to a patch set: the reviewers remain
+            for label in labels.itervalues():
+                for vote in label.get('all', ()):
+                    vote['value'] = 0
+
+                summarize_label(label)
+
+        self.log.debug('%s: %s', event['type'], update['id'])
+
+        with self._db:
+            self._store(data, reviewers)
+
+        return True
+
+
+class IndexFeeder(object):
+    """Seed a ChangeIndex and keep it up to date from the events stream"""
+
+    # Logger
+    log = logging.getLogger(__name__)
+
+    def __init__(self, path, config, lock=None, environ_lock=None):
+        """Constructor
+
+        :param path: the path to the index database
+        :type path: str
+        :param config: the configuration entries to use, as returned by
+            Config.snapshot()
+        :type config: dict
+        :param lock: lock to hold while replacing the content of the index
+            (see libpycr.daemon)
+        :type lock: threading.Lock | None
+        :param environ_lock: lock to hold while relying on the process
+            environment (HTTP proxies, CA bundle, SSH agent and keys), which
+            the daemon replaces for each command
+        :type environ_lock: threading.Lock | None
+        """
+
+        self.path = path
+        self.config = config
+        self._lock = lock or threading.Lock()
+        self._environ_lock = environ_lock or threading.Lock()
+        self._events = Queue.Queue()
+        self._notifier = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start feeding the index in a background thread"""
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop feeding the index"""
+
+        self._stopped.set()
+
+        if self._notifier is not None and self._notifier.is_connected():
+            self._notifier.stop()
+
+    def _create_notifier(self):
+        """Create the events stream listener from the configuration
+
+        :rtype: libpycr.gerrit.events.EventNotifier
+        """
+
+        from libpycr.gerrit.events import EventNotifier
+        import libpycr.gerrit.ssh
+
+        host = self.config.get('ssh.host') or self.config['gerrit.host']
+        host = re.sub(r'^\w+://', '', host).split('/')[0].split(':')[0]
+
+        notifier = EventNotifier(
+            host, int(self.config.get('gerrit.port', libpycr.gerrit.ssh.PORT)),
+            username=(self.config.get('ssh.username') or
+                      self.config.get('gerrit.username')),
+            keyfile=self.config.get('ssh.keyfile'))
+        notifier.listen_all(lambda e: self._events.put((time.time(), e)))
+
+        return notifier
+
+    def _seed(self, index):
+        """Fetch all the changes with the configured statuses into INDEX
+
+        The pages are staged as they are received: the lock is only held
+        while the content of the index is replaced.
+
+        :param index: the index to seed
+        :type index: ChangeIndex
+        :rtype: int
+        """
+
+        statuses = [s.strip() for s in self.config.get(
+            'index.statuses', ','.join(DEFAULT_STATUSES)).split(',')]
+        count = 0
+
+        index.discard_staged()
+
+        for status in statuses:
+            start = 0
+
+            while True:
+                params = {'o': list(ChangeIndex.OPTIONS),
+                          'n': PAGE_SIZE, 'S': start}
+                page = self._get(api.search_query(status=status),
+                                 params=params)
+
+                index.stage(page)
+                count += len(page)
+                start += len(page)
+
+                if not page or not page[-1].get('_more_changes'):
+                    break
+
+        with self._lock:
+            index.reset(statuses)
+
+        return count
+
+    def _get(self, endpoint, **kwargs):
+        """Send a GET request to the server and return the decoded response
+
+        :param endpoint: the endpoint of the request
+        :type endpoint: str
+        :param **kwargs: the arguments of RequestFactory.get
+        :type **kwargs: dict
+        :rtype: object
+        """
+
+        with self._environ_lock:
+            return RequestFactory.get(endpoint, **kwargs)
+
+    def _fetch(self, index, change):
+        """Fetch a change missing from the index and store it
+
+        :param index: the index to update
+        :type index: ChangeIndex
+        :param change: the change attribute of the event about the change
+        :type change: dict
+        """
+
+        change_id = get_event_change_id(change)
+
+        try:
+            data = self._get(api.changes(change_id),
+                             params={'o': list(ChangeIndex.OPTIONS)})
+
+        except RequestError as why:
+            # Eg. the change is not visible to the feeder's account
+            self.log.debug('%s: cannot fetch change: %s', change_id, why)
+            return
+
+        self.log.debug('%s: fetched', change_id)
+        index.store(data)
+
+    def _run(self):
+        """Feeder main loop"""
+
+        # Use the configuration and HTTP sessions of the feeder, rather than
+        # the ones of the commands run by the daemon
+        Config.use(self.config)
+        RequestFactory.use_pool(SessionPool())
+
+        index = ChangeIndex(self.path)
+
+        while not self._stopped.is_set():
+            self._notifier = self._create_notifier()
+            listener = threading.Thread(target=self._notifier.start)
+            listener.daemon = True
+
+            try:
+                self._feed(index, listener)
+            except Exception:  # pylint: disable=broad-except
+                self.log.exception('index feeder error')
+
+            # Events may be missed until the index is seeded again
+            index.set_meta('heartbeat', '0')
+
+            if self._notifier.is_connected():
+                self._notifier.stop()
+
+            self._stopped.wait(RECONNECT_DELAY)
+
+    def _feed(self, index, listener):
+        """Seed the index, then apply the events as they come
+
+        :param index: the index to feed
+        :type index: ChangeIndex
+        :param listener: the thread to run the events stream listener
+        :type listener: threading.Thread
+        """
+
+        # Events are queued while seeding: the stream must be connected
+        # before the query so that no update is lost
+        with self._environ_lock:
+            listener.start()
+
+            while listener.is_alive() and not self._notifier.is_connected():
+                listener.join(0.1)
+
+        if not listener.is_alive():
+            return
+
+        seeded_at = time.time()
+        count = self._seed(index)
+        self.log.debug('Index seeded with %d change(s)', count)
+
+        while listener.is_alive() and not self._stopped.is_set():
+            try:
+                received_at, event = self._events.get(
+                    timeout=HEARTBEAT_PERIOD)
+
+                # Already reflected by the seeding query
+                if received_at >= seeded_at and not index.apply_event(event):
+                    self._fetch(index, event['change'])
+
+            except Queue.Empty:
+                pass
+
+            if self._notifier.is_connected():
+                index.heartbeat()
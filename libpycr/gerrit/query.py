@@ -0,0 +1,411 @@
+"""Gerrit Code Review change search queries
+
+Queries are built from search operators, and combined with the & (AND), |
+(OR) and ~ (NOT) operators. Parentheses are added where needed, and values
+are quoted:
+
+    >>> query = Query.status('open') & Query.project('tools/pycr') & (
+    ...     Query.label('Code-Review', 2) | ~Query.is_state('wip'))
+    >>> str(query)
+    'status:open project:tools/pycr (label:Code-Review=+2 OR -is:wip)'
+    >>> query.encode()
+    'status:open+project:tools/pycr+%28label:Code-Review%3D%2B2+OR+-is:wip%29'
+
+Queries written by the user (eg. git cl list -q) are checked with Query.raw
+and can be combined like any other query.
+"""
+
+import datetime
+import numbers
+import operator
+import re
+import urllib
+
+
+# Characters that prevent a value from being sent as a single word
+SPECIAL_CHARACTERS = re.compile(r'[\s"(){}]')
+
+# Characters kept as is when URL-encoding a query
+SAFE_CHARACTERS = ':/'
+
+# Format of the dates of the before: and after: operators
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Tokens of the query language, as recognized by Query.raw: phrases, words and
+# parentheses
+TOKENS = re.compile(r'\s*(?:"[^"]*"|\{[^{}]*\}|[^\s"(){}]+|[()])')
+
+
+def quote(value):
+    """Quote VALUE if it is not a single word
+
+    The Gerrit query language does not support escape sequences: values that
+    contain double quotes are enclosed in braces.
+
+    :param value: the operator value
+    :type value: str
+    :rtype: str
+    :raise: ValueError if VALUE cannot be quoted
+    """
+
+    if value and not SPECIAL_CHARACTERS.search(value):
+        return value
+
+    if '"' not in value:
+        return '"%s"' % value
+
+    if '{' not in value and '}' not in value:
+        return '{%s}' % value
+
+    raise ValueError('cannot quote value: %s' % value)
+
+
+def format_date(value):
+    """Format a date for the before: and after: operators
+
+    :param value: the date (strings are passed as is)
+    :type value: datetime.datetime | datetime.date | str
+    :rtype: str
+    """
+
+    if isinstance(value, datetime.datetime):
+        return value.strftime(DATE_FORMAT)
+
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+
+    return value
+
+
+def encode_queries(queries):
+    """Encode QUERIES as the q= parameters of a request URL
+
+    The server answers a request with several q= parameters with a list of
+    results, one per query.
+
+    :param queries: the queries
+    :type queries: list[Query]
+    :rtype: str
+    """
+
+    return '&'.join('q=' + query.encode() for query in queries)
+
+
+class Query(object):
+    """An immutable Gerrit Code Review change search query"""
+
+    # Precedence of the expressions, lowest first: combining a query with an
+    # operator of higher precedence requires parentheses
+    OR, AND, NOT = range(3)
+
+    def __init__(self, text, precedence=NOT):
+        """Constructor
+
+        Use the class methods to create queries.
+
+        :param text: the query
+        :type text: str
+        :param precedence: the precedence of the top-level operator of TEXT
+        :type precedence: int
+        """
+
+        self.text = text
+        self.precedence = precedence
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return 'Query(%r)' % self.text
+
+    def __eq__(self, other):
+        return isinstance(other, Query) and self.text == other.text
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.text)
+
+    def group(self, precedence):
+        """Return the text of this query as an operand of PRECEDENCE
+
+        :param precedence: the precedence of the operator
+        :type precedence: int
+        :rtype: str
+        """
+
+        if self.precedence < precedence:
+            return '(%s)' % self.text
+
+        return self.text
+
+    def __and__(self, other):
+        return Query('{} {}'.format(
+            self.group(Query.AND), other.group(Query.AND)), Query.AND)
+
+    def __or__(self, other):
+        return Query('{} OR {}'.format(
+            self.group(Query.OR), other.group(Query.OR)), Query.OR)
+
+    def __invert__(self):
+        return Query('-%s' % self.group(Query.NOT), Query.NOT)
+
+    def encode(self):
+        """Return this query, encoded for the q= parameter of a request URL
+
+        :rtype: str
+        """
+
+        text = self.text
+
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+
+        return urllib.quote_plus(text, safe=SAFE_CHARACTERS)
+
+    @staticmethod
+    def all(*queries):
+        """Return the query matching all QUERIES
+
+        None queries are ignored. Returns None if there is no query.
+
+        :param *queries: the queries
+        :type *queries: list[Query | None]
+        :rtype: Query | None
+        """
+
+        queries = [query for query in queries if query is not None]
+        return reduce(operator.and_, queries) if queries else None
+
+    @staticmethod
+    def any(*queries):
+        """Return the query matching any of QUERIES
+
+        None queries are ignored. Returns None if there is no query.
+
+        :param *queries: the queries
+        :type *queries: list[Query | None]
+        :rtype: Query | None
+        """
+
+        queries = [query for query in queries if query is not None]
+        return reduce(operator.or_, queries) if queries else None
+
+    @classmethod
+    def raw(cls, text):
+        """Create a query from a string in the Gerrit query language
+
+        The string is only checked for unbalanced quotes, braces and
+        parentheses.
+
+        :param text: the query
+        :type text: str
+        :rtype: Query
+        :raise: ValueError if TEXT is not a valid query
+        """
+
+        text = text.strip()
+        depth, position = 0, 0
+
+        if not text:
+            raise ValueError('empty query')
+
+        while position < len(text):
+            match = TOKENS.match(text, position)
+
+            if match is None or not match.group().strip():
+                raise ValueError('unbalanced quote or brace at: %s' %
+                                 text[position:].strip())
+
+            token = match.group().strip()
+            position = match.end()
+
+            if token == '(':
+                depth += 1
+            elif token == ')':
+                depth -= 1
+
+            if depth < 0:
+                raise ValueError('unbalanced parenthesis')
+
+        if depth:
+            raise ValueError('unbalanced parenthesis')
+
+        # The precedence of the top-level operator is unknown
+        return cls(text, Query.OR)
+
+    @classmethod
+    def term(cls, name, value):
+        """Create a query from a search operator
+
+        :param name: the name of the operator (eg. project)
+        :type name: str
+        :param value: the value of the operator
+        :type value: str
+        :rtype: Query
+        :raise: ValueError if VALUE cannot be quoted
+        """
+
+        return cls('%s:%s' % (name, quote(value)))
+
+    @classmethod
+    def status(cls, status):
+        """Changes with STATUS (open, merged, abandoned, ...)
+
+        :param status: the status of the changes
+        :type status: str
+        :rtype: Query
+        """
+
+        return cls.term('status', status)
+
+    @classmethod
+    def owner(cls, owner):
+        """Changes owned by OWNER (account or self)
+
+        :param owner: the owner of the changes
+        :type owner: str
+        :rtype: Query
+        """
+
+        return cls.term('owner', owner)
+
+    @classmethod
+    def reviewer(cls, reviewer):
+        """Changes reviewed by REVIEWER (account or self)
+
+        :param reviewer: the reviewer of the changes
+        :type reviewer: str
+        :rtype: Query
+        """
+
+        return cls.term('reviewer', reviewer)
+
+    @classmethod
+    def project(cls, project):
+        """Changes of PROJECT
+
+        :param project: the name of the project
+        :type project: str
+        :rtype: Query
+        """
+
+        return cls.term('project', project)
+
+    @classmethod
+    def branch(cls, branch):
+        """Changes targeting BRANCH
+
+        :param branch: the name of the destination branch
+        :type branch: str
+        :rtype: Query
+        """
+
+        return cls.term('branch', branch)
+
+    @classmethod
+    def topic(cls, topic):
+        """Changes with TOPIC
+
+        :param topic: the topic of the changes
+        :type topic: str
+        :rtype: Query
+        """
+
+        return cls.term('topic', topic)
+
+    @classmethod
+    def age(cls, age):
+        """Changes not updated for at least AGE
+
+        :param age: the age, in seconds or as a Gerrit duration (eg. 2d, 1w)
+        :type age: int | str
+        :rtype: Query
+        """
+
+        if isinstance(age, numbers.Number):
+            age = '%ds' % age
+
+        return cls.term('age', age)
+
+    @classmethod
+    def before(cls, date):
+        """Changes last updated before DATE
+
+        :param date: the date (strings are passed as is, eg. 2016-01-31)
+        :type date: datetime.datetime | datetime.date | str
+        :rtype: Query
+        """
+
+        return cls.term('before', format_date(date))
+
+    @classmethod
+    def after(cls, date):
+        """Changes last updated after DATE
+
+        :param date: the date (strings are passed as is, eg. 2016-01-31)
+        :type date: datetime.datetime | datetime.date | str
+        :rtype: Query
+        """
+
+        return cls.term('after', format_date(date))
+
+    @classmethod
+    def label(cls, label, score=None, user=None):
+        """Changes with a vote on LABEL
+
+        :param label: the name of the label (eg. Code-Review)
+        :type label: str
+        :param score: the score (eg. -1, or a comparison such as '>=1');
+            any score if None
+        :type score: int | str | None
+        :param user: the account (or group) that voted, if any
+        :type user: str | None
+        :rtype: Query
+        """
+
+        value = label
+
+        if isinstance(score, numbers.Number):
+            value += '=%+d' % score if score else '=0'
+        elif score is not None:
+            value += score if score[:1] in '=<>' else '=' + score
+
+        if user is not None:
+            value += ',user=%s' % user
+
+        return cls.term('label', value)
+
+    @classmethod
+    def file(cls, path):
+        """Changes modifying PATH (or matching a ^regular expression)
+
+        :param path: the path of the file
+        :type path: str
+        :rtype: Query
+        """
+
+        return cls.term('file', path)
+
+    @classmethod
+    def message(cls, text):
+        """Changes with TEXT in their commit message
+
+        :param text: the text to look for
+        :type text: str
+        :rtype: Query
+        """
+
+        return cls.term('message', text)
+
+    @classmethod
+    def is_state(cls, state):
+        """Changes in STATE (watched, starred, reviewed, wip, ...)
+
+        :param state: the argument of the is: operator
+        :type state: str
+        :rtype: Query
+        """
+
+        return cls.term('is', state)
@@ -0,0 +1,358 @@
+"""Resolution of reviewer identifiers into accounts and groups
+
+Reviewers are given on the command-line as free-form identifiers (username,
+email, full name or group name). They are resolved once per command, with
+concurrent account queries (one per identifier), into account IDs: a
+misspelled reviewer is reported before any change is modified, and the server
+does not resolve the same identifier again for each change.
+
+Resolutions, the members of the groups, and the groups for which the server
+asks for a confirmation before adding all their members are cached on disk:
+
+    [reviewers]
+    cachettl = 86400    ; lifetime of the cached resolutions, in seconds
+                        ; (0 disables the cache)
+"""
+
+import functools
+import json
+import logging
+import os
+import time
+
+from libpycr.config import Config
+from libpycr.exceptions import NoSuchGroupError, PyCRError
+from libpycr.gerrit.client import Gerrit
+from libpycr.gerrit.query import Query, quote
+from libpycr.utils.parallel import imap
+from libpycr.utils.system import (
+    confirm, get_host_cache_path, write_atomically)
+
+
+# Default value for reviewers.cachettl
+DEFAULT_TTL = 86400
+
+# Maximum number of candidates listed for an ambiguous identifier
+MAX_CANDIDATES = 5
+
+# Logger
+log = logging.getLogger(__name__)
+
+
+class Reviewer(object):
+    """A resolved reviewer identifier"""
+
+    # Kinds of reviewers
+    ACCOUNT, GROUP = 'account', 'group'
+
+    def __init__(self, identifier, kind, reviewer_id, confirm_message=None,
+                 members=None):
+        """Constructor
+
+        :param identifier: the identifier, as given by the user
+        :type identifier: str
+        :param kind: Reviewer.ACCOUNT or Reviewer.GROUP
+        :type kind: str
+        :param reviewer_id: the ID to send to the server
+        :type reviewer_id: str
+        :param confirm_message: the message of the server asking for a
+            confirmation before adding the members of the group, if any
+        :type confirm_message: str | None
+        :param members: the account IDs of the members of the group, if known
+        :type members: tuple[str] | None
+        """
+
+        self.identifier = identifier
+        self.kind = kind
+        self.reviewer_id = reviewer_id
+        self.confirm_message = confirm_message
+        self.members = members
+
+        # The answer of the user to the confirmation message, if asked
+        self.confirmed = None
+
+    def __str__(self):
+        return self.identifier
+
+    def get_account_ids(self):
+        """Return the IDs of the accounts designated by this reviewer
+
+        :rtype: tuple[str]
+        """
+
+        if self.kind == Reviewer.ACCOUNT:
+            return (self.reviewer_id,)
+
+        assert self.members is not None, 'group members not expanded'
+        return self.members
+
+    def confirm(self, message):
+        """Ask the user, once, to confirm adding all members of the group
+
+        Suitable as the confirm_function of Gerrit.add_reviewer.
+
+        :param message: the message of the server
+        :type message: str
+        :rtype: bool
+        """
+
+        if self.confirmed is None:
+            self.confirm_message = message
+            self.confirmed = confirm(message)
+
+        return self.confirmed
+
+    def to_dict(self):
+        """Return a JSON-serializable representation of this reviewer
+
+        :rtype: dict
+        """
+
+        return {'kind': self.kind, 'id': self.reviewer_id,
+                'confirm': self.confirm_message, 'members': self.members}
+
+    @classmethod
+    def from_dict(cls, identifier, data):
+        """Create a reviewer from its JSON representation
+
+        :param identifier: the identifier, as given by the user
+        :type identifier: str
+        :param data: the representation returned by Reviewer.to_dict
+        :type data: dict
+        :rtype: Reviewer
+        """
+
+        members = data.get('members')
+
+        return cls(identifier, data['kind'], data['id'], data.get('confirm'),
+                   tuple(members) if members is not None else None)
+
+
+def get_cache_path():
+    """Return the path to the reviewer cache of the configured server
+
+    Returns None if the server is not configured.
+
+    :rtype: str | None
+    """
+
+    host = Config.get('gerrit.host')
+
+    if host is None:
+        return None
+
+    return get_host_cache_path('reviewers', host, '.json')
+
+
+class ReviewerCache(object):
+    """On-disk cache of reviewer resolutions"""
+
+    def __init__(self, path, ttl=DEFAULT_TTL):
+        """Constructor
+
+        :param path: the path to the cache file
+        :type path: str
+        :param ttl: the lifetime of the entries, in seconds
+        :type ttl: float
+        """
+
+        self.path = path
+        self.ttl = ttl
+        self.entries = {}
+
+        try:
+            with open(self.path) as cache_file:
+                self.entries = json.load(cache_file)
+
+        except (IOError, ValueError) as why:
+            log.debug('cannot read reviewer cache %s: %s', self.path, why)
+
+    @classmethod
+    def open_default(cls, config=Config):
+        """Open the cache of the configured server
+
+        Returns None if the cache is disabled or the server is not configured.
+
+        :param config: the configuration to read the settings from
+        :type config: Config
+        :rtype: ReviewerCache | None
+        """
+
+        ttl = config.get_float('reviewers.cachettl', DEFAULT_TTL)
+        path = get_cache_path()
+
+        if ttl <= 0 or path is None:
+            return None
+
+        return cls(path, ttl)
+
+    def get(self, identifier):
+        """Return the cached resolution of IDENTIFIER
+
+        Returns None if IDENTIFIER is not cached or its entry is expired.
+
+        :param identifier: the identifier, as given by the user
+        :type identifier: str
+        :rtype: Reviewer | None
+        """
+
+        entry = self.entries.get(identifier)
+
+        if entry is None or time.time() - entry['timestamp'] > self.ttl:
+            return None
+
+        return Reviewer.from_dict(identifier, entry)
+
+    def put(self, reviewer):
+        """Add or refresh the resolution of a reviewer
+
+        :param reviewer: the reviewer
+        :type reviewer: Reviewer
+        """
+
+        entry = reviewer.to_dict()
+        entry['timestamp'] = time.time()
+
+        self.entries[reviewer.identifier] = entry
+
+    def save(self):
+        """Write the cache to disk, dropping the expired entries"""
+
+        now = time.time()
+        entries = dict((key, entry) for key, entry in self.entries.items()
+                       if now - entry['timestamp'] <= self.ttl)
+
+        try:
+            # Commands may run concurrently
+            write_atomically(self.path, functools.partial(json.dump, entries))
+
+        except (IOError, OSError) as why:
+            log.debug('cannot write reviewer cache %s: %s', self.path, why)
+
+
+def select_account(identifier, candidates):
+    """Select the account designated by IDENTIFIER among CANDIDATES
+
+    Returns None if there is no candidate.
+
+    :param identifier: the identifier, as given by the user
+    :type identifier: str
+    :param candidates: the accounts matching IDENTIFIER
+    :type candidates: collections.iterable[AccountInfo]
+    :rtype: AccountInfo | None
+    :raise: PyCRError if IDENTIFIER designates several accounts
+    """
+
+    if len(candidates) <= 1:
+        return candidates[0] if candidates else None
+
+    # Search queries match prefixes: prefer an exact match
+    exact = [a for a in candidates if identifier.lower() in (
+        (a.username or '').lower(), (a.email or '').lower(),
+        (a.name or '').lower())]
+
+    if len(exact) == 1:
+        return exact[0]
+
+    names = [a.username or a.email or a.name
+             for a in (exact or candidates)[:MAX_CANDIDATES]]
+
+    raise PyCRError('ambiguous reviewer {}: matches {}{}'.format(
+        identifier, ', '.join(names),
+        ', ...' if len(exact or candidates) > MAX_CANDIDATES else ''))
+
+
+def resolve_reviewers(identifiers, cache=None):
+    """Resolve reviewer identifiers into account and group IDs
+
+    The identifiers that are not cached are resolved with an account query
+    each, sent concurrently. Identifiers that match no account are looked up
+    as group names.
+
+    :param identifiers: the identifiers, as given by the user
+    :type identifiers: list[str]
+    :param cache: the cache to read and update, if any
+    :type cache: ReviewerCache | None
+    :rtype: list[Reviewer]
+    :raise: PyCRError if an identifier matches no account nor group, or
+        several accounts
+    """
+
+    resolved, pending = {}, []
+
+    for identifier in identifiers:
+        if identifier in resolved or identifier in pending:
+            continue
+
+        reviewer = cache.get(identifier) if cache is not None else None
+
+        if reviewer is None:
+            pending.append(identifier)
+        else:
+            log.debug('reviewer %s resolved from cache', identifier)
+            resolved[identifier] = reviewer
+
+    try:
+        queries = [Query(quote(identifier)) for identifier in pending]
+    except ValueError as why:
+        raise PyCRError('invalid reviewer', why)
+
+    results = imap(Gerrit.query_accounts, queries, catch=PyCRError)
+    errors = []
+
+    for identifier, (candidates, error) in zip(pending, results):
+        if error is not None:
+            errors.append('{}: {}'.format(identifier, error))
+            continue
+
+        try:
+            account = select_account(identifier, candidates)
+
+            if account is not None:
+                reviewer = Reviewer(identifier, Reviewer.ACCOUNT,
+                                    str(account.account_id))
+            else:
+                group = Gerrit.get_group(identifier)
+                reviewer = Reviewer(identifier, Reviewer.GROUP,
+                                    group.name or identifier)
+
+        except NoSuchGroupError:
+            errors.append('unknown reviewer: {}'.format(identifier))
+            continue
+
+        except PyCRError as why:
+            errors.append(str(why))
+            continue
+
+        resolved[identifier] = reviewer
+
+        if cache is not None:
+            cache.put(reviewer)
+
+    # Report all invalid identifiers at once
+    if errors:
+        raise PyCRError(os.linesep.join(errors))
+
+    return [resolved[identifier] for identifier in identifiers]
+
+
+def expand_groups(reviewers, cache=None):
+    """Fetch the members of the groups of REVIEWERS, unless known
+
+    :param reviewers: the resolved reviewers
+    :type reviewers: list[Reviewer]
+    :param cache: the cache to update, if any
+    :type cache: ReviewerCache | None
+    :raise: PyCRError if the members of a group cannot be fetched
+    """
+
+    for reviewer in reviewers:
+        if reviewer.kind != Reviewer.GROUP or reviewer.members is not None:
+            continue
+
+        reviewer.members = tuple([
+            str(account.account_id)
+            for account in Gerrit.get_group_members(reviewer.reviewer_id)])
+
+        if cache is not None:
+            cache.put(reviewer)
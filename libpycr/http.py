@@ -1,17 +1,30 @@
 """This module encapsulate the logic for querying an HTTP server"""
 
 import base64
-import getpass
+import binascii
 import logging
 import json
+import os
 import requests
+import socket
+import threading
+import time
 
+from libpycr import decoder, tracing
 from libpycr.config import Config
-from libpycr.exceptions import RequestError
-from libpycr.utils.system import fail
-
+from libpycr.deadline import Deadline, get_timeouts
+from libpycr.exceptions import (
+    DeadlineExceededError, InvalidResponseError, NetworkError, RequestError)
+from libpycr.retry import RetryPolicy, TokenBucket
+from libpycr.transport import build_adapter
+from libpycr.utils.system import fail, get_local, read_password, set_local
+
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPDigestAuth
-from requests.exceptions import ConnectionError, RequestException
+from requests.exceptions import (
+    ConnectionError, ConnectTimeout, ReadTimeout, RequestException, Timeout)
+from requests.packages.urllib3.exceptions import (
+    ConnectTimeoutError, NewConnectionError)
 
 from urlparse import urlparse
 
@@ -29,14 +42,69 @@ BASE64, JSON, PLAIN = range(3)
 GERRIT_MAGIC = ")]}'\n"
 
 
+class SessionPool(object):
+    """HTTP sessions and client-side rate limiters"""
+
+    def __init__(self):
+        # The session objects, to enable connection reuse. A long-lived
+        # process (see libpycr.daemon) can talk to several servers or with
+        # several identities: keep one session per server and identity.
+        self.sessions = {}
+
+        # Serializes the creation of sessions (and the password prompt) when
+        # requests are sent from several threads
+        self.lock = threading.Lock()
+
+        # Client-side rate limiters, shared by all threads: one per server
+        self.rate_limiters = {}
+
+    def close(self):
+        """Close the connections of all sessions"""
+
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+
+            self.sessions.clear()
+
+
 class RequestFactory(object):
     """A Request factory"""
 
     # Logger
     log = logging.getLogger(__name__)
 
-    # The session object, to enable connection reuse
-    _session = None
+    # The sessions of the process. Threads may use their own pool instead
+    # (see RequestFactory.use_pool).
+    _pool = SessionPool()
+
+    # Adapters connecting to a server in the background, to be handed to the
+    # first session created for that server (see warm_up): (scheme, host) ->
+    # (thread, [adapter, connection timeout error])
+    _warm_ups = {}
+    _warm_ups_lock = threading.Lock()
+
+    @classmethod
+    def use_pool(cls, pool):
+        """Use POOL for the requests sent from the current thread
+
+        Returns the pool previously used by the thread, if any.
+
+        :param pool: the session pool, or None to use the pool of the process
+        :type pool: SessionPool | None
+        :rtype: SessionPool | None
+        """
+
+        return set_local('pool', pool)
+
+    @classmethod
+    def get_pool(cls):
+        """Return the session pool used by the current thread
+
+        :rtype: SessionPool
+        """
+
+        return get_local('pool') or cls._pool
 
     @classmethod
     def set_auth_token(cls, username, password=None):
@@ -97,7 +165,7 @@ class RequestFactory(object):
         password = Config.get('gerrit.password')
 
         if password is None:
-            password = getpass.getpass()
+            password = read_password()
 
         return HTTPDigestAuth(username, password)
 
@@ -131,6 +199,149 @@ class RequestFactory(object):
 
         return url
 
+    @staticmethod
+    def get_session_key():
+        """Return the key identifying the session for the current settings
+
+        :rtype: tuple
+        """
+
+        return (Config.get('gerrit.host'), Config.get('gerrit.unsecure', False),
+                Config.get('gerrit.username'), Config.get('gerrit.password'))
+
+    @staticmethod
+    def get_warm_up_key(url):
+        """Return the key of the warm-up of the connections to URL
+
+        :param url: the URL of the server
+        :type url: str
+        :rtype: tuple[str, str]
+        """
+
+        url = urlparse(url)
+        return url.scheme, url.netloc
+
+    @classmethod
+    def warm_up(cls, unsecure=False):
+        """Start connecting to the configured server in the background
+
+        DNS resolution and TCP (and TLS) connection run in a thread while the
+        command starts up. The connected adapter is handed to the session
+        created for that server (see get_session). Disabled with:
+
+            [http]
+            warmup = false
+
+        :param unsecure: whether the connection will use HTTP
+        :type unsecure: bool
+        """
+
+        host = Config.get('gerrit.host')
+
+        if host is None or not Config.get_bool('http.warmup', True):
+            return
+
+        # A long-lived process (see libpycr.daemon) has open connections
+        if any(key[0] == host for key in cls.get_pool().sessions):
+            return
+
+        url = '{}://{}/'.format('http' if unsecure else 'https', host)
+        key = cls.get_warm_up_key(url)
+
+        with cls._warm_ups_lock:
+            if key in cls._warm_ups:
+                return
+
+            holder = [build_adapter(), None]
+
+            thread = threading.Thread(target=cls._connect, args=(url, holder))
+            thread.daemon = True
+
+            cls._warm_ups[key] = thread, holder
+
+        thread.start()
+
+    @classmethod
+    def _connect(cls, url, holder):
+        """Open a connection to URL in the pool of the adapter of HOLDER
+
+        The adapter is dropped from HOLDER if the connection fails, and the
+        error is kept if the connection timed out.
+
+        :param url: the URL of the server
+        :type url: str
+        :param holder: a list holding the adapter and the timeout error
+        :type holder: list
+        """
+
+        adapter = holder[0]
+
+        # Only HTTP/1.1 pools can be filled ahead of time
+        if not isinstance(adapter, HTTPAdapter):
+            return
+
+        started = time.time()
+
+        try:
+            pool = adapter.get_connection(url)
+
+            # Verify the certificate as requests does for the first request
+            adapter.cert_verify(pool, url, os.environ.get(
+                'REQUESTS_CA_BUNDLE') or os.environ.get(
+                    'CURL_CA_BUNDLE') or True, None)
+
+            # pylint: disable=protected-access
+            conn = pool._get_conn()
+            conn.timeout = get_timeouts()[0]
+            conn.connect()
+            pool._put_conn(conn)
+
+        except Exception as why:  # pylint: disable=broad-except
+            cls.log.debug('Connection warm-up failed: %s', why)
+            holder[0] = None
+
+            # urllib3 reports the other socket errors as a subclass
+            if (isinstance(why, (ConnectTimeoutError, socket.timeout)) and
+                    not isinstance(why, NewConnectionError)):
+                holder[1] = why
+
+            return
+
+        cls.log.debug('Connection warm-up done in %.1fms',
+                      (time.time() - started) * 1000)
+
+    @classmethod
+    def take_warm_adapter(cls, url):
+        """Return the adapter connected to URL in the background, if any
+
+        Waits for the end of the warm-up, at most for the connection timeout.
+        Connecting again would wait as long if the warm-up timed out: the
+        error is raised instead.
+
+        :param url: the URL of the server
+        :type url: str
+        :rtype: requests.adapters.BaseAdapter | None
+        :raise: ConnectTimeout if the warm-up timed out
+        """
+
+        with cls._warm_ups_lock:
+            warm_up = cls._warm_ups.pop(cls.get_warm_up_key(url), None)
+
+        if warm_up is None:
+            return None
+
+        thread, holder = warm_up
+        thread.join(get_timeouts()[0])
+
+        if thread.is_alive():
+            raise ConnectTimeout('Connection to %s timed out' %
+                                 urlparse(url).netloc)
+
+        if holder[1] is not None:
+            raise ConnectTimeout(holder[1])
+
+        return holder[0]
+
     @classmethod
     def get_session(cls, **kwargs):
         """Return a requests.Session object
@@ -138,25 +349,177 @@ class RequestFactory(object):
         :rtype: requests.Session
         """
 
-        if cls._session is None:
-            cls._session = requests.Session()
+        key = cls.get_session_key()
+        pool = cls.get_pool()
+        session = pool.sessions.get(key)
+
+        if session is not None:
+            return session
+
+        # Replace the default adapters (10 connections, no socket tuning) with
+        # the configured transport backend, connected ahead of time if
+        # possible. Waiting for the warm-up must not block the threads that
+        # use the other sessions of the pool.
+        adapter = cls.take_warm_adapter(cls.get_remote_base_url())
+
+        with pool.lock:
+            session = pool.sessions.get(key)
+
+            if session is not None:
+                if adapter is not None:
+                    adapter.close()
+
+                return session
+
+            session = requests.Session()
+
+            adapter = adapter or build_adapter()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
 
             if cls.require_auth():
-                cls._session.auth = RequestFactory.get_http_digest_auth_token()
+                session.auth = RequestFactory.get_http_digest_auth_token()
 
             headers = kwargs['headers'] if 'headers' in kwargs else {}
-            cls._session.headers.update(headers)
+            session.headers.update(headers)
+
+            pool.sessions[key] = session
+
+            return session
 
-        return cls._session
+    @classmethod
+    def get_rate_limiter(cls):
+        """Return the rate limiter for the configured server, if any
+
+        :rtype: TokenBucket | None
+        """
+
+        host = Config.get('gerrit.host')
+        pool = cls.get_pool()
+
+        with pool.lock:
+            if host not in pool.rate_limiters:
+                pool.rate_limiters[host] = TokenBucket.from_config()
+
+            return pool.rate_limiters[host]
 
     @classmethod
-    def send(cls, endpoint, method=GET, encoding=JSON, **kwargs):
+    def request(cls, endpoint, method=GET, idempotent=None, **kwargs):
+        """Send a HTTP request, retrying on transient errors
+
+        Connection errors, timeouts and 502/503/504 responses are retried for
+        idempotent requests only; 429 responses are always retried. Returns
+        the last response received.
+
+        Requests are sent with the configured connection and read timeouts,
+        and retried only while the deadline of the current thread, if any,
+        allows it (see libpycr.deadline).
+
+        :param endpoint: the endpoint to the request
+        :type endpoint: str
+        :param method: HTTP protocol method to use
+        :type method: str
+        :param idempotent: whether the request can safely be sent more than
+            once (default: decided from the method, see RetryPolicy)
+        :type idempotent: bool | None
+        :param **kwargs: any additional arguments to the underlying API call
+        :type **kwargs: dict
+        :rtype: requests.Response
+        :raise: NetworkError if the server cannot be reached
+        :raise: DeadlineExceededError if the deadline has passed
+        :raise: RequestError on any other error
+        """
+
+        policy = RetryPolicy.from_config()
+        rate_limiter = cls.get_rate_limiter()
+        deadline = Deadline.current()
+        attempt = 0
+
+        while True:
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+
+            if deadline is not None:
+                deadline.check()
+
+            trace = tracing.current()
+            started = time.time()
+
+            try:
+                response = cls.get_session().request(
+                    method, endpoint, timeout=get_timeouts(), **kwargs)
+
+            except (ConnectionError, Timeout) as why:
+                if trace is not None:
+                    trace.add_attempt(None, time.time() - started)
+
+                if deadline is not None and deadline.expired():
+                    raise DeadlineExceededError(why)
+
+                if not policy.should_retry(attempt, method,
+                                           idempotent=idempotent):
+                    host = urlparse(endpoint).netloc
+
+                    if not isinstance(why, ReadTimeout):
+                        raise NetworkError('Unable to connect to %s' % host,
+                                           why)
+
+                    # The request was sent: the server may have processed it
+                    if policy.is_idempotent(method, idempotent):
+                        raise NetworkError('No response from %s' % host, why)
+
+                    raise NetworkError(
+                        'No response from %s (the request may have been '
+                        'applied)' % host, why)
+
+                response = None
+
+            except RequestException as why:
+                raise RequestError(
+                    None, None,
+                    'HTTP %s request failed: %s' % (method, endpoint), why)
+
+            else:
+                if trace is not None:
+                    trace.add_attempt(response, time.time() - started)
+
+                if not policy.should_retry(attempt, method,
+                                           response.status_code, idempotent):
+                    return response
+
+            delay = policy.get_delay(attempt, response)
+
+            if delay is None:
+                # The server requested a longer delay than we accept to wait
+                return response
+
+            if deadline is not None and not deadline.allows(delay):
+                # No time left for another attempt
+                if response is None:
+                    raise DeadlineExceededError()
+
+                return response
+
+            cls.log.debug('Attempt %d failed (%s), retrying in %.2fs',
+                          attempt + 1, 'no response' if response is None
+                          else response.status_code, delay)
+
+            time.sleep(delay)
+            attempt += 1
+
+    @classmethod
+    def send(cls, endpoint, method=GET, encoding=JSON, idempotent=None,
+             raw=False, **kwargs):
         """Return the result of a HTTP request
 
-        Returns a tuple of two elements: the raw response (stripped from magic
-        for the JSON format) and the decoded object of that response, or None
-        if encoding is PLAIN. If response is no content (status code
-        204), returns a tuple of None values.
+        Returns the decoded object of the response: the JSON object for the
+        JSON format, the decoded bytes for the base64 format, and the response
+        text for the plain format. If response is no content (status code
+        204), returns None.
+
+        If RAW is True, returns a tuple of two elements instead: the raw
+        response (stripped from magic for the JSON format) and the decoded
+        object of that response.
 
         :param endpoint: the endpoint to the request
         :type endpoint: str
@@ -164,10 +527,41 @@ class RequestFactory(object):
         :type method: str
         :param encoding: expected response format (JSON, base64 or plain text)
         :type encoding: str
+        :param idempotent: whether the request can safely be retried (default:
+            decided from the method, see RetryPolicy)
+        :type idempotent: bool | None
+        :param raw: whether to return the raw response as well
+        :type raw: bool
         :param **kwargs: any additional arguments to the underlying API call
         :type **kwargs: dict
-        :rtype: str, dict | None
-        :raise: requests.exceptions.RequestException on error
+        :rtype: object | (unicode, object)
+        :raise: NetworkError if the server cannot be reached
+        :raise: RequestError if the server returns an error
+        :raise: InvalidResponseError if the response cannot be decoded
+        """
+
+        trace = tracing.begin(method, endpoint)
+
+        if trace is None:
+            return cls._send(endpoint, method, encoding, idempotent, raw,
+                             **kwargs)
+
+        try:
+            result = cls._send(endpoint, method, encoding, idempotent, raw,
+                               **kwargs)
+
+        except Exception as why:
+            tracing.end(trace, why)
+            raise
+
+        tracing.end(trace)
+        return result
+
+    @classmethod
+    def _send(cls, endpoint, method, encoding, idempotent, raw, **kwargs):
+        """Implementation of send(), see send() for the details
+
+        :rtype: object | (unicode, object)
         """
 
         cls.log.debug('Query URL: %s', endpoint)
@@ -180,73 +574,87 @@ class RequestFactory(object):
                 cls.log.debug('JSON-encoded query payload')
                 cls.log.debug(json.dumps(data, indent=2))
 
-        try:
-            response = cls.get_session().request(method, endpoint, **kwargs)
+        response = cls.request(endpoint, method, idempotent, **kwargs)
 
-            if response.status_code == 204:
-                # No content
-                return None, None
+        if response.status_code == 204:
+            # No content
+            return (None, None) if raw else None
 
+        try:
             if response.status_code != 200:
                 response.raise_for_status()
 
-        except ConnectionError as why:
-            fail('Unable to connect to %s' % urlparse(endpoint).netloc)
-
         except RequestException as why:
             raise RequestError(
                 response.status_code, response,
                 'HTTP %s request failed: %s' % (method, endpoint), why)
 
-        if encoding == BASE64:
-            encoded = response.text
+        trace = tracing.current()
+        started = time.time()
+
+        # Work on the undecoded body: decoding it to unicode would copy it
+        content = response.content
+        offset = 0
 
-            cls.log.debug('%d bytes to decode', len(encoded))
+        if encoding == BASE64:
+            cls.log.debug('%d bytes to decode', len(content))
 
-            pad = -len(encoded) % 4
+            pad = -len(content) % 4
             if pad == 3:
-                b64response = encoded[:-1]
+                b64response = content[:-1]
             else:
-                b64response = encoded + b'=' * pad
+                b64response = content + b'=' * pad
 
             cls.log.debug('%d padded bytes to decode', len(b64response))
-            cls.log.debug(b64response)
 
             try:
                 decoded = base64.decodestring(b64response)
-            except TypeError:
+            except (TypeError, binascii.Error):
                 # TypeError: incorrect padding
                 cls.log.exception('cannot decode base64 stream')
-                fail('invalid response stream (could not decode base64)')
+                raise InvalidResponseError(
+                    'invalid response stream (could not decode base64)')
 
         elif encoding == JSON:
-            if not response.text.startswith(GERRIT_MAGIC):
-                fail('invalid response stream (magic prefix not found)')
+            if not content.startswith(GERRIT_MAGIC):
+                raise InvalidResponseError(
+                    'invalid response stream (magic prefix not found)')
+
+            offset = len(GERRIT_MAGIC)
 
-            json_response = response.text[len(GERRIT_MAGIC):]
-            decoded = json.loads(json_response)
-            if cls.log.isEnabledFor(logging.DEBUG):
-                cls.log.debug('JSON-encoded server reply')
-                cls.log.debug(json.dumps(decoded, indent=2))
+            try:
+                decoded = decoder.decode(content, offset)
+            except ValueError as why:
+                raise InvalidResponseError(
+                    'invalid response stream (could not decode JSON)', why)
 
         else:
-            decoded = None
+            decoded = response.text
+
+        if trace is not None:
+            trace.add('decode', time.time() - started)
+
+        if encoding == JSON and cls.log.isEnabledFor(logging.DEBUG):
+            cls.log.debug('JSON-encoded server reply')
+            cls.log.debug(json.dumps(decoded, indent=2))
+
+        if raw:
+            return response.text[offset:], decoded
 
-        return response.text, decoded
+        return decoded
 
     @classmethod
     def get(cls, endpoint, **kwargs):
         """Return the result of a HTTP GET request
 
-        Returns a tuple of two elements: the raw response (stripped from magic)
-        and the json object of that response.
+        Returns the decoded object of the response (see send()).
 
         :param endpoint: the endpoint to GET
         :type endpoint: str
         :param **kwargs: any additional arguments to the underlying GET call
         :type **kwargs: dict
-        :rtype: str, dict
-        :raise: requests.exceptions.RequestException on error
+        :rtype: object
+        :raise: PyCRError on error
         """
 
         return cls.send(endpoint, method=GET, **kwargs)
@@ -255,14 +663,14 @@ class RequestFactory(object):
     def post(cls, endpoint, **kwargs):
         """Return the result of a HTTP POST request
 
-        Returns a tuple of two elements: the raw response (stripped from magic)
-        and the json object of that response.
+        Returns the decoded object of the response (see send()).
 
         :param endpoint: the endpoint to POST
         :type endpoint: str
         :param **kwargs: any additional arguments to the underlying POST call
         :type **kwargs: dict
-        :raise: requests.exceptions.RequestException on error
+        :rtype: object
+        :raise: PyCRError on error
         """
 
         return cls.send(endpoint, method=POST, **kwargs)
@@ -275,7 +683,7 @@ class RequestFactory(object):
         :type endpoint: str
         :param **kwargs: any additional arguments to the underlying DELETE call
         :type **kwargs: dict
-        :raise: requests.exceptions.RequestException on error
+        :raise: PyCRError on error
         """
 
         cls.send(endpoint, method=DELETE, **kwargs)
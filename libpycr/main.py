@@ -1,11 +1,15 @@
 """Generic main function"""
 
+import errno
 import os
 import sys
 
+from libpycr import tracing
 from libpycr.commandline import parse_command_line
 from libpycr.config import Config
+from libpycr.deadline import Deadline
 from libpycr.exceptions import PyCRError
+from libpycr.http import RequestFactory
 from libpycr.utils.system import format_message
 
 
@@ -20,11 +24,16 @@ def builtin_main(builtin_type):
         # Load various input configurations
         Config.load_all()
 
+        # Connect to the server while the command starts up. The command line
+        # is parsed later: guess the scheme.
+        RequestFactory.warm_up(unsecure='--unsecure' in sys.argv[1:])
+
         # Fetch the result of the command-line parsing
         command, arguments = parse_command_line(builtin_type)
 
-        # Execute the requested command
-        command.run(arguments)
+        # Execute the requested command, within its time budget, if any
+        with Deadline.from_config():
+            command.run(arguments)
 
     except PyCRError as why:
         sys.exit(format_message(str(why), prefix='fatal'))
@@ -32,4 +41,19 @@ def builtin_main(builtin_type):
     except KeyboardInterrupt:
         sys.exit(os.linesep + 'Interruption caught...')
 
+    except IOError as why:
+        if why.errno != errno.EPIPE:
+            raise
+
+        # The output was piped to a command that exited (eg. head): discard
+        # the rest of the output, including the buffered part
+        if sys.stdout is sys.__stdout__:
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+        sys.exit(1)
+
+    finally:
+        # Flush the request traces and print the --profile summary
+        tracing.close_sinks()
+
     sys.exit()
@@ -44,6 +44,10 @@ class Builtin(object):
 class GitClBuiltin(Builtin):
     """git-cl builtin"""
 
+    # The ChangeInfo fields used by the command (see libpycr.gerrit.fields).
+    # Changes are fetched with the query options and endpoint of that mask.
+    fields = None
+
     @abstractmethod
     def run(self, arguments, *args, **kwargs):
         pass
@@ -1,10 +1,38 @@
-"""Provides convenient use of PAGER"""
+"""Provides convenient use of PAGER
 
+The pager is only spawned when needed: the output is not paged if the
+standard output is not a terminal, and is held back until it overflows the
+terminal. Output that fits on the screen is written directly, without paying
+for the process spawn.
+
+Once spawned, the output is written to the pager through a large buffer,
+flushed when full and periodically by a watcher thread (so that the first
+screen shows up while the command keeps working). The watcher also detects the
+exit of the pager: the commands can then stop fetching and rendering output
+the user will never see (see Pager.closed), and writes raise PagerClosedError,
+which ends the command silently.
+"""
+
+import errno
 import os
+import re
 import sys
+import threading
 from subprocess import Popen, PIPE
 
 from libpycr.config import Config
+from libpycr.exceptions import PagerClosedError
+from libpycr.utils.system import get_console, get_terminal_size
+
+
+# Size, in bytes, of the buffer of the output written to the pager
+BUFFER_SIZE = 64 * 1024
+
+# Delay, in seconds, between two flushes of the output by the watcher thread
+FLUSH_INTERVAL = 0.1
+
+# Terminal escape sequences (colors), which take no room on the screen
+ESCAPE_SEQUENCE = re.compile(r'\x1b\[[0-9;]*[A-Za-z]')
 
 
 def get_pager():
@@ -16,34 +44,262 @@ def get_pager():
     return os.environ.get('PAGER') or 'less'
 
 
+def spawn_pager(pager):
+    """Start the PAGER process and return it
+
+    The output to page is to be written to the process' standard input.
+
+    :param pager: the pager command
+    :type pager: str
+    :rtype: subprocess.Popen
+    """
+
+    env = os.environ.copy()
+    if 'LESS' not in env:
+        env['LESS'] = 'FRSX'
+    if 'LV' not in env:
+        env['LV'] = '-c'
+
+    return Popen([pager], stdin=PIPE, env=env)
+
+
+class PagerStream(object):
+    """Buffered file-like object writing to the standard input of a pager
+
+    The pager is spawned once the output overflows the terminal, and receives
+    the output held back until then. If the output fits on the screen, it is
+    written to the terminal when the stream is closed.
+    """
+
+    def __init__(self, pager, closed, terminal):
+        """Constructor
+
+        :param pager: the pager command
+        :type pager: str
+        :param closed: the event to set when the pager exits
+        :type closed: threading.Event
+        :param terminal: the stream to write to if the output fits on the
+            screen
+        :type terminal: file
+        """
+
+        self._pager = pager
+        self._proc = None
+        self._watcher = None
+        self._closed = closed
+        self._terminal = terminal
+        self._buffer = []
+        self._size = 0
+        self._lock = threading.Lock()
+
+        # Screen rows used by the output held back, and column of its end
+        self._height, self._width = get_terminal_size(terminal)
+        self._rows = 0
+        self._column = 0
+
+        # Used by the print statement
+        self.softspace = 0
+
+    def _spawn(self):
+        """Spawn the pager and hand it the output held back
+
+        The caller must hold the lock.
+        """
+
+        self._proc = spawn_pager(self._pager)
+
+        self._watcher = threading.Thread(target=self._watch)
+        self._watcher.daemon = True
+        self._watcher.start()
+
+        self._flush()
+
+    def _overflows(self, data):
+        """Account for DATA on the screen; whether the output overflows it
+
+        :param data: the data written
+        :type data: str
+        :rtype: bool
+        """
+
+        lines = ESCAPE_SEQUENCE.sub('', data).split('\n')
+
+        for line in lines[:-1]:
+            # Long lines wrap
+            wrapped = max(self._column + len(line) - 1, 0) // self._width
+            self._rows += 1 + wrapped
+            self._column = 0
+
+        self._column += len(lines[-1])
+
+        # Keep a row for the prompt
+        return self._rows >= self._height - 1
+
+    def _watch(self):
+        """Flush the output periodically until the pager exits"""
+
+        while not self._closed.wait(FLUSH_INTERVAL):
+            if self._proc.poll() is not None:
+                self._closed.set()
+                break
+
+            try:
+                self.flush()
+            except PagerClosedError:
+                break
+
+    def _flush(self):
+        """Write the buffer to the pager
+
+        The caller must hold the lock.
+
+        :raise: PagerClosedError if the pager has exited
+        """
+
+        if not self._buffer or self._proc is None:
+            return
+
+        data = ''.join(self._buffer)
+        self._buffer, self._size = [], 0
+
+        try:
+            self._proc.stdin.write(data)
+        except IOError as why:
+            if why.errno not in (errno.EPIPE, errno.EINVAL):
+                raise
+
+            self._closed.set()
+            raise PagerClosedError()
+
+    def write(self, data):
+        """Write DATA to the pager
+
+        :param data: the data to write
+        :type data: str
+        :raise: PagerClosedError if the pager has exited
+        """
+
+        if self._closed.is_set():
+            raise PagerClosedError()
+
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+
+        with self._lock:
+            self._buffer.append(data)
+            self._size += len(data)
+
+            if self._proc is None:
+                if self._overflows(data):
+                    self._spawn()
+
+            elif self._size >= BUFFER_SIZE:
+                self._flush()
+
+    def writelines(self, lines):
+        """Write LINES to the pager
+
+        :param lines: the lines to write
+        :type lines: collections.iterable[str]
+        :raise: PagerClosedError if the pager has exited
+        """
+
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        """Write the buffered output to the pager
+
+        :raise: PagerClosedError if the pager has exited
+        """
+
+        with self._lock:
+            self._flush()
+
+    def isatty(self):
+        """Whether this stream is a terminal
+
+        :rtype: bool
+        """
+
+        return False
+
+    def close(self):
+        """Flush the output and wait for the user to quit the pager"""
+
+        if self._proc is None:
+            # The output fits on the screen
+            self._terminal.write(''.join(self._buffer))
+            self._terminal.flush()
+            self._buffer, self._size = [], 0
+            return
+
+        try:
+            self.flush()
+        except PagerClosedError:
+            pass
+
+        try:
+            self._proc.stdin.close()
+        except IOError:
+            pass
+
+        self._proc.wait()
+        self._closed.set()
+        self._watcher.join()
+
+
 # pylint: disable=R0903
 # Disable "Too few public methods" (for all above classes)
 class Pager(object):
     """Pager abstraction
 
     Writes on the standard output stream if no pager is found.
+
+    Commands that fetch or render their output incrementally should stop
+    as soon as Pager.closed is set (see libpycr.utils.parallel.imap).
     """
 
     def __init__(self, command):
-        self._pager_proc = None
+        self._stream = None
+        self._stdout = None
+        self._console = None
         self.command = command
 
+        # Set when the user quits the pager
+        self.closed = threading.Event()
+
     def __enter__(self):
         pager = Config.get('core.pager', get_pager())
         pager = Config.get('pager.%s' % self.command, pager)
 
-        if pager:
-            env = os.environ.copy()
-            if 'LESS' not in env:
-                env['LESS'] = 'FRSX'
-            if 'LV' not in env:
-                env['LV'] = '-c'
-            self._pager_proc = Popen([pager], stdin=PIPE, env=env)
-            sys.stdout = self._pager_proc.stdin
+        if not pager:
+            return self
+
+        # Let the remote end page the output if the command is run on behalf
+        # of a client (see libpycr.daemon)
+        self._console = get_console()
+
+        if self._console is not None:
+            self._console.start_pager(pager)
+
+        # Do not page output redirected to a file or to another command
+        elif sys.stdout.isatty():
+            self._stdout = sys.stdout
+            self._stream = PagerStream(pager, self.closed, self._stdout)
+            sys.stdout = self._stream
+
+        return self
 
     def __exit__(self, typ, value, traceback):
-        if self._pager_proc:
-            sys.stdout = sys.__stdout__
-            self._pager_proc.stdin.close()
-            self._pager_proc.wait()
-            self._pager_proc = None
+        if self._console:
+            self._console.stop_pager()
+            self._console = None
+
+        if self._stream:
+            sys.stdout = self._stdout
+            self._stream.close()
+            self._stream = None
+
+        # The user quit the pager: not an error
+        return typ is not None and issubclass(typ, PagerClosedError)
@@ -0,0 +1,223 @@
+"""Retry policy and client-side rate limiting for HTTP requests
+
+Configuration ([http] section):
+
+    retries = 3          ; maximum number of retries per request
+    backoff = 0.5        ; base delay, in seconds, of the exponential backoff
+    maxbackoff = 30      ; maximum delay, in seconds, between two attempts
+    retrypost = false    ; retry all POST requests, not only idempotent ones
+    ratelimit = 0        ; maximum requests per second (0: unlimited)
+    burst = 10           ; number of requests allowed in a burst
+"""
+
+import calendar
+import email.utils
+import random
+import threading
+import time
+
+from libpycr.config import Config
+
+
+# Default values for the [http] configuration section
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+DEFAULT_MAX_BACKOFF = 30.0
+DEFAULT_BURST = 10
+
+# Status codes for which the server did not process the request: retrying is
+# safe whatever the method
+RETRY_ALWAYS_STATUSES = (429,)
+
+# Status codes for which the request may or may not have been processed:
+# only retry idempotent requests
+RETRY_IDEMPOTENT_STATUSES = (502, 503, 504)
+
+# Idempotent HTTP methods
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'DELETE', 'PUT', 'OPTIONS')
+
+
+def parse_retry_after(value):
+    """Return the delay, in seconds, requested by a Retry-After header
+
+    Returns None if the header value is invalid.
+
+    :param value: the value of the header (delay in seconds or HTTP date)
+    :type value: str | None
+    :rtype: float | None
+    """
+
+    if not value:
+        return None
+
+    value = value.strip()
+
+    if value.isdigit():
+        return float(value)
+
+    date = email.utils.parsedate(value)
+
+    if date is None:
+        return None
+
+    return max(0.0, calendar.timegm(date) - time.time())
+
+
+class RetryPolicy(object):
+    """Decide whether and when to retry a failed request"""
+
+    def __init__(self, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                 max_backoff=DEFAULT_MAX_BACKOFF, retry_post=False):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_post = retry_post
+
+    @classmethod
+    def from_config(cls, config=Config):
+        """Create the policy from the configuration
+
+        :param config: the configuration to read the settings from
+        :type config: Config
+        :rtype: RetryPolicy
+        """
+
+        return cls(retries=config.get_int('http.retries', DEFAULT_RETRIES),
+                   backoff=config.get_float('http.backoff', DEFAULT_BACKOFF),
+                   max_backoff=config.get_float(
+                       'http.maxbackoff', DEFAULT_MAX_BACKOFF),
+                   retry_post=config.get_bool('http.retrypost', False))
+
+    def is_idempotent(self, method, idempotent=None):
+        """Whether a request can safely be sent more than once
+
+        :param method: the HTTP method
+        :type method: str
+        :param idempotent: the caller's opinion, if any (eg. a POST request
+            that has no side effect when repeated)
+        :type idempotent: bool | None
+        :rtype: bool
+        """
+
+        if idempotent is not None:
+            return idempotent
+
+        return method in IDEMPOTENT_METHODS or (
+            method == 'POST' and self.retry_post)
+
+    def should_retry(self, attempt, method, status_code=None,
+                     idempotent=None):
+        """Whether to retry after a failed attempt
+
+        STATUS_CODE is None if no response was received (connection error or
+        timeout).
+
+        :param attempt: the number of the failed attempt (0 for the first)
+        :type attempt: int
+        :param method: the HTTP method
+        :type method: str
+        :param status_code: the status code of the response, if any
+        :type status_code: int | None
+        :param idempotent: whether the request is idempotent (default: decided
+            from the method)
+        :type idempotent: bool | None
+        :rtype: bool
+        """
+
+        if attempt >= self.retries:
+            return False
+
+        if status_code in RETRY_ALWAYS_STATUSES:
+            return True
+
+        if status_code is None or status_code in RETRY_IDEMPOTENT_STATUSES:
+            return self.is_idempotent(method, idempotent)
+
+        return False
+
+    def get_delay(self, attempt, response=None):
+        """Return the delay, in seconds, before the next attempt
+
+        Honors the Retry-After header of the response if any. Otherwise,
+        computes an exponential backoff with full jitter. Returns None if the
+        server requested a delay longer than max_backoff.
+
+        :param attempt: the number of the failed attempt (0 for the first)
+        :type attempt: int
+        :param response: the response of the failed attempt, if any
+        :type response: requests.Response | None
+        :rtype: float | None
+        """
+
+        if response is not None:
+            delay = parse_retry_after(response.headers.get('Retry-After'))
+
+            if delay is not None:
+                return delay if delay <= self.max_backoff else None
+
+        return random.uniform(
+            0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket rate limiter"""
+
+    def __init__(self, rate, burst=DEFAULT_BURST):
+        """Constructor
+
+        :param rate: the number of tokens added per second
+        :type rate: float
+        :param burst: the capacity of the bucket
+        :type burst: int
+        """
+
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+
+        self._tokens = float(self.burst)
+        self._timestamp = time.time()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config=Config):
+        """Create the rate limiter from the configuration
+
+        Returns None if rate limiting is disabled.
+
+        :param config: the configuration to read the settings from
+        :type config: Config
+        :rtype: TokenBucket | None
+        """
+
+        rate = config.get_float('http.ratelimit', 0)
+
+        if rate <= 0:
+            return None
+
+        return cls(rate, config.get_int('http.burst', DEFAULT_BURST))
+
+    def _reserve(self):
+        """Take a token and return the time to wait before it is available
+
+        :rtype: float
+        """
+
+        with self._lock:
+            now = time.time()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._timestamp) * self.rate)
+            self._timestamp = now
+            self._tokens -= 1
+
+            if self._tokens >= 0:
+                return 0
+
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        """Block until a request is allowed"""
+
+        delay = self._reserve()
+
+        if delay > 0:
+            time.sleep(delay)
@@ -0,0 +1,517 @@
+"""Request-level tracing of the calls to the Gerrit Code Review server
+
+Each call to RequestFactory.send is recorded as a Trace: HTTP method, endpoint
+template (eg. /changes/{change-id}/detail), the Gerrit method that issued the
+request, status code, response size, and the time spent in each phase of the
+request (DNS resolution, TCP connection, TLS handshake, time to first byte,
+download and decoding).
+
+Traces are dispatched to sinks. A sink is any object providing the record
+(called with each Trace) and close (called at the end of the command)
+methods. Tracing is disabled, and costs nothing, as long as no sink is
+registered.
+
+Two sinks are provided:
+
+    HistogramSink  in-memory latency histograms, optionally printed as a
+                   summary table when closed (--profile)
+    JsonLinesSink  one JSON object per request, appended to a file (--trace or
+                   the trace.file configuration key)
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from urlparse import urlparse
+
+from libpycr.utils.output import Table
+
+
+# Registered sinks
+_sinks = []
+
+# The trace of the request being sent, per thread
+_local = threading.local()
+
+# Logger
+log = logging.getLogger(__name__)
+
+# REST API collections: the path segment that follows a collection name is an
+# identifier, replaced with the associated placeholder in endpoint templates
+COLLECTIONS = {
+    'accounts': '{account-id}',
+    'branches': '{branch-id}',
+    'changes': '{change-id}',
+    'comments': '{comment-id}',
+    'drafts': '{draft-id}',
+    'emails': '{email-id}',
+    'files': '{file-id}',
+    'groups': '{group-id}',
+    'members': '{account-id}',
+    'projects': '{project-name}',
+    'reviewers': '{account-id}',
+    'revisions': '{revision-id}',
+    'sshkeys': '{ssh-key-id}',
+}
+
+# Root collections of the REST API
+ROOTS = ('access', 'accounts', 'changes', 'config', 'groups', 'plugins',
+         'projects')
+
+# Modules whose functions are reported as the origin of a request
+CALLER_MODULES = ('libpycr.gerrit.client',)
+
+
+def get_endpoint_template(url):
+    """Return the endpoint template of URL
+
+    Identifiers are replaced with placeholders, and the server base URL and
+    the query string are dropped:
+
+        https://host/a/changes/I8473b9/revisions/current/patch?zip
+        -> /changes/{change-id}/revisions/{revision-id}/patch
+
+    :param url: the request URL
+    :type url: str
+    :rtype: str
+    """
+
+    segments = urlparse(url).path.split('/')
+
+    # Drop the server base path and the authentication prefix (/a/)
+    for index, segment in enumerate(segments):
+        if segment in ROOTS:
+            segments = segments[index:]
+            break
+
+    for index in range(1, len(segments)):
+        if segments[index] and segments[index - 1] in COLLECTIONS:
+            segments[index] = COLLECTIONS[segments[index - 1]]
+
+    return '/' + '/'.join(segments)
+
+
+def get_caller():
+    """Return the name of the API method that is sending the current request
+
+    Returns None if the request does not originate from one of the
+    CALLER_MODULES.
+
+    :rtype: str | None
+    """
+
+    frame = sys._getframe(1)
+
+    while frame is not None:
+        if frame.f_globals.get('__name__') in CALLER_MODULES:
+            owner = frame.f_locals.get('cls')
+
+            if owner is None and 'self' in frame.f_locals:
+                owner = type(frame.f_locals['self'])
+
+            if owner is None:
+                return frame.f_code.co_name
+
+            return '{}.{}'.format(owner.__name__, frame.f_code.co_name)
+
+        frame = frame.f_back
+
+    return None
+
+
+class Trace(object):
+    """Record of a single call to the Gerrit Code Review server"""
+
+    # Phases of a request, in order
+    PHASES = ('dns', 'connect', 'tls', 'ttfb', 'download', 'decode')
+
+    # Phases that only occur when a new connection is established
+    SETUP_PHASES = ('dns', 'connect', 'tls')
+
+    def __init__(self, method, url, caller=None):
+        """Constructor
+
+        :param method: the HTTP method
+        :type method: str
+        :param url: the request URL
+        :type url: str
+        :param caller: the name of the API method sending the request
+        :type caller: str | None
+        """
+
+        self.method = method
+        self.url = url
+        self.endpoint = get_endpoint_template(url)
+        self.caller = caller
+
+        self.status = None
+        self.bytes = 0
+        self.attempts = 0
+        self.error = None
+
+        self.timestamp = time.time()
+        self.duration = None
+        self.timings = dict.fromkeys(self.PHASES, 0.0)
+
+        # Connection setup time of the current attempt
+        self._setup = 0.0
+
+    def add(self, phase, seconds):
+        """Add SECONDS to the time spent in PHASE
+
+        :param phase: one of Trace.PHASES
+        :type phase: str
+        :param seconds: the duration to add
+        :type seconds: float
+        """
+
+        self.timings[phase] += seconds
+
+        if phase in self.SETUP_PHASES:
+            self._setup += seconds
+
+    def add_attempt(self, response, duration):
+        """Record one attempt at sending the request
+
+        :param response: the response received, if any
+        :type response: requests.Response | None
+        :param duration: the total duration of the attempt, in seconds
+        :type duration: float
+        """
+
+        self.attempts += 1
+
+        if response is not None:
+            elapsed = response.elapsed.total_seconds()
+
+            self.status = response.status_code
+            self.bytes += len(response.content)
+
+            # Response.elapsed stops when the headers are parsed: it includes
+            # the connection setup but not the download of the body
+            self.add('ttfb', max(0.0, elapsed - self._setup))
+            self.add('download', max(0.0, duration - elapsed))
+
+        self._setup = 0.0
+
+    def to_dict(self):
+        """Return a JSON-serializable representation of this trace
+
+        :rtype: dict
+        """
+
+        return {
+            'timestamp': self.timestamp,
+            'method': self.method,
+            'url': self.url,
+            'endpoint': self.endpoint,
+            'caller': self.caller,
+            'status': self.status,
+            'bytes': self.bytes,
+            'attempts': self.attempts,
+            'error': self.error,
+            'duration': self.duration,
+            'timings': self.timings,
+        }
+
+
+def add_sink(sink):
+    """Register a new sink
+
+    :param sink: the sink
+    :type sink: object
+    """
+
+    _sinks.append(sink)
+
+
+def remove_sink(sink):
+    """Unregister SINK
+
+    :param sink: the sink
+    :type sink: object
+    """
+
+    _sinks.remove(sink)
+
+
+def get_sinks():
+    """Return the registered sinks
+
+    :rtype: tuple[object]
+    """
+
+    return tuple(_sinks)
+
+
+def close_sinks():
+    """Close and unregister all sinks"""
+
+    while _sinks:
+        sink = _sinks.pop(0)
+
+        try:
+            sink.close()
+        except Exception:  # pylint: disable=W0703
+            log.exception('cannot close sink %r', sink)
+
+
+def begin(method, url):
+    """Start tracing a request sent from the current thread
+
+    Returns None if tracing is disabled.
+
+    :param method: the HTTP method
+    :type method: str
+    :param url: the request URL
+    :type url: str
+    :rtype: Trace | None
+    """
+
+    if not _sinks:
+        return None
+
+    trace = Trace(method, url, get_caller())
+    _local.trace = trace
+
+    return trace
+
+
+def current():
+    """Return the trace of the request being sent from the current thread
+
+    :rtype: Trace | None
+    """
+
+    return getattr(_local, 'trace', None)
+
+
+def end(trace, error=None):
+    """Stop tracing TRACE and dispatch it to all sinks
+
+    :param trace: the trace, as returned by begin()
+    :type trace: Trace
+    :param error: the error that interrupted the request, if any
+    :type error: Exception | None
+    """
+
+    _local.trace = None
+
+    trace.duration = time.time() - trace.timestamp
+
+    if error is not None:
+        trace.error = type(error).__name__
+
+    for sink in tuple(_sinks):
+        try:
+            sink.record(trace)
+        except Exception:  # pylint: disable=W0703
+            log.exception('cannot record trace in sink %r', sink)
+
+
+class Histogram(object):
+    """HDR-style latency histogram
+
+    Values are recorded in microseconds with a relative precision better than
+    1%: each power of two is divided into 128 linear sub-buckets. Memory usage
+    is bounded by the range of the values, not by their count.
+    """
+
+    # Number of significant bits kept per value
+    PRECISION = 8
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+        # (shift, mantissa) -> number of values
+        self._buckets = {}
+
+    def record(self, seconds):
+        """Record a duration
+
+        :param seconds: the duration
+        :type seconds: float
+        """
+
+        value = max(0, int(seconds * 1e6))
+        shift = max(0, value.bit_length() - self.PRECISION)
+        bucket = (shift, value >> shift)
+
+        self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percent):
+        """Return the value at PERCENT, in seconds
+
+        :param percent: the percentile (between 0 and 100)
+        :type percent: float
+        :rtype: float
+        """
+
+        if not self.count:
+            return 0.0
+
+        rank = max(1, int(round(self.count * percent / 100.0)))
+        seen = 0
+
+        for shift, mantissa in sorted(self._buckets,
+                                      key=lambda b: b[1] << b[0]):
+            seen += self._buckets[(shift, mantissa)]
+
+            if seen >= rank:
+                # Highest value of the bucket, capped to the recorded maximum
+                value = ((mantissa + 1) << shift) - 1
+                return min(value, self.max) / 1e6
+
+        return self.max / 1e6
+
+    def mean(self):
+        """Return the mean value, in seconds
+
+        :rtype: float
+        """
+
+        return self.total / 1e6 / self.count if self.count else 0.0
+
+
+class HistogramSink(object):
+    """Aggregate traces into in-memory latency histograms
+
+    Traces are grouped per API method (or per endpoint template for requests
+    that do not originate from an API method) and HTTP method.
+    """
+
+    # Columns of the summary table
+    COLUMNS = ('Call', 'Method', 'Count', 'Errors', 'KiB', 'p50 ms', 'p90 ms',
+               'p99 ms', 'max ms', 'setup ms', 'ttfb ms', 'decode ms')
+
+    def __init__(self, report=None):
+        """Constructor
+
+        :param report: the stream to print the summary table to when closing
+            this sink, if any
+        :type report: file | None
+        """
+
+        self.report = report
+        self.stats = {}
+
+        self._lock = threading.Lock()
+
+    def record(self, trace):
+        """Add TRACE to the histograms
+
+        :param trace: the trace to record
+        :type trace: Trace
+        """
+
+        key = (trace.caller or trace.endpoint, trace.method)
+
+        with self._lock:
+            stats = self.stats.get(key)
+
+            if stats is None:
+                stats = self.stats[key] = {
+                    'endpoints': set(),
+                    'errors': 0,
+                    'bytes': 0,
+                    'total': Histogram(),
+                    'timings': dict((p, Histogram()) for p in Trace.PHASES),
+                }
+
+            stats['endpoints'].add(trace.endpoint)
+            stats['bytes'] += trace.bytes
+            stats['total'].record(trace.duration)
+
+            if trace.error is not None or (trace.status or 0) >= 400:
+                stats['errors'] += 1
+
+            for phase, seconds in trace.timings.iteritems():
+                stats['timings'][phase].record(seconds)
+
+    def get_summary(self):
+        """Return the rows of the summary table, slowest calls first
+
+        :rtype: list[list]
+        """
+
+        def msec(seconds):
+            """Format a duration in milliseconds"""
+            return '{:.1f}'.format(seconds * 1000)
+
+        rows = []
+
+        with self._lock:
+            items = sorted(self.stats.iteritems(),
+                           key=lambda i: i[1]['total'].total, reverse=True)
+
+            for (call, method), stats in items:
+                total, timings = stats['total'], stats['timings']
+                setup = sum(timings[p].mean() for p in Trace.SETUP_PHASES)
+
+                rows.append([
+                    call, method, total.count, stats['errors'],
+                    '{:.1f}'.format(stats['bytes'] / 1024.0),
+                    msec(total.percentile(50)), msec(total.percentile(90)),
+                    msec(total.percentile(99)), msec(total.max / 1e6),
+                    msec(setup), msec(timings['ttfb'].mean()),
+                    msec(timings['decode'].mean())])
+
+        return rows
+
+    def close(self):
+        """Print the summary table if requested"""
+
+        if self.report is None or not self.stats:
+            return
+
+        table = Table(self.COLUMNS, align=dict(
+            (column, Table.LEFT if column == 'Call' else Table.RIGHT)
+            for column in self.COLUMNS))
+        table.write(self.get_summary(), self.report)
+        self.report.flush()
+
+
+class JsonLinesSink(object):
+    """Append traces to a file, one JSON object per line"""
+
+    def __init__(self, path):
+        """Constructor
+
+        :param path: the path to the trace file
+        :type path: str
+        """
+
+        self.path = os.path.expanduser(path)
+        self.stream = open(self.path, 'a')
+
+        self._lock = threading.Lock()
+
+    def record(self, trace):
+        """Append TRACE to the file
+
+        :param trace: the trace to record
+        :type trace: Trace
+        """
+
+        line = json.dumps(trace.to_dict(), sort_keys=True)
+
+        with self._lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+    def close(self):
+        """Close the trace file"""
+
+        self.stream.close()
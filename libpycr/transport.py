@@ -0,0 +1,271 @@
+"""HTTP transport backends used by the request factory
+
+A transport backend is a factory that builds the requests adapter mounted on
+the HTTP session. The default backend is a tuned HTTP/1.1 connection pool; an
+optional HTTP/2 backend is available when the hyper package is installed.
+
+The backend and its settings are read from the [http] section of the
+configuration files:
+
+    [http]
+    backend = http1            ; http1 (default) or http2
+    poolconnections = 10       ; number of per-host pools to cache
+    poolsize = 16              ; maximum number of connections per host
+    poolblock = false          ; block instead of opening extra connections
+    keepalive = true           ; enable TCP keep-alive probes
+    keepaliveidle = 60         ; idle seconds before the first probe
+    keepaliveinterval = 10     ; seconds between two probes
+    nodelay = true             ; disable Nagle's algorithm (TCP_NODELAY)
+"""
+
+import logging
+import socket
+import time
+
+from libpycr import tracing
+from libpycr.config import Config
+from libpycr.utils.system import fail
+
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connection import (
+    HTTPConnection, HTTPSConnection)
+from requests.packages.urllib3.connectionpool import (
+    HTTPConnectionPool, HTTPSConnectionPool)
+
+
+# Default values for the [http] configuration section
+DEFAULT_BACKEND = 'http1'
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_SIZE = 16
+
+# Registered backends: name -> factory
+_BACKENDS = {}
+
+# Logger
+log = logging.getLogger(__name__)
+
+
+def register_backend(name, factory):
+    """Register a new transport backend
+
+    The factory is called with the configuration object (any object providing
+    the get, get_int and get_bool methods of libpycr.config.Config) and must
+    return a requests.adapters.BaseAdapter instance.
+
+    :param name: the name of the backend (value of http.backend)
+    :type name: str
+    :param factory: the adapter factory
+    :type factory: callable
+    """
+
+    _BACKENDS[name] = factory
+
+
+def get_backends():
+    """Return the names of all registered backends
+
+    :rtype: tuple[str]
+    """
+
+    return tuple(sorted(_BACKENDS))
+
+
+def get_socket_options(config=Config):
+    """Return the socket options to apply to new connections
+
+    :param config: the configuration to read the settings from
+    :type config: Config
+    :rtype: list[tuple[int, int, int]]
+    """
+
+    options = []
+
+    if config.get_bool('http.nodelay', True):
+        options.append((socket.IPPROTO_TCP, socket.TCP_NODELAY, 1))
+
+    if config.get_bool('http.keepalive', True):
+        options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+
+        # TCP_KEEPIDLE and TCP_KEEPINTVL are not available on all platforms
+        idle = config.get_int('http.keepaliveidle')
+        if idle is not None and hasattr(socket, 'TCP_KEEPIDLE'):
+            options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle))
+
+        interval = config.get_int('http.keepaliveinterval')
+        if interval is not None and hasattr(socket, 'TCP_KEEPINTVL'):
+            options.append(
+                (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval))
+
+    return options
+
+
+class TracedConnectionMixin(object):
+    """Record the DNS resolution and TCP connection times of new connections
+
+    Timings are added to the trace of the request being sent (see
+    libpycr.tracing), if any.
+    """
+
+    def _new_conn(self):
+        trace = tracing.current()
+        host = getattr(self, '_dns_host', None)
+
+        if trace is None or host is None:
+            return super(TracedConnectionMixin, self)._new_conn()
+
+        started = time.time()
+
+        try:
+            addresses = socket.getaddrinfo(host, self.port, 0,
+                                           socket.SOCK_STREAM)
+        except socket.error:
+            # Let urllib3 report the error
+            addresses = None
+
+        resolved = time.time()
+        trace.add('dns', resolved - started)
+
+        try:
+            if addresses:
+                # Connect to the resolved address so that the connection time
+                # does not include a second lookup
+                self._dns_host = addresses[0][4][0]
+
+            try:
+                conn = super(TracedConnectionMixin, self)._new_conn()
+
+            except Exception:
+                if not addresses or len(addresses) == 1:
+                    raise
+
+                # Fall back to the default behavior, which tries all addresses
+                self._dns_host = host
+                conn = super(TracedConnectionMixin, self)._new_conn()
+
+        finally:
+            self._dns_host = host
+
+        trace.add('connect', time.time() - resolved)
+        return conn
+
+
+class TracedHTTPConnection(TracedConnectionMixin, HTTPConnection):
+    """HTTP connection reporting its setup time"""
+    pass
+
+
+class TracedHTTPSConnection(TracedConnectionMixin, HTTPSConnection):
+    """HTTPS connection reporting its setup time, including TLS handshake"""
+
+    def connect(self):
+        trace = tracing.current()
+
+        if trace is None:
+            return super(TracedHTTPSConnection, self).connect()
+
+        started = time.time()
+        before = trace.timings['dns'] + trace.timings['connect']
+
+        super(TracedHTTPSConnection, self).connect()
+
+        after = trace.timings['dns'] + trace.timings['connect']
+        trace.add('tls', max(0.0, time.time() - started - (after - before)))
+
+
+class TracedHTTPConnectionPool(HTTPConnectionPool):
+    """HTTP connection pool creating TracedHTTPConnection objects"""
+
+    ConnectionCls = TracedHTTPConnection
+
+
+class TracedHTTPSConnectionPool(HTTPSConnectionPool):
+    """HTTPS connection pool creating TracedHTTPSConnection objects"""
+
+    ConnectionCls = TracedHTTPSConnection
+
+
+class TunedHTTPAdapter(HTTPAdapter):
+    """HTTP/1.1 adapter with configurable pool size and socket options
+
+    Connections report their setup time to the request tracer.
+    """
+
+    __attrs__ = HTTPAdapter.__attrs__ + ['socket_options']
+
+    def __init__(self, socket_options=None, **kwargs):
+        # Must be set before calling the parent constructor, which creates the
+        # pool manager
+        self.socket_options = socket_options
+        super(TunedHTTPAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False,
+                         **pool_kwargs):
+        if self.socket_options is not None:
+            pool_kwargs['socket_options'] = self.socket_options
+
+        super(TunedHTTPAdapter, self).init_poolmanager(
+            connections, maxsize, block=block, **pool_kwargs)
+
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TracedHTTPConnectionPool,
+            'https': TracedHTTPSConnectionPool,
+        }
+
+
+def http1_backend(config):
+    """Build the default HTTP/1.1 adapter
+
+    :param config: the configuration to read the settings from
+    :type config: Config
+    :rtype: TunedHTTPAdapter
+    """
+
+    return TunedHTTPAdapter(
+        socket_options=get_socket_options(config),
+        pool_connections=config.get_int(
+            'http.poolconnections', DEFAULT_POOL_CONNECTIONS),
+        pool_maxsize=config.get_int('http.poolsize', DEFAULT_POOL_SIZE),
+        pool_block=config.get_bool('http.poolblock', False))
+
+
+def http2_backend(config):
+    """Build an HTTP/2 adapter
+
+    HTTP/2 multiplexes all requests over a single connection per host: pool
+    settings do not apply. Requires the hyper package.
+
+    :param config: the configuration to read the settings from
+    :type config: Config
+    :rtype: hyper.contrib.HTTP20Adapter
+    """
+
+    del config
+
+    try:
+        from hyper.contrib import HTTP20Adapter
+    except ImportError:
+        fail('http.backend = http2 requires the hyper package')
+
+    return HTTP20Adapter()
+
+
+def build_adapter(config=Config):
+    """Build the adapter of the backend selected by http.backend
+
+    :param config: the configuration to read the settings from
+    :type config: Config
+    :rtype: requests.adapters.BaseAdapter
+    """
+
+    name = config.get('http.backend', DEFAULT_BACKEND)
+
+    if name not in _BACKENDS:
+        fail('unknown http.backend: {} (expected one of: {})'.format(
+            name, ', '.join(get_backends())))
+
+    log.debug('Using %s transport backend', name)
+    return _BACKENDS[name](config)
+
+
+register_backend('http1', http1_backend)
+register_backend('http2', http2_backend)
@@ -1,7 +1,9 @@
 """This module contains the input / output formatting routines"""
 
+import itertools
 import os
 import re
+import sys
 import pygments
 
 from libpycr.config import Config
@@ -154,3 +156,157 @@ class Formatter(object):
 
         for token in pygments.lex(diff, DiffLexer(encoding='utf-8')):
             yield token
+
+
+def to_unicode(value):
+    """Return VALUE as an unicode string
+
+    :param value: the value
+    :type value: object
+    :rtype: unicode
+    """
+
+    if isinstance(value, unicode):
+        return value
+
+    if isinstance(value, str):
+        return value.decode(Formatter.ENCODING, 'replace')
+
+    return unicode(value)
+
+
+class Table(object):
+    """Text table, written row by row
+
+    Renders like PrettyTable, but the width of each column is fixed once,
+    either declared upfront or computed from the first rows (the sample
+    window), so that rows are written as soon as they are produced rather than
+    when the table is complete. Cells that turn out to be wider than their
+    column after the sample window are written in full, shifting the end of
+    their row.
+    """
+
+    # Cell alignments
+    LEFT, CENTER, RIGHT = 'l', 'c', 'r'
+
+    # Default number of rows the column widths are computed from
+    SAMPLE_SIZE = 100
+
+    def __init__(self, columns, align=CENTER, widths=None,
+                 sample=SAMPLE_SIZE):
+        """Constructor
+
+        :param columns: the column headers
+        :type columns: list[str]
+        :param align: the alignment of the cells of all columns, or a mapping
+            column header -> alignment (default: Table.CENTER)
+        :type align: str | dict
+        :param widths: column header -> width, for the columns whose width is
+            known upfront
+        :type widths: dict | None
+        :param sample: the number of rows the other widths are computed from
+        :type sample: int
+        """
+
+        widths = widths or {}
+
+        self.columns = [to_unicode(column) for column in columns]
+
+        if isinstance(align, dict):
+            self.align = [align.get(c, Table.CENTER) for c in columns]
+        else:
+            self.align = [align] * len(columns)
+
+        self.widths = [widths.get(c) for c in columns]
+        self.sample = sample
+
+    @staticmethod
+    def justify(text, width, align):
+        """Pad TEXT to WIDTH
+
+        :param text: the text of the cell
+        :type text: unicode
+        :param width: the width of the column
+        :type width: int
+        :param align: the alignment of the cell
+        :type align: str
+        :rtype: unicode
+        """
+
+        excess = max(width - len(text), 0)
+
+        if align == Table.LEFT:
+            return text + u' ' * excess
+
+        if align == Table.RIGHT:
+            return u' ' * excess + text
+
+        # Same rounding as PrettyTable: the extra space goes to the right of
+        # text of odd length, and to the left of text of even length
+        left = excess // 2 + (excess % 2 if len(text) % 2 == 0 else 0)
+        return u' ' * left + text + u' ' * (excess - left)
+
+    def format_row(self, cells, widths):
+        """Return a line of the table
+
+        :param cells: the text of the cells
+        :type cells: list[unicode]
+        :param widths: the width of the columns
+        :type widths: list[int]
+        :rtype: unicode
+        """
+
+        return u'| %s |' % u' | '.join(
+            self.justify(cell, width, align)
+            for cell, width, align in zip(cells, widths, self.align))
+
+    def format(self, rows):
+        """Line generator for the table
+
+        :param rows: the rows of the table
+        :type rows: collections.iterable[list[object]]
+        :yield: unicode
+        """
+
+        rows = ([to_unicode(cell) for cell in row] for row in rows)
+
+        # Only wait for the sample window if some widths are unknown
+        head = []
+
+        if None in self.widths:
+            head = list(itertools.islice(rows, self.sample))
+
+        widths = []
+
+        for idx, column in enumerate(self.columns):
+            width = self.widths[idx]
+
+            if width is None:
+                width = max([len(row[idx]) for row in head] or [0])
+
+            widths.append(max(width, len(column)))
+
+        rule = u'+%s+' % u'+'.join(u'-' * (width + 2) for width in widths)
+
+        yield rule
+        yield self.format_row(self.columns, widths)
+        yield rule
+
+        for row in itertools.chain(head, rows):
+            yield self.format_row(row, widths)
+
+        yield rule
+
+    def write(self, rows, stream=None):
+        """Write the table, row by row
+
+        :param rows: the rows of the table
+        :type rows: collections.iterable[list[object]]
+        :param stream: the stream to write to (default: sys.stdout)
+        :type stream: file | None
+        """
+
+        stream = stream or sys.stdout
+
+        for line in self.format(rows):
+            stream.write(line.encode(Formatter.ENCODING) + os.linesep)
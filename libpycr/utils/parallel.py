@@ -0,0 +1,161 @@
+"""Helpers to run independent requests concurrently"""
+
+import functools
+
+from multiprocessing.pool import ThreadPool
+
+from libpycr.deadline import Deadline
+from libpycr.exceptions import DeadlineExceededError
+from libpycr.utils.system import get_thread_state, set_thread_state
+
+
+# Default maximum number of concurrent calls
+DEFAULT_WORKERS = 8
+
+# Delay, in seconds, between two checks for interruption while waiting for a
+# result (waiting without timeout cannot be interrupted with Ctrl-C)
+POLL_INTERVAL = 0.5
+
+
+def _call(function, catch, item):
+    """Call FUNCTION on ITEM
+
+    :param function: the function to call
+    :type function: callable
+    :param catch: the exception type(s) to return instead of raising
+    :type catch: type | tuple[type]
+    :param item: the argument to call FUNCTION with
+    :type item: object
+    :rtype: object, Exception | None
+    """
+
+    try:
+        return function(item), None
+    except catch as why:
+        return None, why
+
+
+def _expire(catch):
+    """Return the outcome of a call cancelled by the deadline
+
+    :param catch: the exception type(s) to return instead of raising
+    :type catch: type | tuple[type]
+    :rtype: None, DeadlineExceededError
+    :raise: DeadlineExceededError if not an instance of CATCH
+    """
+
+    error = DeadlineExceededError()
+
+    if not isinstance(error, catch):
+        raise error
+
+    return None, error
+
+
+def _call_in_worker(function, catch, state, item):
+    """Call FUNCTION on ITEM from a worker thread
+
+    :param function: the function to call
+    :type function: callable
+    :param catch: the exception type(s) to return instead of raising
+    :type catch: type | tuple[type]
+    :param state: the per-thread state of the calling thread (see
+        libpycr.utils.system.get_thread_state)
+    :type state: dict
+    :param item: the argument to call FUNCTION with
+    :type item: object
+    :rtype: object, Exception | None
+    """
+
+    # Prompts (eg. for a password) must reach the user of the calling thread,
+    # and requests the server of its Gerrit client
+    set_thread_state(state)
+
+    try:
+        return _call(function, catch, item)
+    finally:
+        set_thread_state({})
+
+
+def imap(function, items, workers=DEFAULT_WORKERS, catch=Exception,
+         cancel=None):
+    """Call FUNCTION on each element of ITEMS from a pool of threads
+
+    Yields a tuple (result, error) per element, in the order of ITEMS, as soon
+    as it is available. ERROR is the exception raised by FUNCTION if it is an
+    instance of CATCH, None otherwise; other exceptions are raised again in
+    the calling thread.
+
+    Pending calls are cancelled if the caller stops iterating, or as soon as
+    CANCEL is set, in which case the iteration stops early. They are also
+    cancelled when the deadline of the calling thread passes (see
+    libpycr.deadline): the remaining elements then fail with
+    DeadlineExceededError, and the results received until then are kept.
+
+    :param function: the function to call
+    :type function: callable
+    :param items: the arguments to call FUNCTION with
+    :type items: collections.iterable
+    :param workers: the maximum number of concurrent calls
+    :type workers: int
+    :param catch: the exception type(s) to yield instead of raising
+    :type catch: type | tuple[type]
+    :param cancel: an event to stop on (eg. Pager.closed), if any
+    :type cancel: threading.Event | None
+    :rtype: collections.iterable[(object, Exception | None)]
+    """
+
+    items = list(items)
+    deadline = Deadline.current()
+
+    def cancelled():
+        """Whether CANCEL is set"""
+        return cancel is not None and cancel.is_set()
+
+    def expired():
+        """Whether the deadline has passed"""
+        return deadline is not None and deadline.expired()
+
+    if len(items) <= 1 or workers <= 1:
+        for item in items:
+            if cancelled():
+                return
+
+            yield _expire(catch) if expired() else _call(function, catch,
+                                                         item)
+
+        return
+
+    call = functools.partial(_call_in_worker, function, catch,
+                             get_thread_state())
+    pool = ThreadPool(min(workers, len(items)))
+
+    try:
+        # One result per element: an element cancelled by the deadline does
+        # not hold back the results of the next ones
+        results = [pool.apply_async(call, (item,)) for item in items]
+
+        for result in results:
+            while True:
+                if cancelled():
+                    return
+
+                remaining = (deadline.remaining() if deadline is not None
+                             else None)
+
+                result.wait(POLL_INTERVAL if remaining is None
+                            else min(POLL_INTERVAL, remaining))
+
+                if result.ready():
+                    outcome = result.get()
+                    break
+
+                # Results received before the deadline are still yielded
+                if expired():
+                    outcome = _expire(catch)
+                    break
+
+            yield outcome
+
+    finally:
+        pool.terminate()
@@ -0,0 +1,270 @@
+"""Machine-readable output: entities written as records
+
+With --format json, ndjson, csv or tsv, builtins write the entities they
+fetch as records instead of formatted text. Records are built from the fields
+of the entities (see Info.to_dict) and written one at a time, as soon as they
+are available: the output is neither colorized nor paged, and the memory used
+does not grow with the number of records.
+
+    json      a single array of objects
+    ndjson    one object per line
+    csv, tsv  one row per record, with a header row built from the fields
+              of the first record (nested objects and lists are written as
+              JSON)
+"""
+
+import csv
+import json
+import sys
+
+from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
+
+from libpycr.config import Config
+
+
+# Name of the default, human-readable output format
+TEXT = 'text'
+
+# Available output formats
+FORMATS = (TEXT, 'json', 'ndjson', 'csv', 'tsv')
+
+
+def set_format(name):
+    """Set the output format
+
+    :param name: the name of the format (see FORMATS)
+    :type name: str
+    """
+
+    Config.set('core.format', name)
+
+
+def get_format():
+    """Return the name of the output format
+
+    :rtype: str
+    """
+
+    return Config.get('core.format', TEXT)
+
+
+def is_enabled():
+    """Whether builtins must write records instead of formatted text
+
+    :rtype: bool
+    """
+
+    return get_format() != TEXT
+
+
+def to_serializable(value):
+    """Convert VALUE into a JSON-serializable object
+
+    :param value: an entity (any object with a to_dict method), a collection
+        of entities, or a plain value
+    :type value: object
+    :rtype: object
+    """
+
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+
+    if isinstance(value, dict):
+        return OrderedDict((k, to_serializable(v)) for k, v in value.items())
+
+    if isinstance(value, (list, tuple)):
+        return [to_serializable(v) for v in value]
+
+    return value
+
+
+def merge(*parts):
+    """Build a single record from several parts
+
+    Use to add context to the record of an entity (eg. the account of an
+    email address).
+
+    :param *parts: entities, mappings or sequences of (key, value) pairs
+    :type *parts: list[Info | dict | collections.iterable[(str, object)]]
+    :rtype: OrderedDict
+    """
+
+    record = OrderedDict()
+
+    for part in parts:
+        part = to_serializable(part)
+        record.update(part.items() if isinstance(part, dict) else part)
+
+    return record
+
+
+def get_field_names(record):
+    """Return the names of the fields of RECORD, in order
+
+    Entities of the same type all have the same fields (see
+    Info.get_field_names), even if some of them are not set.
+
+    :param record: the entity or mapping
+    :type record: Info | dict
+    :rtype: list[str]
+    """
+
+    if hasattr(record, 'get_field_names'):
+        return list(record.get_field_names())
+
+    return list(to_serializable(record).keys())
+
+
+class RecordWriter(object):
+    """Write records to a stream, one at a time"""
+
+    __metaclass__ = ABCMeta
+
+    def __init__(self, stream):
+        """Constructor
+
+        :param stream: the stream to write to
+        :type stream: file
+        """
+
+        self.stream = stream
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @abstractmethod
+    def write(self, record):
+        """Write a record
+
+        :param record: the entity or mapping to write
+        :type record: Info | dict
+        """
+        pass
+
+    def close(self):
+        """Terminate the output"""
+
+        self.stream.flush()
+
+
+class NdjsonWriter(RecordWriter):
+    """Write records as JSON objects, one per line"""
+
+    def write(self, record):
+        self.stream.write(json.dumps(to_serializable(record),
+                                     separators=(',', ':')))
+        self.stream.write('\n')
+
+
+class JsonWriter(RecordWriter):
+    """Write records as the elements of a JSON array"""
+
+    def __init__(self, stream):
+        super(JsonWriter, self).__init__(stream)
+        self.count = 0
+
+    def write(self, record):
+        self.stream.write(',\n' if self.count else '[\n')
+        self.stream.write(json.dumps(to_serializable(record)))
+        self.count += 1
+
+    def close(self):
+        self.stream.write('\n]\n' if self.count else '[]\n')
+        super(JsonWriter, self).close()
+
+
+class CsvWriter(RecordWriter):
+    """Write records as rows of delimiter-separated values"""
+
+    def __init__(self, stream, delimiter=','):
+        """Constructor
+
+        :param stream: the stream to write to
+        :type stream: file
+        :param delimiter: the field separator
+        :type delimiter: str
+        """
+
+        super(CsvWriter, self).__init__(stream)
+
+        self.writer = csv.writer(stream, delimiter=delimiter,
+                                 lineterminator='\n')
+        self.header = None
+
+    @staticmethod
+    def encode(value):
+        """Return VALUE as a cell
+
+        :param value: the value
+        :type value: object
+        :rtype: str
+        """
+
+        if value is None:
+            return ''
+
+        if isinstance(value, (dict, list, tuple)):
+            return json.dumps(value)
+
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+
+        return value
+
+    def write(self, record):
+        # Columns are the fields of the first record
+        if self.header is None:
+            self.header = get_field_names(record)
+            self.writer.writerow(self.header)
+
+        record = to_serializable(record)
+
+        self.writer.writerow([self.encode(record.get(key))
+                              for key in self.header])
+
+
+class TsvWriter(CsvWriter):
+    """Write records as rows of tab-separated values"""
+
+    def __init__(self, stream):
+        super(TsvWriter, self).__init__(stream, delimiter='\t')
+
+
+# Output format -> record writer
+WRITERS = {
+    'json': JsonWriter,
+    'ndjson': NdjsonWriter,
+    'csv': CsvWriter,
+    'tsv': TsvWriter,
+}
+
+
+def open_writer(stream=None):
+    """Return a writer for the configured output format
+
+    Use as a context manager to terminate the output on exit.
+
+    :param stream: the stream to write to (default: sys.stdout)
+    :type stream: file | None
+    :rtype: RecordWriter
+    """
+
+    return WRITERS[get_format()](stream or sys.stdout)
+
+
+def write_all(records, stream=None):
+    """Write RECORDS with the configured output format
+
+    :param records: the entities or mappings to write
+    :type records: collections.iterable[Info | dict]
+    :param stream: the stream to write to (default: sys.stdout)
+    :type stream: file | None
+    """
+
+    with open_writer(stream) as writer:
+        for record in records:
+            writer.write(record)
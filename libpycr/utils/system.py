@@ -1,7 +1,142 @@
 """Low level, operating system routines used for file input / output"""
 
+import getpass
 import os
+import re
 import sys
+import tempfile
+import threading
+
+
+# Per-thread state: the console used for user interaction, and the
+# configuration and HTTP sessions of the Gerrit client in use (see
+# libpycr.gerrit.client.GerritClient). Worker threads inherit the state of the
+# thread they work for (see libpycr.utils.parallel).
+_local = threading.local()
+
+
+def get_local(name):
+    """Return the value of the per-thread state entry NAME, if set
+
+    :param name: the name of the entry
+    :type name: str
+    :rtype: object | None
+    """
+
+    return getattr(_local, name, None)
+
+
+def set_local(name, value):
+    """Set the value of the per-thread state entry NAME
+
+    Returns the previous value of the entry, if any.
+
+    :param name: the name of the entry
+    :type name: str
+    :param value: the value of the entry, or None to unset it
+    :type value: object | None
+    :rtype: object | None
+    """
+
+    previous = get_local(name)
+    setattr(_local, name, value)
+
+    return previous
+
+
+def get_thread_state():
+    """Return a copy of the per-thread state of the current thread
+
+    :rtype: dict
+    """
+
+    return dict(vars(_local))
+
+
+def set_thread_state(state):
+    """Replace the per-thread state of the current thread
+
+    :param state: the state, as returned by get_thread_state
+    :type state: dict
+    """
+
+    vars(_local).clear()
+    vars(_local).update(state)
+
+
+def set_console(console):
+    """Set the console to use for user interaction in the current thread
+
+    When set, prompts are delegated to this object instead of the process
+    terminal (see libpycr.daemon.RemoteConsole for the expected interface).
+
+    :param console: the console object, or None to use the process terminal
+    :type console: object | None
+    """
+
+    set_local('console', console)
+
+
+def get_console():
+    """Return the console set for the current thread, if any
+
+    :rtype: object | None
+    """
+
+    return get_local('console')
+
+
+def read_input(prompt):
+    """Read a line of user input
+
+    Like the built-in raw_input(), but honors the console set for the current
+    thread.
+
+    :param prompt: the prompt to display
+    :type prompt: str
+    :rtype: str
+    """
+
+    console = get_console()
+
+    if console is not None:
+        return console.read_input(prompt)
+
+    return raw_input(prompt)
+
+
+def read_password(prompt='Password: '):
+    """Read a password without echoing it
+
+    Like getpass.getpass(), but honors the console set for the current thread.
+
+    :param prompt: the prompt to display
+    :type prompt: str
+    :rtype: str
+    """
+
+    console = get_console()
+
+    if console is not None:
+        return console.read_password(prompt)
+
+    return getpass.getpass(prompt)
+
+
+def read_stdin():
+    """Read the whole standard input
+
+    Like sys.stdin.read(), but honors the console set for the current thread.
+
+    :rtype: str
+    """
+
+    console = get_console()
+
+    if console is not None:
+        return console.read_stdin()
+
+    return sys.stdin.read()
 
 
 def format_message(message, prefix=None, why=None):
@@ -78,7 +213,7 @@ def confirm(question):
     """
 
     print question
-    answer = raw_input("Type 'yes' to confirm, other to cancel: ").lower()
+    answer = read_input("Type 'yes' to confirm, other to cancel: ").lower()
 
     return answer in ('y', 'yes')
 
@@ -96,10 +231,10 @@ def ask(question, choices=None):
     """
 
     if choices is None:
-        return raw_input('%s: ' % question)
+        return read_input('%s: ' % question)
 
     while True:
-        answer = raw_input('%s: ' % question)
+        answer = read_input('%s: ' % question)
 
         if answer in choices:
             break
@@ -110,7 +245,7 @@ def ask(question, choices=None):
     return answer
 
 
-def reverse_find_file(filename, origin=os.getcwd(), ignores=None):
+def reverse_find_file(filename, origin=None, ignores=None, inspected=None):
     """Look for a given filename in the current directory
 
     Try the parent directories until found of file-system root reached.
@@ -118,29 +253,213 @@ def reverse_find_file(filename, origin=os.getcwd(), ignores=None):
 
     :param filename: the file name as a string
     :type filename: str
-    :param origin: the origin directory for the search
+    :param origin: the origin directory for the search. Defaults to the
+        current working directory
     :type origin: str
     :param ignores: an optional list of files to ignore
     :type ignores: collections.iterable[str]
+    :param inspected: an optional list to append the directories looked into
+        to, in order
+    :type inspected: list[str]
     :rtype: str | None
     """
 
-    directory = origin
-    inspected = None
+    directory = os.getcwd() if origin is None else origin
+    previous = None
 
     ignore_list = [] if ignores is None else ignores
 
-    while directory != inspected:
+    while directory != previous:
+        if inspected is not None:
+            inspected.append(directory)
+
         lookup = os.path.join(directory, filename)
 
         if os.path.isfile(lookup) and lookup not in ignore_list:
             break
 
-        inspected = directory
+        previous = directory
         directory = os.path.dirname(directory)
 
-    if directory == inspected:
+    if directory == previous:
         return None
 
     assert lookup is not None, 'internal error'
     return lookup
+
+
+def get_terminal_size(stream=None):
+    """Return the size of the terminal STREAM is attached to
+
+    Falls back to the LINES and COLUMNS environment variables, then to 24x80.
+
+    :param stream: the stream (default: sys.stdout)
+    :type stream: file | None
+    :rtype: int, int
+    """
+
+    stream = stream or sys.stdout
+
+    try:
+        import fcntl
+        import struct
+        import termios
+
+        rows, columns = struct.unpack('hh', fcntl.ioctl(
+            stream.fileno(), termios.TIOCGWINSZ, '1234'))
+
+        if rows > 0 and columns > 0:
+            return rows, columns
+
+    except (AttributeError, ImportError, IOError, ValueError):
+        pass
+
+    try:
+        return (int(os.environ.get('LINES', 24)),
+                int(os.environ.get('COLUMNS', 80)))
+    except ValueError:
+        return 24, 80
+
+
+def get_cache_dir():
+    """Return the directory where to store cached data, creating it if needed
+
+    Honors the XDG_CACHE_HOME environment variable.
+
+    :rtype: str
+    """
+
+    cache_home = (os.environ.get('XDG_CACHE_HOME') or
+                  os.path.join(os.path.expanduser('~'), '.cache'))
+    directory = os.path.join(cache_home, 'pycr')
+
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory, 0700)
+        except OSError:
+            # Created concurrently by another process
+            if not os.path.isdir(directory):
+                raise
+
+    return directory
+
+
+def get_host_cache_path(prefix, host, suffix, username=None):
+    """Return the path to a cache file specific to a server
+
+    :param prefix: the prefix of the file name (eg. reviewers)
+    :type prefix: str
+    :param host: the server's host
+    :type host: str
+    :param suffix: the suffix of the file name (eg. .json)
+    :type suffix: str
+    :param username: the account whose view of the server is cached, if the
+        cached data depends on it
+    :type username: str | None
+    :rtype: str
+    """
+
+    name = host if username is None else '{}-{}'.format(host, username)
+
+    return os.path.join(get_cache_dir(), '{}-{}{}'.format(
+        prefix, re.sub(r'[^\w.-]', '_', name), suffix))
+
+
+def write_atomically(path, dump, mode='w'):
+    """Replace the file at PATH with the content written by DUMP
+
+    The content is written to a temporary file, then renamed over PATH:
+    processes reading PATH concurrently see either the old or the new file.
+
+    :param path: the path to the file
+    :type path: str
+    :param dump: function writing the content to the file object it is given
+    :type dump: callable
+    :param mode: the mode to open the file with
+    :type mode: str
+    :raise: IOError or OSError if the file cannot be written
+    """
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+
+    try:
+        with os.fdopen(fd, mode) as tmp_file:
+            dump(tmp_file)
+
+        os.rename(tmp_path, path)
+
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class ThreadLocalStream(object):
+    """File-like object dispatching writes to a per-thread stream
+
+    Install an instance as sys.stdout (or sys.stderr) to let threads redirect
+    their output independently. Threads without a redirection write to the
+    fallback stream.
+    """
+
+    def __init__(self, fallback):
+        self._fallback = fallback
+        self._local = threading.local()
+
+        # Used by the print statement
+        self.softspace = 0
+
+    def redirect(self, stream):
+        """Redirect the current thread's output to STREAM
+
+        :param stream: the target stream, or None to restore the fallback
+        :type stream: file | None
+        """
+
+        self._local.stream = stream
+
+    def _target(self):
+        """Return the stream to write to in the current thread
+
+        :rtype: file
+        """
+
+        return getattr(self._local, 'stream', None) or self._fallback
+
+    def write(self, data):
+        """Write DATA to the current thread's stream
+
+        :param data: the data to write
+        :type data: str
+        """
+
+        self._target().write(data)
+
+    def writelines(self, lines):
+        """Write LINES to the current thread's stream
+
+        :param lines: the lines to write
+        :type lines: collections.iterable[str]
+        """
+
+        self._target().writelines(lines)
+
+    def flush(self):
+        """Flush the current thread's stream"""
+
+        self._target().flush()
+
+    def isatty(self):
+        """Whether the current thread's stream is a terminal
+
+        :rtype: bool
+        """
+
+        return self._target().isatty()
+
+    def fileno(self):
+        """Return the file descriptor of the current thread's stream
+
+        :rtype: int
+        """
+
+        return self._target().fileno()
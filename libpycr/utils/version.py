@@ -1,6 +1,24 @@
-"""Compute the version number based on libpycr.VERSION"""
+"""Compute the version number based on libpycr.VERSION
 
-from libpycr.utils.git import get_changeset
+The changeset of development versions is written to libpycr._version when the
+package is built (see setup.py), so that installed copies never run git to
+compute their version. Source checkouts fall back to asking git.
+"""
+
+
+def get_build_changeset():
+    """Return the changeset identifier of the development version
+
+    :rtype: str | None
+    """
+
+    try:
+        from libpycr._version import CHANGESET
+    except ImportError:
+        from libpycr.utils.git import get_changeset
+        return get_changeset()
+
+    return CHANGESET
 
 
 def get_version(version=None):
@@ -22,7 +40,7 @@ def get_version(version=None):
     sub = ''
 
     if version[3] == 'alpha' and version[4] == 0:
-        git_changeset = get_changeset()
+        git_changeset = get_build_changeset()
         if git_changeset:
             sub = '.dev%s' % git_changeset
 
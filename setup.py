@@ -3,6 +3,7 @@
 """Gerrit Code Review - Command Line Tools"""
 
 import os
+from distutils.command.build_py import build_py
 from distutils.core import setup
 
 
@@ -15,6 +16,27 @@ if ROOT_DIR != '':
 # Dynamically calculate the version based on libpycr.VERSION
 VERSION = __import__('libpycr').get_version()
 
+
+class BuildPy(build_py):
+    """Write the changeset of the development version into the package
+
+    The tools then resolve their version without running git (see
+    libpycr.utils.version).
+    """
+
+    def run(self):
+        build_py.run(self)
+
+        from libpycr.utils.git import get_changeset
+
+        path = os.path.join(self.build_lib, 'libpycr', '_version.py')
+
+        if not self.dry_run:
+            with open(path, 'w') as version_file:
+                version_file.write('"""Generated by setup.py: do not edit"""'
+                                   '\n\nCHANGESET = %r\n' % get_changeset())
+
+
 # Run the setup tools
 setup(
     name='PyCR',
@@ -26,9 +48,11 @@ setup(
     packages=['libpycr', 'libpycr.builtin', 'libpycr.builtin.changes',
               'libpycr.builtin.accounts', 'libpycr.gerrit',
               'libpycr.gerrit.api', 'libpycr.meta', 'libpycr.utils'],
-    requires=['requests', 'pygments', 'prettytable'],
+    requires=['requests', 'pygments'],
+    cmdclass={'build_py': BuildPy},
     scripts=[
         os.path.join('scripts', 'git-cl'),
-        os.path.join('scripts', 'gerrit-accounts')
+        os.path.join('scripts', 'gerrit-accounts'),
+        os.path.join('scripts', 'pycr-daemon')
     ]
 )